@@ -19,10 +19,7 @@
 
 """aerial namespace definition."""
 
-from pkg_resources import declare_namespace
 from pkgutil import extend_path
 
 # noinspection PyUnboundLocalVariable
-__path__ = extend_path(__path__, __name__)
-
-declare_namespace('aerial')
\ No newline at end of file
+__path__ = extend_path(__path__, __name__)
\ No newline at end of file
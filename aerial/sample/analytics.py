@@ -0,0 +1,267 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Incremental occupancy statistics over the detection stream."""
+
+
+import math
+import time
+from collections import deque
+from threading import Lock
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SlidingWindow:
+    """
+    Sums of values by key over the last length seconds. The window is a ring of length / resolution buckets, each
+    holding the sums of the keys which received values during its time, and the total of every key is kept up to date
+    as values are added and buckets expire. Adding a value takes constant time, and expiring a bucket only touches the
+    keys it holds, so the totals are available at any time without summing anything up. A key is dropped from the
+    totals once no bucket holds it anymore. Time is taken from the values added, and never goes backwards.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, length = 300, resolution = 1.0):
+        self.length = length
+        self.resolution = float(resolution)
+        self.size = int(math.ceil(length / self.resolution))
+        self.buckets = [{} for _ in xrange(self.size)]
+        self.totals = {}
+        self.__holders = {}
+        self.__bucket = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def add(self, key, value, timestamp):
+        """
+        Adds a value for a key at the given time.
+        """
+        self.advance(timestamp)
+        bucket = int(timestamp // self.resolution)
+        if bucket <= self.__bucket - self.size:
+            return
+        sums = self.buckets[bucket % self.size]
+        if key in sums:
+            sums[key] += value
+            self.totals[key] += value
+        else:
+            sums[key] = value
+            self.totals[key] = self.totals.get(key, 0.0) + value
+            self.__holders[key] = self.__holders.get(key, 0) + 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def add_interval(self, key, start, end):
+        """
+        Adds the duration of an interval for a key, split among the buckets the interval spans.
+        """
+        self.advance(end)
+        start = max(start, (self.__bucket - self.size + 1) * self.resolution)
+        while start < end:
+            boundary = min(end, (math.floor(start / self.resolution) + 1) * self.resolution)
+            self.add(key, boundary - start, start)
+            start = boundary
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def advance(self, timestamp):
+        """
+        Moves the window forward to the given time, expiring the buckets which fall out of it.
+        """
+        bucket = int(timestamp // self.resolution)
+        if self.__bucket is None:
+            self.__bucket = bucket
+            return
+        if bucket <= self.__bucket:
+            return
+        for index in xrange(self.__bucket + 1, self.__bucket + 1 + min(bucket - self.__bucket, self.size)):
+            slot = index % self.size
+            sums = self.buckets[slot]
+            if not sums:
+                continue
+            for key, value in sums.iteritems():
+                holders = self.__holders[key] - 1
+                if holders == 0:
+                    del self.__holders[key]
+                    del self.totals[key]
+                else:
+                    self.__holders[key] = holders
+                    self.totals[key] -= value
+            self.buckets[slot] = {}
+        self.__bucket = bucket
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TumblingWindows:
+    """
+    Sums of values by key over consecutive, non-overlapping windows of length seconds, aligned to multiples of the
+    length. The sums of the last history windows are kept once they are complete, the oldest ones being dropped.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, length = 60, history = 60):
+        self.length = length
+        self.completed = deque(maxlen = history)
+        self.start = None
+        self.totals = {}
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def add(self, key, value, timestamp):
+        """
+        Adds a value for a key at the given time.
+        """
+        self.advance(timestamp)
+        if timestamp >= self.start:
+            self.totals[key] = self.totals.get(key, 0) + value
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def add_interval(self, key, start, end):
+        """
+        Adds the duration of an interval for a key, split among the windows the interval spans.
+        """
+        while start < end:
+            boundary = min(end, (math.floor(start / self.length) + 1) * self.length)
+            self.add(key, boundary - start, start)
+            start = boundary
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def advance(self, timestamp):
+        """
+        Completes the current window, and any empty ones after it, once the given time is past its end.
+        """
+        start = math.floor(timestamp / self.length) * self.length
+        if self.start is None:
+            self.start = start
+        skipped = 0
+        while self.start < start and skipped < self.completed.maxlen:
+            self.completed.append((self.start, self.totals))
+            self.start += self.length
+            self.totals = {}
+            skipped += 1
+        self.start = max(self.start, start)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class OccupancyAnalytics:
+    """
+    Computes occupancy statistics incrementally from detection results, to be used as (or called by) the detection
+    listener: The time every profile is present, how long it stays each time it is detected (its dwell time), the
+    transitions between profiles and the number of results. Statistics are kept since the start, over a sliding window
+    of window seconds, and over tumbling windows of tumbling_window seconds, the last history of which are kept.
+    Results are timed by their 'timestamp', if any, or by the time they are received. The time between two results is
+    attributed to the profile detected first, unless it is longer than max_gap seconds, e.g. while the connection is
+    lost, in which case it is not attributed at all and the dwell time of the profile ends with the first result.
+    Updating takes constant time; snapshot() returns the statistics, and may be called from another thread.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, window = 300, resolution = 1.0, tumbling_window = 60, history = 60, max_gap = 10):
+        self.max_gap = max_gap
+        self.sliding = SlidingWindow(window, resolution)
+        self.tumbling = TumblingWindows(tumbling_window, history)
+        self.totals = {}
+        self.profile = None
+        self.since = None
+        self.last_time = None
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def update(self, detection_result):
+        """
+        Takes a detection result into account.
+        :param detection_result: The detection result (dictionary).
+        """
+        profile = detection_result['results']
+        timestamp = detection_result.get('timestamp', None)
+        if timestamp is None:
+            timestamp = time.time()
+        with self.__lock:
+            if self.last_time is not None and timestamp < self.last_time:
+                timestamp = self.last_time
+            if self.profile is not None:
+                connected = timestamp - self.last_time <= self.max_gap
+                if connected:
+                    self.__record_interval(('presence', self.profile), self.last_time, timestamp)
+                if profile != self.profile or not connected:
+                    end = timestamp if connected else self.last_time
+                    self.__record(('dwell', self.profile), end - self.since, end)
+                    self.__record(('stays', self.profile), 1, end)
+                    if profile != self.profile:
+                        self.__record(('transitions', (self.profile, profile)), 1, timestamp)
+                    self.since = timestamp
+            else:
+                self.since = timestamp
+            self.__record(('results', profile), 1, timestamp)
+            self.profile = profile
+            self.last_time = timestamp
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """
+        :return: A dictionary with the current 'profile' and how long it has been present ('dwell'), and the
+                 statistics since the start ('total'), over the sliding window ('window') and over the completed
+                 tumbling windows ('tumbling', a list which is ordered by the 'start' time of the windows). See
+                 summarize() for the statistics.
+        """
+        with self.__lock:
+            return {
+                'time': self.last_time,
+                'profile': self.profile,
+                'dwell': self.last_time - self.since if self.profile is not None else 0,
+                'total': summarize(self.totals),
+                'window': dict(summarize(self.sliding.totals), length = self.sliding.length),
+                'tumbling': [dict(summarize(totals), start = start, length = self.tumbling.length)
+                             for start, totals in self.tumbling.completed]
+            }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __record(self, key, value, timestamp):
+        self.totals[key] = self.totals.get(key, 0) + value
+        self.sliding.add(key, value, timestamp)
+        self.tumbling.add(key, value, timestamp)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __record_interval(self, key, start, end):
+        self.totals[key] = self.totals.get(key, 0) + end - start
+        self.sliding.add_interval(key, start, end)
+        self.tumbling.add_interval(key, start, end)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def summarize(totals):
+    """
+    Turns the sums kept by OccupancyAnalytics into statistics.
+    :return: A dictionary with the seconds every profile was present ('presence') and its share of the time any profile
+             was present ('presence_ratio'), the mean dwell time of every profile ('dwell', only counting the stays
+             which have ended), the number of 'transitions' by source and target profile (a dictionary of
+             dictionaries), and the number of 'results' by profile.
+    """
+    summary = { 'presence': {}, 'presence_ratio': {}, 'dwell': {}, 'transitions': {}, 'results': {} }
+    for (kind, name), value in totals.iteritems():
+        if value <= 1e-9:
+            continue
+        if kind == 'presence':
+            summary['presence'][name] = value
+        elif kind == 'stays':
+            summary['dwell'][name] = totals.get(('dwell', name), 0) / value
+        elif kind == 'transitions':
+            summary['transitions'].setdefault(name[0], {})[name[1]] = int(round(value))
+        elif kind == 'results':
+            summary['results'][name] = int(round(value))
+    present = sum(summary['presence'].values())
+    for name, seconds in summary['presence'].items():
+        summary['presence_ratio'][name] = seconds / present
+    return summary
\ No newline at end of file
@@ -20,14 +20,44 @@
 """Wrapper for aerial REST API and detection websocket."""
 
 
-import json
+import fnmatch
+import random
+import re
+import time
 import urllib
 import signal
+from datetime import timedelta
+from collections import deque
+from Queue import Queue
 from threading import Thread
 
-from tornado import gen, websocket
-from tornado.httpclient import HTTPClient, HTTPError
+from tornado import gen
+from tornado.concurrent import Future, is_future
+from tornado.httpclient import HTTPError
 from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+
+from aerial.sample import codec, detection_stream, profiling
+from aerial.sample.codec import LazyDetectionResult
+from aerial.sample.connection_pool import KeepAliveHTTPClient
+from aerial.sample.detection_stream import DetectionStream
+from aerial.sample.initialization_cache import profiles_fingerprint
+from aerial.sample.profile_cache import ProfileCache
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+PROFILE_URL = re.compile(r'^/profiles/[^/]+') # Profile-specific URLs, reported as a single endpoint in metrics
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def connect_websocket(url):
+    """
+    Opens a web socket connection. tornado's websocket module (along with tornado.web) is imported only once detection
+    is used, since it takes longer to import than everything else the REST methods need.
+    :return: A Future resolving to the connection.
+    """
+    from tornado.websocket import websocket_connect
+    return websocket_connect(url)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -43,155 +73,785 @@ class AerialException(Exception):
 
 
 # ---------------------------------------------------------------------------------------------------------------------
-class ApiWrapper:
+class ReconnectPolicy:
     """
-    This class encapsulates the DevKit API client code and provides convenient methods for interacting with the API.
-    Methods in this class parse the API JSON responses into dictionaries and return them. In case the API returns an
-    errors, it is wrapped inside an AerialException instance and raised. All of the methods in this class will block
-    until a response is received from the API.
+    Opt-in policy for re-establishing a lost detection web socket connection. Attempts are spaced out with an
+    exponential backoff (initial_delay, multiplied by multiplier on every attempt up to max_delay), each delay being
+    randomly shortened by up to the jitter fraction so that many clients do not reconnect in lockstep. The DevKit is
+    re-initialized for the given mode only if the server reports that the detection session has expired (one of the
+    SESSION_EXPIRED_ERRORS error types); without a mode, an expired session ends the detection loop.
     """
 
+    SESSION_EXPIRED_ERRORS = ('session_expired', 'not_initialized')
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, mode = None, max_attempts = 10, initial_delay = 0.5, max_delay = 30, multiplier = 2,
+                 jitter = 0.5):
+        self.mode = mode
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
     # -----------------------------------------------------------------------------------------------------------------
-    def __init__(self, server, port):
+    def delay(self, attempt):
+        """
+        Computes the delay before the specified reconnection attempt.
+        :param attempt: The number of the attempt, starting from 1.
+        :return: The delay in seconds.
+        """
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class AsyncApiWrapper:
+    """
+    Non-blocking counterpart of ApiWrapper, built on tornado's AsyncHTTPClient. Every method returns a Future which
+    resolves to the same value the corresponding ApiWrapper method returns, so many requests can be in flight at
+    once, e.g. by yielding a list of futures from a coroutine. The number of concurrent requests is capped by
+    max_concurrency; further requests wait for a free slot instead of being rejected. Instances are bound to the
+    IOLoop which is current when they are created. Unless an existing AsyncHTTPClient is passed to share it among
+    several instances, requests are sent by a KeepAliveHTTPClient, which reuses connections from the ConnectionPool
+    shared by all instances (see the connection_pool module). If a ProfileCache is given, list_profiles() is served
+    from it whenever possible, and reset(), train() and change_status() write their changes through to it. JSON
+    documents are handled by the codec module; if lazy_results is set, detection results are passed to listeners as
+    LazyDetectionResult instances, which are only decoded once they are looked into. If a ClientMetrics instance is
+    given, request durations and errors, detection messages and listener durations are recorded in it. If an
+    InitializationCache is given, every initialization is stored in it, and initialize() can reuse a detection session
+    initialized by an earlier run.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, server, port, max_concurrency = 10, client = None, profile_cache = None, lazy_results = False,
+                 metrics = None, initialization_cache = None):
         self.server = server
         self.port = port
-        self.client = HTTPClient()
+        self.max_concurrency = max_concurrency
+        self.profile_cache = profile_cache
+        self.lazy_results = lazy_results
+        self.metrics = metrics
+        self.initialization_cache = initialization_cache
+        self.reused_mode = None
+        if client is None:
+            client = KeepAliveHTTPClient(force_instance = True, max_clients = max_concurrency)
+        self.client = client
+        self.__request_slots = Semaphore(max_concurrency)
+        self.__base_url = 'http://{0}:{1}/api'.format(server, port)
         self.__stop_detection = False
+        self.__detection_socket = None
+        self.__detection_wakeup = None
 
     # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
     def list_profiles(self):
         """
-        Retrieves and returns a list of all profiles and their training sets by sending a GET request.
-        :return: A list of dictionaries, each representing a profile and its training sets.
+        Retrieves a list of all profiles and their training sets by sending a GET request, unless the profile cache can
+        serve it.
+        :return: A Future resolving to a list of dictionaries, each representing a profile and its training sets.
         """
-        return self.__http_request('/profiles/')
+        cache = self.profile_cache
+        if cache is None:
+            profiles = yield self.__http_request('/profiles/')
+            raise gen.Return(profiles)
+
+        # Serve a fresh list right away, and revalidate a stale one
+        if cache.fresh():
+            cache.hits += 1
+            raise gen.Return(cache.profiles)
+        response = yield self.__fetch('/profiles/', headers = cache.validators())
+        if response.code == 304:
+            cache.revalidations += 1
+            cache.revalidated()
+            raise gen.Return(cache.profiles)
+
+        # The list has changed (or has never been retrieved), so keep the new one
+        cache.misses += 1
+        profiles = self.__parse(response)
+        cache.store(profiles, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        raise gen.Return(profiles)
 
     # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def stream_profiles(self, callback):
+        """
+        Retrieves all profiles like list_profiles(), but parses the response incrementally as it arrives, passing every
+        profile to the callback as soon as it is complete, so that neither the whole response nor the whole list is
+        kept in memory (unless the profile cache keeps the list).
+        :param callback: The function which is called with every profile (dictionary) as the sole argument. If it
+                         returns a Future, the rest of the response is not read until the Future is resolved.
+        :return: A Future resolving to the number of profiles once all of them have been passed to the callback.
+        """
+        cache = self.profile_cache
+        if cache is not None and cache.fresh():
+            cache.hits += 1
+            for profile in cache.profiles:
+                callback(profile)
+            raise gen.Return(len(cache.profiles))
+
+        # Collect the profiles for the cache, if any, while passing them on, and hold the response back while the
+        # callback asks to
+        profiles = [] if cache is not None else None
+        pending = []
+
+        def __collect(profile):
+            if profiles is not None:
+                profiles.append(profile)
+            result = callback(profile)
+            if is_future(result):
+                pending.append(result)
+
+        def __receive_chunk(chunk):
+            parser.feed(chunk)
+            if pending:
+                futures = list(pending)
+                del pending[:]
+                return gen.multi(futures)
+
+        parser = codec.ArrayStreamParser(__collect)
+        response = yield self.__fetch('/profiles/', headers = cache.validators() if cache is not None else None,
+                                      streaming_callback = __receive_chunk)
+        if response.code == 304:
+            cache.revalidations += 1
+            cache.revalidated()
+            for profile in cache.profiles:
+                callback(profile)
+            raise gen.Return(len(cache.profiles))
+        parser.close()
+        if not parser.finished():
+            raise AerialException('malformed_response', 'An unexpected response has been received from the server.')
+        if cache is not None:
+            cache.misses += 1
+            cache.store(profiles, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        raise gen.Return(parser.count)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
     def reset(self):
         """
         Sends a DELETE request to the API to reset all the profiles.
+        :return: A Future which is resolved once the profiles are reset.
         """
-        self.__http_request('/profiles/', method = 'DELETE')
+        yield self.__http_request('/profiles/', method = 'DELETE')
+        if self.profile_cache is not None:
+            self.profile_cache.reset()
 
     # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
     def train(self, profile_name):
         """
         Sends a long-running POST request to the API to add a training set for the specified profile.
         :param profile_name: The name of the profile for which a new training set should be recorded.
-        :return: A dictionary representing the newly added training set.
+        :return: A Future resolving to a dictionary representing the newly added training set.
         """
-        return self.__http_request('/profiles/{0}/training-sets/'.format(profile_name),
-                                   method ='POST', body = None, request_timeout = 60)
+        training_set = yield self.__http_request('/profiles/{0}/training-sets/'.format(profile_name),
+                                                 method ='POST', body = None, request_timeout = 60)
+        if self.profile_cache is not None:
+            if training_set is not None:
+                self.profile_cache.add_training_set(profile_name, training_set)
+            else:
+                self.profile_cache.invalidate()
+        raise gen.Return(training_set)
 
     # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
     def change_status(self, profile_name, enabled):
         """
         Changes the enabled status of the specified profile.
         :param profile_name: The name of the profile to be enabled / disabled.
         :param enabled: A boolean indicating the desired enabled status of the profile.
+        :return: A Future which is resolved once the status is changed.
         """
         modifications = { 'enabled': enabled }
-        return self.__http_request('/profiles/{0}'.format(profile_name),
-                                   method = 'PUT', body = json.dumps(modifications))
+        result = yield self.__http_request('/profiles/{0}'.format(profile_name),
+                                           method = 'PUT', body = codec.dumps(modifications))
+        if self.profile_cache is not None:
+            self.profile_cache.change_status(profile_name, enabled)
+        raise gen.Return(result)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def change_status_bulk(self, profile_names, enabled):
+        """
+        Changes the enabled status of several profiles, sending the requests concurrently (up to max_concurrency at a
+        time). A failure to change one profile does not affect the others.
+        :param profile_names: The names of the profiles to be enabled / disabled.
+        :param enabled: A boolean indicating the desired enabled status of the profiles.
+        :return: A Future resolving to a dictionary which maps every profile name either to the response of its request
+                 or to the exception raised by it.
+        """
+
+        @gen.coroutine
+        def __change_status(profile_name):
+            try:
+                result = yield self.change_status(profile_name, enabled)
+            except Exception as error:
+                result = error
+            raise gen.Return(result)
+
+        results = yield [__change_status(profile_name) for profile_name in profile_names]
+        raise gen.Return(dict(zip(profile_names, results)))
 
     # -----------------------------------------------------------------------------------------------------------------
-    def initialize(self, mode):
-        return self.__http_request('/initialization/{}'.format(mode),
-                                   method = 'POST', body = None, request_timeout = 300)
+    @gen.coroutine
+    def match_profiles(self, patterns):
+        """
+        Expands glob patterns (e.g. 'kitchen-*') into the names of the existing profiles they match. Patterns without
+        wildcards are taken as names as they are, so that no request is needed if there are only such patterns.
+        :param patterns: The list of profile names and / or glob patterns.
+        :return: A Future resolving to the list of profile names, without duplicates and in the order of the patterns.
+        """
+        names = []
+        existing_names = None
+        for pattern in patterns:
+            if any(wildcard in pattern for wildcard in '*?['):
+                if existing_names is None:
+                    profiles = yield self.list_profiles()
+                    existing_names = [profile['name'] for profile in profiles]
+                matches = fnmatch.filter(existing_names, pattern)
+            else:
+                matches = [pattern]
+            names.extend(name for name in matches if name not in names)
+        raise gen.Return(names)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def initialize(self, mode, reuse = False):
+        """
+        Initializes the DevKit for the specified detection mode by sending a long-running POST request. With an
+        initialization cache, the profiles are retrieved to compute their fingerprint only if there is a cached result
+        to be compared with, or a fresh result to be stored (see InitializationCache).
+        :param mode: A string with the value of 'home' or 'room'.
+        :param reuse: (Optional) Whether an unexpired initialization of the same mode and profiles, found in the
+                      initialization cache, is to be returned instead of initializing again. The reused_mode attribute
+                      is set to the mode if it is, so that detect() re-initializes if the session turns out to be gone.
+        :return: A Future resolving to the initialization result.
+        """
+        self.reused_mode = None
+        if self.initialization_cache is None:
+            result = yield self.__http_request('/initialization/{}'.format(mode),
+                                               method = 'POST', body = None, request_timeout = 300)
+            raise gen.Return(result)
+
+        # Reuse the cached result if the profiles have not changed since
+        cache = self.initialization_cache
+        if reuse:
+            entry = cache.get(self.server, mode)
+            if entry is not None and entry['fingerprint'] == profiles_fingerprint((yield self.list_profiles())):
+                cache.hits += 1
+                self.reused_mode = mode
+                raise gen.Return(entry['result'])
+            cache.misses += 1
+
+        # Initialize again, and cache the result if it expires
+        result = yield self.__http_request('/initialization/{}'.format(mode),
+                                           method = 'POST', body = None, request_timeout = 300)
+        if cache.cacheable(result):
+            cache.store(self.server, mode, profiles_fingerprint((yield self.list_profiles())), result)
+        else:
+            cache.invalidate(self.server)
+        raise gen.Return(result)
 
     # -----------------------------------------------------------------------------------------------------------------
-    def detect(self, listener):
+    @gen.coroutine
+    def detect(self, listener, reconnect_policy = None, event_listener = None, shutdown_on_loss = True):
         """
-        Initializes the DevKit for detection by sending a POST request and establishes the web socket connection,
-        waiting for detection results to be received from the server and passing them to a specified callback function.
+        Establishes the web socket connection, waiting for detection results to be received from the server and passing
+        them to a specified callback function as soon as they arrive. The returned Future is resolved once the loop is
+        stopped.
         :param listener: The callback function which is called with the detection result as the sole argument every
-        time it is received from the DevKit.
-        :return: The thread on which the web socket loop is run. The thread is not supposed to be explicitly stopped,
-        but only joined to make sure the detection loop is stopped. See the stop() method.
+        time it is received from the DevKit. If it returns a Future, e.g. DetectionDispatcher.put() when its queue is
+        full, the next message is not read until the Future is resolved.
+        :param reconnect_policy: (Optional) A ReconnectPolicy instance. If given, a lost connection is re-established
+                                 according to it; otherwise, or once the policy gives up, SIGALRM is sent to shutdown.
+        :param event_listener: (Optional) The callback function which is called with a dictionary describing every
+                               connection event: 'disconnected', 'reconnecting' (with the 'attempt' number and the
+                               'delay' before it), 'reinitialized', 'reconnected' (with the 'gap' in seconds during
+                               which no results could be received) and 'gave_up'.
+        :param shutdown_on_loss: (Optional) Whether SIGALRM is sent to shutdown once the connection is lost for good.
+                                 Otherwise, the returned Future fails with a 'connection_lost' AerialException, leaving
+                                 it to the caller to handle the loss.
         """
 
-        # Define the co-routine to be synchronously run on the event loop.
-        @gen.coroutine
-        def __connect():
-
-            # Form the websocket URL and connect to it
-            url = 'ws://{0}:{1}/api/detection'.format(self.server, self.port)
-            socket = yield websocket.websocket_connect(url)
-
-            # The loop which waits for a response (a web socket message), a stop signal, or a break in the connection
-            while not self.__stop_detection:
-                # Obtain a potential message (a "future") from the server and wait for something to happen
-                message_future = socket.read_message()
-                while True:
-                    # If the socket is unexpectedly closed, send an alarm to shutdown
-                    if message_future.done() and message_future.result() is None :
-                        self.__stop_detection = True
-                        print '\nConnection with aerial Devkit lost.\n'
-                        signal.alarm(1) # send SIGALRM to shutdown via our signal handler;
-                        break;
-                    # If a stop signal is received, simply break out
-                    if self.__stop_detection :
-                        break
-                    # If a response is received, parse it and call the callback function
-                    elif message_future.done():
-                        detection_result = json.loads(message_future.result())
-                        listener(detection_result)
-                        break
-                    # Otherwise, check again in half a second
-                    yield gen.sleep(0.5)
-
-            # After the loop is finished, close the socket.
-            if socket is not None:
-                socket.close()
+        # Form the websocket URL and connect to it, initializing again if a reused initialization has expired early
+        url = 'ws://{0}:{1}/api/detection'.format(self.server, self.port)
+        try:
+            socket = yield connect_websocket(url)
+        except HTTPError as error:
+            error_type = self.__aerial_error_type(error.response.body if error.response is not None else None)
+            if self.reused_mode is None or error_type not in ReconnectPolicy.SESSION_EXPIRED_ERRORS:
+                raise
+            mode = self.reused_mode
+            self.initialization_cache.invalidate(self.server)
+            yield self.initialize(mode)
+            self.__emit(event_listener, 'reinitialized', mode = mode)
+            socket = yield connect_websocket(url)
 
-        # Create the thread to run the event loop, start it, and return it
-        loop_thread = Thread(target = lambda: IOLoop.current().run_sync(__connect))
-        loop_thread.start()
-        return loop_thread
+        while socket is not None:
+            # Receive results until the connection is either stopped or lost
+            self.__detection_socket = socket
+            yield self.__receive(socket, listener)
+            self.__detection_socket = None
+            socket.close()
+            if self.__stop_detection:
+                break
+
+            # Try to re-establish a lost connection, if enabled
+            if reconnect_policy is not None:
+                socket = yield self.__reconnect(url, reconnect_policy, self.__close_error(socket), event_listener)
+            else:
+                socket = None
+
+            # If the socket is unexpectedly closed for good, send an alarm to shutdown, or let the caller handle it
+            if socket is None and not self.__stop_detection:
+                if not shutdown_on_loss:
+                    raise AerialException('connection_lost', 'Connection with aerial Devkit lost.')
+                print '\nConnection with aerial Devkit lost.\n'
+                signal.alarm(1) # send SIGALRM to shutdown via our signal handler;
+
+        # After the loop is finished, get ready for the next run.
+        self.__stop_detection = False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __receive(self, socket, listener):
+        """
+        The loop which waits for a response (a web socket message), a stop signal, or a break in the connection. A stop
+        signal closes the socket, which resolves the pending read with None right away. While profiling, the time spent
+        waiting for messages, decoding them and in the listener is timed as the 'receive', 'decode' and 'listener'
+        spans.
+        """
+        metrics = self.metrics
+        received_time = None
+        while not self.__stop_detection:
+            span = profiling.start_span()
+            message = yield socket.read_message()
+            profiling.end_span('receive', span)
+            if message is None:
+                break
+            if metrics is not None:
+                received_time, previous_time = time.time(), received_time
+                metrics.message(self.server, len(message), received_time, previous_time)
+            # If a response is received, parse it and call the callback function, waiting for it if it asks to
+            if self.lazy_results:
+                detection_result = LazyDetectionResult(message)
+            else:
+                span = profiling.start_span()
+                detection_result = codec.loads(message)
+                profiling.end_span('decode', span)
+            span = profiling.start_span()
+            pending = listener(detection_result)
+            if is_future(pending):
+                yield pending
+            profiling.end_span('listener', span)
+            if metrics is not None:
+                metrics.listener(self.server, time.time() - received_time)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __reconnect(self, url, reconnect_policy, error_type, event_listener):
+        """
+        Tries to re-establish a lost detection connection according to the reconnect policy, re-initializing the DevKit
+        first whenever the server reports that the detection session has expired.
+        :param error_type: The type of the aerial error the connection was closed with, if any.
+        :return: A Future resolving to the new web socket, or None if the policy gave up or a stop signal is received.
+        """
+        lost_time = time.time()
+        self.__emit(event_listener, 'disconnected', error = error_type)
+        attempt = 0
+        while reconnect_policy.max_attempts is None or attempt < reconnect_policy.max_attempts:
+
+            # Wait for the backoff delay, unless a stop signal is received in the meantime
+            attempt += 1
+            delay = reconnect_policy.delay(attempt)
+            self.__emit(event_listener, 'reconnecting', attempt = attempt, delay = delay)
+            self.__detection_wakeup = Future()
+            try:
+                yield gen.with_timeout(timedelta(seconds = delay), self.__detection_wakeup)
+            except gen.TimeoutError:
+                pass
+            self.__detection_wakeup = None
+            if self.__stop_detection:
+                raise gen.Return(None)
+
+            # Re-initialize only if the session has expired
+            if error_type in ReconnectPolicy.SESSION_EXPIRED_ERRORS:
+                if reconnect_policy.mode is None:
+                    break
+                try:
+                    yield self.initialize(reconnect_policy.mode)
+                except Exception as error:
+                    error_type = getattr(error, 'type', None)
+                    continue
+                self.__emit(event_listener, 'reinitialized', mode = reconnect_policy.mode)
+
+            # Try to connect, keeping the error type of a failed handshake to find out whether the session has expired
+            try:
+                socket = yield connect_websocket(url)
+            except HTTPError as error:
+                error_type = self.__aerial_error_type(error.response.body if error.response is not None else None)
+                continue
+            except Exception:
+                error_type = None
+                continue
+            self.__emit(event_listener, 'reconnected', attempt = attempt, gap = time.time() - lost_time)
+            raise gen.Return(socket)
+
+        self.__emit(event_listener, 'gave_up', attempts = attempt)
+        raise gen.Return(None)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __emit(self, event_listener, event, **details):
+        """
+        Passes a connection event, described by a dictionary, to the event listener if there is any.
+        """
+        if event_listener is not None:
+            details['event'] = event
+            details['server'] = self.server
+            event_listener(details)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __close_error(self, socket):
+        """
+        Extracts the type of the aerial error a web socket was closed with, which the server sends as the close reason.
+        """
+        return self.__aerial_error_type(getattr(socket, 'close_reason', None))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __aerial_error_type(self, document):
+        """
+        Returns the type of the standard aerial API error contained in a JSON document, or None if there is none.
+        """
+        try:
+            return codec.loads(document)['error']['type']
+        except Exception:
+            return None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stream_detections(self, batch_size = None, batch_interval = None):
+        """
+        Starts the detection loop and returns a DetectionStream through which its results can be pulled one by one or
+        in batches. Must be called on the IOLoop the detection loop is to be run on.
+        :param batch_size: (Optional) The maximum number of results in a batch.
+        :param batch_interval: (Optional) The maximum number of seconds a batch is kept open after its first result.
+        :return: The DetectionStream instance. Closing it stops the detection loop.
+        """
+        stream = DetectionStream(self, batch_size, batch_interval)
+        IOLoop.current().add_future(self.detect(stream.put), stream.finish)
+        return stream
 
     # -----------------------------------------------------------------------------------------------------------------
     def stop(self):
         """
-        If the detection loop is already started, sends it a stop signal. This method returns immediately, typically
-        before the loop is actually stopped.
+        If the detection loop is already started, sends it a stop signal by closing the web socket, which wakes the loop
+        up immediately. This method returns immediately, typically before the loop is actually stopped, and must be
+        called on the IOLoop the detection loop is running on.
         """
         self.__stop_detection = True
+        if self.__detection_socket is not None:
+            self.__detection_socket.close()
+        if self.__detection_wakeup is not None and not self.__detection_wakeup.done():
+            self.__detection_wakeup.set_result(None)
 
     # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
     def __http_request(self, url, method = 'GET', body = None, request_timeout = 30):
         """
         Sends an HTTP request, while parsing JSON responses into dictionaries and wrapping aerial API errors in
         AerialException instances.
-        :return: The parsed response.
+        :return: A Future resolving to the parsed response.
+        """
+        response = yield self.__fetch(url, method, body, request_timeout)
+        raise gen.Return(self.__parse(response))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __fetch(self, url, method = 'GET', body = None, request_timeout = 30, headers = None,
+                streaming_callback = None):
+        """
+        Sends an HTTP request, wrapping aerial API errors in AerialException instances. A '304 Not Modified' response
+        to a conditional request is returned rather than raised. Waits for a free request slot if max_concurrency
+        requests are already in flight. If a streaming_callback is given, the body of a successful response is passed
+        to it in chunks as they arrive, instead of being kept in the response.
+        :return: A Future resolving to the HTTP response.
         """
 
         # Encode and prepare the request URL
+        endpoint = PROFILE_URL.sub('/profiles/{name}', url)
         url = urllib.quote(url)
-        full_url = 'http://{0}:{1}/api{2}'.format(self.server, self.port, url)
+        full_url = self.__base_url + url
 
         # Fix missing 'body' in POST and PUT requests
         if method in ['POST', 'PUT'] and body is None:
             body = ''
 
-        # Try to send the request
+        # Try to send the request once a slot is available
+        with (yield self.__request_slots.acquire()):
+            start_time = time.time()
+            span = profiling.start_span()
+            try:
+                response = yield self.client.fetch(full_url, method = method, body = body, headers = headers,
+                                                   request_timeout = request_timeout,
+                                                   streaming_callback = streaming_callback)
+            except HTTPError as error:
+                profiling.end_span('http_request', span)
+                if error.code == 304 and error.response is not None:
+                    self.__record_request(method, endpoint, start_time)
+                    raise gen.Return(error.response)
+                # In case the response indicates an error, try to transform it into an AerialException instance.
+                # Fails if the error response is not a standard aerial API error.
+                try:
+                    aerial_error = codec.loads(error.response.body)['error']
+                    error = AerialException(aerial_error['type'], aerial_error['message'])
+                finally:
+                    # Nevertheless, wrapped or not, raise the HTTP error.
+                    self.__record_request(method, endpoint, start_time, error)
+                    raise error
+            except Exception as error:
+                profiling.end_span('http_request', span)
+                self.__record_request(method, endpoint, start_time, error)
+                raise
+            profiling.end_span('http_request', span)
+        self.__record_request(method, endpoint, start_time)
+        raise gen.Return(response)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __record_request(self, method, endpoint, start_time, error = None):
+        """
+        Records the duration of a request, and its error if it has failed, if metrics are enabled.
+        """
+        if self.metrics is None:
+            return
+        if error is None:
+            error_type = None
+        elif isinstance(error, AerialException):
+            error_type = error.type
+        elif isinstance(error, HTTPError):
+            error_type = 'http_{0}'.format(error.code)
+        else:
+            error_type = error.__class__.__name__
+        self.metrics.request(self.server, method, endpoint, time.time() - start_time, error_type)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __parse(self, response):
+        """
+        Parses the JSON body of a successful HTTP response.
+        :return: The parsed body, or None if the body is empty.
+        """
+        if response.body is not None and response.body != '':
+            try:
+                return codec.loads(response.body)
+            except ValueError:
+                # If the response is not a JSON document, something unexpected has happened. Raise an appropriate
+                # exception.
+                raise AerialException('malformed_response',
+                                      'An unexpected response has been received from the server.')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ApiWrapper:
+    """
+    This class encapsulates the DevKit API client code and provides convenient methods for interacting with the API.
+    Methods in this class parse the API JSON responses into dictionaries and return them. In case the API returns an
+    errors, it is wrapped inside an AerialException instance and raised. All of the methods in this class will block
+    until a response is received from the API.
+    It is a thin blocking facade over AsyncApiWrapper (available as the async_wrapper attribute), whose coroutines are
+    run to completion on a private IOLoop. Like tornado's HTTPClient, an instance must not be used from several threads
+    at the same time. If profile_cache_ttl is given, profile lists are cached and revalidated through a ProfileCache
+    (available as the profile_cache attribute, e.g. to read its statistics) which is considered fresh for that many
+    seconds. See AsyncApiWrapper for lazy_results, metrics and initialization_cache.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, server, port, max_concurrency = 10, profile_cache_ttl = None, lazy_results = False,
+                 metrics = None, initialization_cache = None):
+        self.server = server
+        self.port = port
+        self.io_loop = IOLoop(make_current = False)
+        self.detection_loop = None
+        self.profile_cache = ProfileCache(profile_cache_ttl) if profile_cache_ttl is not None else None
+        # Create the asynchronous wrapper while the private IOLoop is current, so that its HTTP client is bound to it.
+        self.async_wrapper = self.io_loop.run_sync(
+            gen.coroutine(lambda: AsyncApiWrapper(server, port, max_concurrency, profile_cache = self.profile_cache,
+                                                  lazy_results = lazy_results, metrics = metrics,
+                                                  initialization_cache = initialization_cache)))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the underlying HTTP client and the private IOLoop. The instance cannot be used afterwards.
+        """
+        self.async_wrapper.client.close()
+        self.io_loop.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def list_profiles(self):
+        """
+        Retrieves and returns a list of all profiles and their training sets by sending a GET request.
+        :return: A list of dictionaries, each representing a profile and its training sets.
+        """
+        return self.io_loop.run_sync(self.async_wrapper.list_profiles)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stream_profiles(self):
+        """
+        Retrieves all profiles, yielding every one of them as soon as it has been received and parsed. The private
+        IOLoop is only run until the next profiles arrive, and the rest of the response is not read until they are
+        consumed, so the profiles are neither buffered nor handed over to another thread. See
+        AsyncApiWrapper.stream_profiles().
+        """
+        profiles = deque()
+        request = []
+        arrival = [None]
+        consumed = [Future()]
+
+        def __wake_up(*args):
+            if arrival[0] is not None and not arrival[0].done():
+                arrival[0].set_result(None)
+
+        def __collect(profile):
+            profiles.append(profile)
+            __wake_up()
+            return consumed[0]
+
+        def __resume():
+            # Futures are resolved while the IOLoop is current, as their callbacks are scheduled on the current one
+            resumed, consumed[0] = consumed[0], Future()
+            resumed.set_result(None)
+            return arrival[0]
+
+        def __start():
+            request.append(self.async_wrapper.stream_profiles(__collect))
+            request[0].add_done_callback(__wake_up)
+
+        # The request is started once the IOLoop runs, and kept going whenever it is run again
+        self.io_loop.add_callback(__start)
+        while True:
+            while profiles:
+                yield profiles.popleft()
+            if request and request[0].done():
+                request[0].result()
+                return
+            arrival[0] = Future()
+            self.io_loop.run_sync(__resume)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def reset(self):
+        """
+        Sends a DELETE request to the API to reset all the profiles.
+        """
+        self.io_loop.run_sync(self.async_wrapper.reset)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def train(self, profile_name):
+        """
+        Sends a long-running POST request to the API to add a training set for the specified profile.
+        :param profile_name: The name of the profile for which a new training set should be recorded.
+        :return: A dictionary representing the newly added training set.
+        """
+        return self.io_loop.run_sync(lambda: self.async_wrapper.train(profile_name))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def change_status(self, profile_name, enabled):
+        """
+        Changes the enabled status of the specified profile.
+        :param profile_name: The name of the profile to be enabled / disabled.
+        :param enabled: A boolean indicating the desired enabled status of the profile.
+        """
+        return self.io_loop.run_sync(lambda: self.async_wrapper.change_status(profile_name, enabled))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def change_status_bulk(self, profile_names, enabled):
+        """
+        Changes the enabled status of several profiles, sending the requests concurrently.
+        :param profile_names: The names of the profiles to be enabled / disabled.
+        :param enabled: A boolean indicating the desired enabled status of the profiles.
+        :return: A dictionary which maps every profile name either to the response of its request or to the exception
+                 raised by it.
+        """
+        return self.io_loop.run_sync(lambda: self.async_wrapper.change_status_bulk(profile_names, enabled))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def match_profiles(self, patterns):
+        """
+        Expands glob patterns into the names of the existing profiles they match. See AsyncApiWrapper.match_profiles().
+        :param patterns: The list of profile names and / or glob patterns.
+        :return: The list of profile names.
+        """
+        return self.io_loop.run_sync(lambda: self.async_wrapper.match_profiles(patterns))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, mode, reuse = False):
+        return self.io_loop.run_sync(lambda: self.async_wrapper.initialize(mode, reuse))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def detect(self, listener, reconnect_policy = None, event_listener = None):
+        """
+        Establishes the web socket connection, waiting for detection results to be received from the server and passing
+        them to a specified callback function.
+        :param listener: The callback function which is called with the detection result as the sole argument every
+        time it is received from the DevKit.
+        :param reconnect_policy: (Optional) A ReconnectPolicy instance. See AsyncApiWrapper.detect().
+        :param event_listener: (Optional) The callback function for connection events. See AsyncApiWrapper.detect().
+        :return: The thread on which the web socket loop is run. The thread is not supposed to be explicitly stopped,
+        but only joined to make sure the detection loop is stopped. See the stop() method.
+        """
+        return self.__start_detection(lambda: self.async_wrapper.detect(listener, reconnect_policy, event_listener))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stream_detections(self, batch_size = None, batch_interval = None):
+        """
+        Runs the detection loop in the background and yields its results as they arrive, either one by one or, if
+        batch_size and / or batch_interval are given, as lists which are complete once batch_size results are collected
+        or batch_interval seconds have passed since their first result. Closing the generator stops the detection loop.
+        :param batch_size: (Optional) The maximum number of results in a batch.
+        :param batch_interval: (Optional) The maximum number of seconds a batch is kept open after its first result.
+        """
+        result_queue = Queue()
+        loop_thread = self.__start_detection(lambda: self.async_wrapper.detect(result_queue.put),
+                                             on_finish = lambda: result_queue.put(detection_stream.END_OF_STREAM))
         try:
-            response = self.client.fetch(full_url, method = method, body = body, request_timeout = request_timeout)
-        except HTTPError as error:
-            # In case the response indicates an error, try to transform it into an AerialException instance. Fails if
-            # the error response is not a standard aerial API error.
+            for item in detection_stream.iterate(result_queue, batch_size, batch_interval):
+                yield item
+        finally:
+            self.stop()
+            loop_thread.join()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __start_detection(self, detection, on_finish = None):
+        """
+        Runs the detection loop of the asynchronous wrapper on a new thread with its own IOLoop.
+        :param detection: The function starting the detection coroutine.
+        :param on_finish: (Optional) A function to be called on the detection thread once the loop is finished.
+        :return: The started thread.
+        """
+
+        # Create the event loop for the detection thread up front, so that stop() can reach it right away.
+        detection_loop = IOLoop(make_current = False)
+        self.detection_loop = detection_loop
+
+        def __run():
+            detection_loop.make_current()
             try:
-                aerial_error = json.loads(error.response.body)['error']
-                error = AerialException(aerial_error['type'], aerial_error['message'])
+                detection_loop.run_sync(detection)
             finally:
-                # Nevertheless, wrapped or not, raise the HTTP error.
-                raise error
+                detection_loop.close()
+                if on_finish is not None:
+                    on_finish()
+
+        # Create the thread to run the event loop, start it, and return it
+        loop_thread = Thread(target = __run)
+        loop_thread.start()
+        return loop_thread
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        If the detection loop is already started, sends it a stop signal, which wakes it up immediately. This method
+        returns immediately, typically before the loop is actually stopped, and may be called from any thread.
+        """
+        if self.detection_loop is not None:
+            self.detection_loop.add_callback(self.async_wrapper.stop)
         else:
-            # If everything went smoothly, try to parse the JSON response and return the result.
-            if response.body is not None and response.body != '':
-                try:
-                    return json.loads(response.body)
-                except ValueError:
-                    # If the response is not a JSON document, something unexpected has happened. Raise an appropriate
-                    # exception.
-                    raise AerialException('malformed_response',
-                                          'An unexpected response has been received from the server.')
+            self.async_wrapper.stop()
\ No newline at end of file
@@ -23,10 +23,10 @@
 import signal
 import socket
 
-from concurrent.futures import ThreadPoolExecutor
-
+# The modules of the features (detection, daemon, fleet, recording, sinks, analytics and training) are imported by the
+# methods using them, so that the commands which do not use them, e.g. listing the profiles, start faster.
 from aerial.sample import utils
-from aerial.sample.api_wrapper import ApiWrapper, AerialException
+from aerial.sample.api_wrapper import ApiWrapper, AerialException, ReconnectPolicy
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -44,6 +44,16 @@ def handle_api_errors(function):
     return wrapper
 
 
+# ---------------------------------------------------------------------------------------------------------------------
+def wait_for_shutdown():
+    """
+    Gives the control to the signal handler, which shuts the application down once a keyboard interrupt or a
+    termination signal is received. Waits again after any other handled signal (e.g. SIGUSR1 toggling profiling).
+    """
+    while True:
+        signal.pause()
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 class Application:
     """
@@ -53,19 +63,37 @@ class Application:
     """
 
     # -----------------------------------------------------------------------------------------------------------------
-    def __init__(self, server, port):
-        self.api_wrapper = ApiWrapper(server, port)
-        self.executor = ThreadPoolExecutor(max_workers = 2)
+    def __init__(self, server, port, metrics_port = None):
+        self.port = port
+        self.metrics = None
+        self.metrics_server = None
+        if metrics_port is not None:
+            # The metrics module imports tornado's web framework, so it is only imported if metrics are enabled
+            from aerial.sample.metrics import ClientMetrics, MetricsServer
+            self.metrics = ClientMetrics()
+            self.metrics_server = MetricsServer(self.metrics.registry)
+            self.metrics_server.start(metrics_port)
+        from aerial.sample.initialization_cache import InitializationCache
+        self.initialization_cache = InitializationCache()
+        self.api_wrapper = ApiWrapper(server, port, lazy_results = True, metrics = self.metrics,
+                                      initialization_cache = self.initialization_cache)
         self.detection_thread = None
+        self.fleet = None
+        self.dispatcher = None
+        self.recorder = None
+        self.sinks = None
+        self.analytics = None
+        self.daemon = None
+        self.daemon_client = None
 
     # -----------------------------------------------------------------------------------------------------------------
     @handle_api_errors
     def list_profiles(self):
         """
-        Retrieves and pretty-prints a list of all profiles with their training sets.
+        Retrieves and pretty-prints a list of all profiles with their training sets, printing every profile as soon as
+        it has been received.
         """
-        result = self.api_wrapper.list_profiles()
-        for p in result:
+        for p in self.api_wrapper.stream_profiles():
             utils.print_profile(p)
 
     # -----------------------------------------------------------------------------------------------------------------
@@ -79,54 +107,74 @@ class Application:
 
     # -----------------------------------------------------------------------------------------------------------------
     @handle_api_errors
-    def train(self, profile_name):
+    def train(self, trainings, switch_delay = 0):
         """
-        Creates a training set for the specified profile. Shows a timer and interacts with the server in the
-        background. Once the recording is finished and the training set is successfully added to the profile, its date
-        is printed in the console.
-        :param profile_name: The name of the profile for which the training set is to be recorded.
+        Creates training sets for the specified profiles, recording them back to back (see TrainingScheduler). Shows a
+        timer while interacting with the server, and prints the date of every training set successfully added to its
+        profile as soon as it is added. Once all of them are finished, the time each session took is printed.
+        :param trainings: A list of tuples of a profile name and the number of training sets to be recorded for it.
+        :param switch_delay: (Optional) The number of seconds to count down before every recording for a different
+                             profile than the one before. By default, recordings follow each other with no delay.
         """
-        utils.print_delay(5)
-        task = self.executor.submit(self.api_wrapper.train, profile_name)
-        utils.print_timer(45, task)
-        if task.result() is not None:
-            date = task.result()['date']
-            print 'Training set added for profile "{0}" [{1}].'.format(profile_name, utils.format_datetime(date))
+        from aerial.sample.training import TrainingScheduler
+        scheduler = TrainingScheduler(self.api_wrapper.async_wrapper, trainings, switch_delay = switch_delay,
+                                      listener = utils.print_training_event)
+        sessions = self.api_wrapper.io_loop.run_sync(scheduler.run)
+        utils.print_training_summary(sessions)
 
     # -----------------------------------------------------------------------------------------------------------------
     @handle_api_errors
-    def enable(self, profile_name):
+    def enable(self, profile_names):
         """
-        Enables a profile specified by its name.
-        :param profile_name: The name of the profile to be enabled.
+        Enables the profiles specified by their names or glob patterns, all at once.
+        :param profile_names: The list of names and / or glob patterns of the profiles to be enabled.
         """
-        self.api_wrapper.change_status(profile_name, True)
-        print 'Profile {0} is enabled.'.format(profile_name)
+        self.__change_status(profile_names, True)
 
     # -----------------------------------------------------------------------------------------------------------------
     @handle_api_errors
-    def disable(self, profile_name):
+    def disable(self, profile_names):
         """
-        Disables a profile specified by its name.
-        :param profile_name: The name of the profile to be disabled.
+        Disables the profiles specified by their names or glob patterns, all at once.
+        :param profile_names: The list of names and / or glob patterns of the profiles to be disabled.
         """
-        self.api_wrapper.change_status(profile_name, False)
-        print 'Profile {0} is disabled.'.format(profile_name)
+        self.__change_status(profile_names, False)
 
     # -----------------------------------------------------------------------------------------------------------------
     @handle_api_errors
-    def detect(self, mode):
+    def detect(self, mode, reconnect_attempts = None, overflow = None, record_directory = None,
+               sink_specifications = None, stats = False, reinitialize = False):
         """
         Initializes the system for the specified detection mode, runs a loop to receive detection results from the
         server, and gives the control to the signal handler to stop the loop once a keyboard interrupt or a termination
-        signal is received from the user or the operating system.
+        signal is received from the user or the operating system. If a detection daemon (see run_daemon()) is running
+        for the DevKit and the mode, the results are received from it instead, without initializing the system again.
+        Likewise, the session of an earlier run is reused if it has not expired and the enabled profiles are unchanged.
         :param mode: A string with the value of 'home' or 'room' that respectively indicates home-level or room-level
                      detection.
+        :param reconnect_attempts: (Optional) If given, a lost connection is re-established with up to this many
+                                   attempts before giving up.
+        :param overflow: (Optional) The overflow policy of the queue between the connection and the console output,
+                         one of the dispatch module's OVERFLOW_* constants. Assumes OVERFLOW_BLOCK by default.
+        :param record_directory: (Optional) The directory in which all detection results are to be recorded.
+        :param sink_specifications: (Optional) The sinks to which all detection results are to be forwarded (see
+                                    sinks.parse_sink()). With a stdout sink, results are not printed in the console.
+        :param stats: (Optional) Whether to print live occupancy statistics along with the latest result.
+        :param reinitialize: (Optional) Whether to initialize the system even if the session of an earlier run could be
+                             reused.
         """
 
-        # Initialize the system
-        print 'Initializing...\n'
-        init_result = self.api_wrapper.initialize(mode)
+        from aerial.sample.daemon import DaemonClient, is_running, socket_path
+
+        # Attach to the detection daemon of the DevKit if one is running, otherwise initialize the system
+        daemon_path = socket_path(self.api_wrapper.server, mode)
+        if is_running(daemon_path):
+            print 'Attaching to the detection daemon on {0}...\n'.format(daemon_path)
+            self.daemon_client = DaemonClient(daemon_path, lazy_results = True)
+            init_result = self.daemon_client.connect()['init']
+        else:
+            print 'Initializing...\n'
+            init_result = self.api_wrapper.initialize(mode, reuse = not reinitialize)
 
         # Verify the initialization response
         if init_result.get('profiles', None) is None:
@@ -140,8 +188,168 @@ class Application:
             print 'Detection is about to begin. Press Ctrl+C to stop.\n'
 
         # Start the detection loop and wait for a keyboard interrupt or a termination signal to stop
-        self.detection_thread = self.api_wrapper.detect(utils.print_detection)
-        signal.pause()
+        if stats:
+            from aerial.sample.analytics import OccupancyAnalytics
+            self.analytics = OccupancyAnalytics()
+            listener = self.__listener(lambda result: utils.print_occupancy(result, self.analytics), overflow,
+                                       record_directory, sink_specifications)
+        else:
+            listener = self.__listener(utils.print_detection, overflow, record_directory, sink_specifications)
+        if self.daemon_client is not None:
+            self.detection_thread = self.daemon_client.detect(listener)
+        else:
+            self.detection_thread = self.api_wrapper.detect(listener,
+                                                            self.__reconnect_policy(mode, reconnect_attempts),
+                                                            utils.print_connection_event)
+        wait_for_shutdown()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @handle_api_errors
+    def run_daemon(self, mode, reconnect_attempts = None, reinitialize = False):
+        """
+        Runs a detection daemon, which initializes the system and holds a single detection connection, re-broadcasting
+        the results to the detect() calls of other instances of the application on the same machine, until a keyboard
+        interrupt or a termination signal is received.
+        :param mode: A string with the value of 'home' or 'room' that respectively indicates home-level or room-level
+                     detection.
+        :param reconnect_attempts: (Optional) If given, a lost connection is re-established with up to this many
+                                   attempts before giving up.
+        :param reinitialize: (Optional) Whether to initialize the system even if the session of an earlier run could be
+                             reused.
+        """
+        from aerial.sample.daemon import DetectionDaemon
+        if reinitialize:
+            self.initialization_cache.invalidate(self.api_wrapper.server)
+        print 'Initializing...\n'
+        self.daemon = DetectionDaemon(self.api_wrapper.server, self.port, mode,
+                                      reconnect_policy = self.__reconnect_policy(mode, reconnect_attempts),
+                                      event_listener = utils.print_connection_event,
+                                      initialization_cache = self.initialization_cache)
+        self.detection_thread = self.daemon.start()
+        print 'Detection daemon is running on {0}. Press Ctrl+C to stop.\n'.format(self.daemon.path)
+        wait_for_shutdown()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def detect_fleet(self, servers, mode, reconnect_attempts = None, overflow = None,
+                     record_directory = None, sink_specifications = None):
+        """
+        Runs detection on several DevKits at once over a single event loop. All DevKits are initialized concurrently;
+        the ones which fail to initialize are reported and left out. Detection results are printed line by line, tagged
+        with the DevKit they are received from, until a keyboard interrupt or a termination signal is received.
+        :param servers: The list of DevKit addresses.
+        :param mode: A string with the value of 'home' or 'room' that respectively indicates home-level or room-level
+                     detection.
+        :param reconnect_attempts: (Optional) If given, a lost connection to any of the DevKits is re-established with
+                                   up to this many attempts before giving up.
+        :param overflow: (Optional) The overflow policy of the queue between the connections and the console output,
+                         as in detect().
+        :param record_directory: (Optional) The directory in which all detection results are to be recorded.
+        :param sink_specifications: (Optional) The sinks to which all detection results are to be forwarded (see
+                                    sinks.parse_sink()). With a stdout sink, results are not printed in the console.
+        """
+
+        from aerial.sample.fleet import DetectionFleet
+
+        # Initialize all DevKits and leave out the ones which did not respond as expected
+        print 'Initializing {0} DevKits...\n'.format(len(servers))
+        fleet = DetectionFleet(servers, self.port, lazy_results = True, metrics = self.metrics)
+        init_results = fleet.initialize(mode)
+        failed_servers = []
+        for server in servers:
+            init_result = init_results[server]
+            if isinstance(init_result, AerialException):
+                utils.print_api_error(AerialException(init_result.type, '{0}: {1}'.format(server, init_result.message)))
+            elif isinstance(init_result, Exception):
+                utils.print_api_error(AerialException('connection_error', '{0}: {1}.'.format(server, init_result)))
+            elif init_result.get('profiles', None) is None:
+                utils.print_api_error(AerialException('unknown_error', '{0}: Unexpected response received from server '
+                                                                       'during initialization.'.format(server)))
+            else:
+                continue
+            failed_servers.append(server)
+        fleet.remove(failed_servers)
+        if len(fleet.servers) == 0:
+            fleet.close()
+            return
+
+        # Start the detection loops and wait for a keyboard interrupt or a termination signal to stop
+        print 'Detection is about to begin on {0} DevKits. Press Ctrl+C to stop.\n'.format(len(fleet.servers))
+        self.fleet = fleet
+        listener = self.__listener(utils.print_fleet_detection, overflow, record_directory, sink_specifications)
+        self.detection_thread = self.fleet.detect(listener,
+                                                  self.__reconnect_policy(mode, reconnect_attempts),
+                                                  utils.print_connection_event)
+        wait_for_shutdown()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __change_status(self, patterns, enabled):
+        """
+        Changes the enabled status of the profiles matching the patterns concurrently and prints a report of the
+        outcome.
+        """
+        profile_names = self.api_wrapper.match_profiles(patterns)
+        if len(profile_names) == 0:
+            raise AerialException('profile_not_found', 'No profiles match {0}.'.format(', '.join(patterns)))
+        results = self.api_wrapper.change_status_bulk(profile_names, enabled)
+
+        # Collect the failures, wrapping the ones which are not standard aerial API errors as handle_api_errors does
+        failures = {}
+        for profile_name, result in results.items():
+            if isinstance(result, AerialException):
+                failures[profile_name] = result
+            elif isinstance(result, socket.error):
+                failures[profile_name] = AerialException('socket_error', '{0}.'.format(result.strerror))
+            elif isinstance(result, Exception):
+                failures[profile_name] = AerialException('unknown_error', '{0}.'.format(result))
+        utils.print_status_report(profile_names, failures, enabled)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __listener(self, printer, overflow, record_directory, sink_specifications):
+        """
+        Creates the detection listener which feeds every result to the occupancy analytics, records it and forwards it
+        to the sinks, if enabled, and passes it on to the console output through a dispatcher unless the results are
+        written to the standard output.
+        :param printer: The function printing a detection result in the console.
+        """
+        from aerial.sample.dispatch import DetectionDispatcher, OVERFLOW_BLOCK
+        consumers = []
+        console = True
+        if self.analytics is not None:
+            consumers.append(self.analytics.update)
+        if record_directory is not None:
+            from aerial.sample.recorder import DetectionRecorder
+            self.recorder = DetectionRecorder(record_directory)
+            consumers.append(self.recorder.record)
+        if sink_specifications:
+            from aerial.sample.sinks import SinkGroup, StdoutSink, create_sink
+            try:
+                self.sinks = SinkGroup([create_sink(specification) for specification in sink_specifications])
+            except (IOError, OSError) as error:
+                raise AerialException('sink_error', '{0}.'.format(error))
+            consumers.append(self.sinks.put)
+            console = not any(isinstance(sink, StdoutSink) for sink in self.sinks.sinks)
+        if console:
+            if overflow is None:
+                overflow = OVERFLOW_BLOCK
+            self.dispatcher = DetectionDispatcher(printer, overflow = overflow, workers = 1)
+        if len(consumers) == 0:
+            return self.dispatcher.put
+
+        def __consume_and_dispatch(detection_result):
+            for consumer in consumers:
+                consumer(detection_result)
+            if self.dispatcher is not None:
+                return self.dispatcher.put(detection_result)
+        return __consume_and_dispatch
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __reconnect_policy(self, mode, reconnect_attempts):
+        """
+        Creates the reconnect policy for a detection loop, or returns None if reconnecting is not enabled.
+        """
+        if reconnect_attempts is None:
+            return None
+        return ReconnectPolicy(mode, max_attempts = reconnect_attempts)
 
     # -----------------------------------------------------------------------------------------------------------------
     def shutdown(self):
@@ -150,6 +358,21 @@ class Application:
         called by a signal handler.
         """
         self.api_wrapper.stop()
-        self.executor.shutdown(wait = False)
+        if self.fleet is not None:
+            self.fleet.stop()
+        if self.daemon is not None:
+            self.daemon.stop()
+        if self.daemon_client is not None:
+            self.daemon_client.stop()
         if self.detection_thread is not None:
-            self.detection_thread.join(3)
\ No newline at end of file
+            self.detection_thread.join()
+        if self.fleet is not None:
+            self.fleet.close()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.sinks is not None:
+            self.sinks.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
\ No newline at end of file
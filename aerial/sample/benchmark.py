@@ -0,0 +1,268 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Benchmarks for the client hot paths, run against a local stub DevKit."""
+
+
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+import timeit
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def percentiles(samples, points = (50, 90, 99)):
+    """
+    Computes percentiles of a list of samples by the nearest-rank method.
+    :return: A dictionary mapping 'p<point>' to the percentile, plus 'min', 'max' and 'mean'.
+    """
+    if len(samples) == 0:
+        return {}
+    ordered = sorted(samples)
+    result = dict(('p{0}'.format(point), ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))])
+                  for point in points)
+    result.update(min = ordered[0], max = ordered[-1], mean = sum(ordered) / len(ordered))
+    return result
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+@contextmanager
+def stub_devkit(*arguments):
+    """
+    Runs a stub DevKit in a separate process for the duration of the block, so that it does not compete with the
+    measured client for the interpreter lock.
+    :param arguments: Command line arguments for the stub.
+    :return: The port the stub listens on.
+    """
+
+    # Find a free port and start the stub on it
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    process = subprocess.Popen([sys.executable, '-m', 'aerial.sample.devkit_stub', '--port', str(port)] +
+                               list(arguments), stdout = open(os.devnull, 'w'), stderr = subprocess.STDOUT)
+
+    # Wait for it to accept connections
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                break
+            except socket.error:
+                if time.time() > deadline or process.poll() is not None:
+                    raise RuntimeError('The stub DevKit could not be started.')
+                time.sleep(0.05)
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+@contextmanager
+def silenced_stdout():
+    """
+    Redirects the standard output to the null device for the duration of the block.
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def bench_detection(duration, rate, payload_size):
+    """
+    Measures the detection message rate and per-message end-to-end latency (from being sent by the stub to being
+    passed to the listener) through ApiWrapper.detect().
+    """
+    from aerial.sample.api_wrapper import ApiWrapper
+
+    with stub_devkit('--rate', str(rate), '--payload-size', str(payload_size)) as port:
+        api_wrapper = ApiWrapper('127.0.0.1', port)
+        api_wrapper.initialize('home')
+        latencies = []
+
+        def __listener(detection_result):
+            latencies.append(time.time() - detection_result['timestamp'])
+
+        # The SIGALRM sent on an unexpected loss of the connection must not end the benchmark
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        detection_thread = api_wrapper.detect(__listener)
+        time.sleep(duration)
+        api_wrapper.stop()
+        detection_thread.join()
+
+    return {
+        'target_rate': rate,
+        'payload_size': payload_size,
+        'messages': len(latencies),
+        'messages_per_second': len(latencies) / float(duration),
+        'latency_seconds': percentiles(latencies)
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def bench_list_profiles(profiles, training_sets, repetitions):
+    """
+    Measures the time ApiWrapper.list_profiles() takes for a large number of training sets.
+    """
+    from aerial.sample.api_wrapper import ApiWrapper
+
+    with stub_devkit('--profiles', str(profiles), '--training-sets', str(training_sets)) as port:
+        api_wrapper = ApiWrapper('127.0.0.1', port)
+        api_wrapper.list_profiles()
+        timings = []
+        for _ in range(repetitions):
+            start = time.time()
+            api_wrapper.list_profiles()
+            timings.append(time.time() - start)
+
+    return {
+        'profiles': profiles,
+        'training_sets': profiles * training_sets,
+        'seconds': percentiles(timings)
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def bench_utils(number):
+    """
+    Measures the per-call cost of utils.format_datetime() and utils.print_detection().
+    """
+    from aerial.sample import utils
+
+    def __per_call(statement):
+        return min(timeit.repeat(statement, repeat = 3, number = number)) / number
+
+    detection_result = { 'results': 'profile0' }
+    with silenced_stdout():
+        print_detection = __per_call(lambda: utils.print_detection(detection_result))
+    return {
+        'format_datetime_seconds': __per_call(lambda: utils.format_datetime('2016-05-01T10:00:00.000Z')),
+        'print_detection_seconds': print_detection
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# The modules imported by the sample application before its first API request, and the ones it must not import by then
+STARTUP_MODULES = ['aerial.sample.sample', 'aerial.sample.application']
+DEFERRED_MODULES = ['pkg_resources', 'tornado.web', 'tornado.websocket', 'dateutil', 'aerial.sample.metrics',
+                    'aerial.sample.daemon', 'aerial.sample.fleet', 'aerial.sample.training', 'aerial.sample.recorder',
+                    'aerial.sample.sinks', 'aerial.sample.shared_ring', 'aerial.sample.analytics']
+STARTUP_SCRIPT = """
+import sys, time
+start = time.time()
+for module in {0!r}:
+    __import__(module)
+print time.time() - start
+print ' '.join(module for module in {1!r} if module in sys.modules)
+"""
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def bench_startup(repetitions):
+    """
+    Measures the wall-clock time of starting the sample application until it has parsed its command line, and the time
+    of importing the modules it needs before its first API request, each in a fresh interpreter. Also reports the
+    modules which should have been deferred but were imported.
+    """
+    timings = []
+    import_timings = []
+    imported = set()
+    script = STARTUP_SCRIPT.format(STARTUP_MODULES, DEFERRED_MODULES)
+    with open(os.devnull, 'w') as null:
+        for _ in range(repetitions):
+            start = time.time()
+            subprocess.call([sys.executable, '-m', 'aerial.sample.sample', '--help'], stdout = null, stderr = null)
+            timings.append(time.time() - start)
+            output = subprocess.check_output([sys.executable, '-c', script], stderr = null).split('\n')
+            import_timings.append(float(output[0]))
+            imported.update(output[1].split())
+    return {
+        'seconds': percentiles(timings),
+        'import_seconds': percentiles(import_timings),
+        'deferred_modules_imported': sorted(imported)
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def main():
+    """
+    Runs the benchmarks, prints their results and writes them to a JSON file so that runs can be compared.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('-o', '--output', type = str, default = 'benchmark.json', help = 'Result file (JSON)')
+    parser.add_argument('--label', type = str, default = None, help = 'Label stored with the results, e.g. a version')
+    parser.add_argument('--duration', type = float, default = 5, help = 'Seconds of detection to measure')
+    parser.add_argument('--rate', type = int, default = 20000,
+                        help = 'Detection messages per second sent by the stub to saturate the client')
+    parser.add_argument('--paced-rate', type = int, default = 500,
+                        help = 'Detection messages per second sent by the stub to measure latency without a backlog')
+    parser.add_argument('--payload-size', type = int, default = 0, help = 'Padding bytes per detection message')
+    parser.add_argument('--profiles', type = int, default = 50, help = 'Profiles for the list_profiles benchmark')
+    parser.add_argument('--training-sets', type = int, default = 200, help = 'Training sets per profile')
+    parser.add_argument('--only', type = str, nargs = '+', default = None,
+                        choices = ['detection', 'list_profiles', 'utils', 'startup'], help = 'Benchmarks to run')
+    arguments = parser.parse_args()
+
+    benchmarks = [
+        ('detection', lambda: {
+            'saturated': bench_detection(arguments.duration, arguments.rate, arguments.payload_size),
+            'paced': bench_detection(arguments.duration, arguments.paced_rate, arguments.payload_size)
+        }),
+        ('list_profiles', lambda: bench_list_profiles(arguments.profiles, arguments.training_sets, 10)),
+        ('utils', lambda: bench_utils(10000)),
+        ('startup', lambda: bench_startup(10))
+    ]
+
+    results = {}
+    for name, benchmark in benchmarks:
+        if arguments.only is None or name in arguments.only:
+            results[name] = benchmark()
+            print '{0}: {1}'.format(name, json.dumps(results[name], sort_keys = True))
+
+    report = {
+        'label': arguments.label,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent = 2, sort_keys = True)
+    print 'Results written to {0}.'.format(arguments.output)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# If the script is run directly, simply run the main function.
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,266 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Pluggable JSON codec, and lazily decoded detection results."""
+
+
+import json
+import re
+from collections import MutableMapping
+
+from aerial.sample import profiling
+
+
+# The codecs which may be used, in the order of preference. Each maps its name to a function returning its
+# (loads, dumps) pair, or raising ImportError if it is not installed.
+CODECS = [
+    ('ujson', lambda: __import__('ujson')),
+    ('simplejson', lambda: __import__('simplejson')),
+    ('json', lambda: json)
+]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def __compact_dumps(module):
+    """
+    :return: A dumps function of a json-compatible module producing compact documents.
+    """
+    return lambda document: module.dumps(document, separators = (',', ':'))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def set_codec(name = None):
+    """
+    Selects the JSON codec used by loads() and dumps().
+    :param name: (Optional) The name of one of the CODECS. By default, the first one which is installed is selected.
+    :return: The name of the selected codec.
+    """
+    global codec_name, loads, dumps
+    for candidate, importer in CODECS:
+        if name is not None and candidate != name:
+            continue
+        try:
+            module = importer()
+        except ImportError:
+            if name is not None:
+                raise
+            continue
+        codec_name = candidate
+        loads = module.loads
+        dumps = module.dumps if candidate == 'ujson' else __compact_dumps(module)
+        return codec_name
+    raise ValueError('Unknown JSON codec: {0}'.format(name))
+
+
+codec_name = None
+loads = json.loads
+dumps = json.dumps
+set_codec()
+
+# The decoder of array elements parsed incrementally, which needs to be told where an element starts (raw_decode()),
+# and the pattern of the whitespace in between
+ELEMENT_DECODER = json.JSONDecoder()
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class LazyDetectionResult(MutableMapping):
+    """
+    A detection result which keeps the raw JSON document it was received as, and only decodes it the first time one of
+    its fields is read. Results which are dropped, coalesced or recorded without being looked into are never decoded
+    at all. Fields which are set on the result (e.g. the 'server' tag of DetectionFleet) are kept aside, so that
+    setting them does not require decoding either; encode() returns the raw document as it is unless there are any.
+    """
+
+    __slots__ = ('raw', '__decoded', '__extra')
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, raw):
+        self.raw = raw
+        self.__decoded = None
+        self.__extra = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def decoded(self):
+        """
+        :return: The decoded document as a dictionary, including the fields set on the result.
+        """
+        if self.__decoded is None:
+            span = profiling.start_span()
+            self.__decoded = loads(self.raw)
+            profiling.end_span('decode', span)
+            if self.__extra is not None:
+                self.__decoded.update(self.__extra)
+        return self.__decoded
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def encode(self):
+        """
+        :return: The result as a JSON document, without encoding it again unless it has been modified.
+        """
+        if self.__extra is None:
+            return self.raw
+        return dumps(self.decoded())
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if self.__decoded is None and self.__extra is not None and key in self.__extra:
+            return self.__extra[key]
+        return self.decoded()[key]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __setitem__(self, key, value):
+        if self.__extra is None:
+            self.__extra = {}
+        self.__extra[key] = value
+        if self.__decoded is not None:
+            self.__decoded[key] = value
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __delitem__(self, key):
+        decoded = self.decoded()
+        del decoded[key]
+        if self.__extra is not None:
+            self.__extra.pop(key, None)
+        self.raw = dumps(decoded)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __iter__(self):
+        return iter(self.decoded())
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.decoded())
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __repr__(self):
+        return 'LazyDetectionResult({0!r})'.format(self.raw)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def encode_detection(detection_result):
+    """
+    Encodes a detection result as a compact JSON document, reusing the raw document of a LazyDetectionResult.
+    """
+    if isinstance(detection_result, LazyDetectionResult):
+        return detection_result.encode()
+    return dumps(detection_result)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ArrayStreamParser:
+    """
+    Parses a JSON array incrementally from chunks of its text, as they arrive, passing every element to the callback
+    as soon as it is complete. Only the text following the last complete element is kept, so memory use depends on
+    the size of the largest element rather than on the size of the array. Elements are decoded by the json module's
+    decoder, right from the text; an element which is not complete yet is decoded again only once the text has
+    doubled in size, so that large elements do not take quadratic time (and once close() is called at the end of the
+    text). An element is only passed on once the comma or the bracket following it has arrived, so that a number cut
+    off at the end of a chunk is not taken for a whole one. As UTF-8 continuation bytes never take the value of an
+    ASCII character, chunks may be split anywhere. A document which is not an array is ignored, and a malformed one
+    is waited on until its end; either way, finished() remains false.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, callback):
+        self.callback = callback
+        self.count = 0
+        self.__buffer = ''
+        self.__retry_size = 0
+        self.__started = False
+        self.__finished = False
+        self.__invalid = False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def feed(self, chunk):
+        """
+        Parses the next chunk of the text. Suitable as the streaming_callback of an HTTP request.
+        """
+        if self.__finished or self.__invalid:
+            return
+        buffer = self.__buffer + chunk
+        if len(buffer) < self.__retry_size:
+            self.__buffer = buffer
+            return
+        self.__retry_size = 0
+
+        position = 0
+        pending = False
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                if pending:
+                    # Keep the text of the element until it is known to be complete
+                    position = element_start
+                break
+            character = buffer[position]
+
+            if not self.__started:
+                # The opening bracket of the array
+                if character != '[':
+                    self.__invalid = True
+                    return
+                self.__started = True
+                position += 1
+                continue
+
+            if pending:
+                # The comma or the closing bracket following an element, which completes it. Anything else means that
+                # the element has been cut off, e.g. a number before its fraction, or that it is malformed.
+                if character not in ',]':
+                    self.__retry_size = 2 * (len(buffer) - element_start)
+                    position = element_start
+                    break
+                self.count += 1
+                self.callback(element)
+                pending = False
+                position += 1
+                if character == ']':
+                    self.__finished = True
+                    return
+                continue
+
+            # The closing bracket of an empty array, or the next element unless it has not been received completely yet
+            if character == ']' and self.count == 0:
+                self.__finished = True
+                return
+            try:
+                element, end = ELEMENT_DECODER.raw_decode(buffer, position)
+            except ValueError:
+                self.__retry_size = 2 * (len(buffer) - position)
+                break
+            element_start, position = position, end
+            pending = True
+
+        self.__buffer = buffer[position:]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Parses the rest of the text once all of it has been fed.
+        """
+        self.__retry_size = 0
+        self.feed('')
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def finished(self):
+        """
+        :return: Whether the closing bracket of the array has been parsed.
+        """
+        return self.__finished
\ No newline at end of file
@@ -0,0 +1,350 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Persistent HTTP/1.1 connections shared by the API clients."""
+
+
+import select
+import socket
+import time
+import urlparse
+from datetime import timedelta
+from io import BytesIO
+from threading import Lock
+
+from tornado import gen, httputil
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPResponse
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.locks import Semaphore
+from tornado.netutil import Resolver
+from tornado.tcpclient import TCPClient
+
+
+# Methods whose requests may be sent twice without changing the outcome, and can thus be retried over another
+# connection if a reused one fails before responding
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class CachingResolver(Resolver):
+    """
+    A resolver which remembers the addresses of every host for ttl seconds, so that hostnames are not resolved again
+    for every new connection. Resolving is left to another resolver, tornado's default one unless given.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, resolver = None, ttl = 300):
+        self.resolver = resolver if resolver is not None else Resolver()
+        self.ttl = ttl
+        self.addresses = {}
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def resolve(self, host, port, family = socket.AF_UNSPEC):
+        key = (host, port, family)
+        entry = self.addresses.get(key, None)
+        if entry is not None and entry[0] > time.time():
+            raise gen.Return(entry[1])
+        addresses = yield self.resolver.resolve(host, port, family)
+        self.addresses[key] = (time.time() + self.ttl, addresses)
+        raise gen.Return(addresses)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        self.resolver.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ConnectionPool:
+    """
+    A bounded pool of idle keep-alive connections by DevKit (host and port), along with the resolver used to open new
+    ones. Connections are kept as plain sockets, which are not bound to an IOLoop, so a single pool can be shared by any
+    number of clients, each running on its own IOLoop and thread. At most max_idle_per_host connections are kept for a
+    DevKit and at most max_idle connections in total; connections which have been idle for longer than idle_timeout
+    seconds, or which have been closed by the server in the meantime, are discarded rather than reused.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, max_idle_per_host = 10, max_idle = 100, idle_timeout = 30, resolver = None):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.resolver = resolver if resolver is not None else CachingResolver()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.__idle = {}
+        self.__idle_count = 0
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def acquire(self, host, port):
+        """
+        Takes the most recently released connection to a DevKit which is still usable out of the pool.
+        :return: A connected socket, or None if there is none.
+        """
+        while True:
+            with self.__lock:
+                idle = self.__idle.get((host, port), None)
+                if not idle:
+                    return None
+                connection, released_time = idle.pop()
+                self.__idle_count -= 1
+            if time.time() - released_time <= self.idle_timeout and not closed_by_peer(connection):
+                with self.__lock:
+                    self.reused += 1
+                return connection
+            self.__discard(connection)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self, host, port, connection):
+        """
+        Puts a connection whose response has been read completely back into the pool, or closes it if the pool is full.
+        """
+        with self.__lock:
+            idle = self.__idle.setdefault((host, port), [])
+            if len(idle) < self.max_idle_per_host and self.__idle_count < self.max_idle:
+                idle.append((connection, time.time()))
+                self.__idle_count += 1
+                return
+        self.__discard(connection)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def connected(self):
+        """
+        Records that a client has opened a new connection, which it may release into the pool later.
+        """
+        with self.__lock:
+            self.created += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        with self.__lock:
+            connections = [connection for idle in self.__idle.values() for connection, _ in idle]
+            self.__idle = {}
+            self.__idle_count = 0
+        for connection in connections:
+            self.__discard(connection)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        """
+        :return: A dictionary with the numbers of connections created, reused, discarded and currently idle.
+        """
+        with self.__lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'idle': self.__idle_count
+            }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __discard(self, connection):
+        connection.close()
+        with self.__lock:
+            self.discarded += 1
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def closed_by_peer(connection):
+    """
+    Checks whether an idle connection has become readable, which means that the server has closed it (or has sent
+    something it should not have), without blocking.
+    """
+    try:
+        return len(select.select([connection], [], [], 0)[0]) > 0
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+shared_pool = None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def get_shared_pool():
+    """
+    :return: The connection pool shared by all clients which are not given one of their own, created on first use.
+    """
+    global shared_pool
+    if shared_pool is None:
+        shared_pool = ConnectionPool()
+    return shared_pool
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ResponseCollector(httputil.HTTPMessageDelegate):
+    """
+    Collects the start line, the headers and the body of a response read by an HTTP1Connection, passing the body to a
+    streaming callback instead, if one is given. If the streaming callback returns a Future, the rest of the body is
+    not read until it is resolved. The body of an error response is always collected, so that the error it describes
+    can be read from the response.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, streaming_callback = None):
+        self.streaming_callback = streaming_callback
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+        self.finished = False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def headers_received(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def data_received(self, chunk):
+        if self.streaming_callback is not None and self.start_line.code < 300:
+            return self.streaming_callback(chunk)
+        else:
+            self.chunks.append(chunk)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def finish(self):
+        self.finished = True
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class KeepAliveHTTPClient(AsyncHTTPClient):
+    """
+    An AsyncHTTPClient which keeps HTTP/1.1 connections open and reuses them for later requests, taking them from and
+    returning them to a ConnectionPool (the shared one unless given). tornado's own simple client closes the connection
+    after every response. A request sent over a reused connection which turns out to have been closed by the server
+    before responding is retried over another one. Since a connection may also fail after the server has acted on the
+    request, requests with other methods than IDEMPOTENT_METHODS (e.g. POST) are always sent over a new connection and
+    never retried; the connection is still pooled afterwards for other requests. Like the simple client, at most
+    max_clients requests are sent at the same time, and further ones are queued. Only plain HTTP is supported, and
+    redirects are not followed.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, max_clients = 10, pool = None, max_header_size = None, max_body_size = None,
+                   defaults = None):
+        super(KeepAliveHTTPClient, self).initialize(defaults = defaults)
+        self.max_clients = max_clients
+        self.pool = pool if pool is not None else get_shared_pool()
+        self.slots = Semaphore(max_clients)
+        self.tcp_client = TCPClient(resolver = self.pool.resolver)
+        self.connection_parameters = HTTP1ConnectionParameters(max_header_size = max_header_size,
+                                                               max_body_size = max_body_size)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def fetch_impl(self, request, callback):
+        IOLoop.current().add_future(self.__fetch(request), lambda future: callback(future.result()))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __fetch(self, request):
+        """
+        Sends a request, over a pooled connection if possible, and reads its response.
+        :return: A Future resolving to the HTTPResponse, which carries the error if the request has failed.
+        """
+        yield self.slots.acquire()
+        start_time = time.time()
+        url = urlparse.urlsplit(request.url)
+        host = url.hostname
+        port = url.port if url.port is not None else 80
+        path = (url.path or '/') + ('?' + url.query if url.query else '')
+        try:
+            if url.scheme != 'http':
+                raise ValueError('Unsupported URL scheme: {0}'.format(url.scheme))
+            response = yield gen.with_timeout(timedelta(seconds = request.request_timeout),
+                                              self.__send(request, host, port, path, url.netloc, start_time),
+                                              quiet_exceptions = (StreamClosedError, socket.error))
+        except gen.TimeoutError:
+            response = HTTPResponse(request, 599, error = HTTPError(599, 'Timeout during request'),
+                                    request_time = time.time() - start_time)
+        except StreamClosedError as error:
+            # Like the simple client, report the underlying error (e.g. a refused connection) if there is one
+            error = error.real_error if error.real_error is not None else HTTPError(599, 'Stream closed')
+            response = HTTPResponse(request, 599, error = error, request_time = time.time() - start_time)
+        except Exception as error:
+            response = HTTPResponse(request, 599, error = error, request_time = time.time() - start_time)
+        finally:
+            self.slots.release()
+        raise gen.Return(response)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __send(self, request, host, port, path, netloc, start_time):
+        """
+        Sends a request over pooled connections until one of them is found alive, or over a new one once the pool has
+        none left (or right away if the request is not idempotent), and puts the connection back into the pool if the
+        server keeps it open.
+        """
+        reuse = request.method in IDEMPOTENT_METHODS
+        while True:
+            connection = self.pool.acquire(host, port) if reuse else None
+            if connection is not None:
+                stream = IOStream(connection)
+            else:
+                stream = yield self.tcp_client.connect(host, port,
+                                                       timeout = timedelta(seconds = request.connect_timeout))
+                self.pool.connected()
+            collector = ResponseCollector(request.streaming_callback)
+            try:
+                yield self.__exchange(stream, request, path, netloc, collector)
+            except (StreamClosedError, socket.error):
+                stream.close()
+                # Retry only if a reused connection had already been closed, which leaves the request unanswered and,
+                # as it is idempotent, safe to send again
+                if connection is not None and collector.start_line is None:
+                    continue
+                raise
+            except Exception:
+                stream.close()
+                raise
+            break
+
+        # Keep the connection unless the server is about to close it
+        if not stream.closed():
+            stream.io_loop.remove_handler(stream.socket)
+            self.pool.release(host, port, stream.socket)
+        raise gen.Return(HTTPResponse(request, collector.start_line.code, reason = collector.start_line.reason,
+                                      headers = collector.headers, buffer = BytesIO(''.join(collector.chunks)),
+                                      request_time = time.time() - start_time, start_time = start_time))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __exchange(self, stream, request, path, netloc, collector):
+        """
+        Writes a request to a connection and reads its response into a ResponseCollector.
+        """
+        connection = HTTP1Connection(stream, True, self.connection_parameters)
+        headers = httputil.HTTPHeaders(request.headers)
+        headers.setdefault('Host', netloc)
+        if request.body is not None:
+            headers['Content-Length'] = str(len(request.body))
+        connection.write_headers(httputil.RequestStartLine(request.method, path, 'HTTP/1.1'), headers)
+        if request.body:
+            connection.write(request.body)
+        connection.finish()
+        yield connection.read_response(collector)
+        if not collector.finished:
+            stream.close()
+            raise StreamClosedError()
+        connection.detach()
\ No newline at end of file
@@ -0,0 +1,350 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""A local daemon sharing one detection session among any number of clients."""
+
+
+import errno
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import tempfile
+from threading import Thread, Event
+
+from tornado import gen
+from tornado.concurrent import is_future
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError, StreamBufferFullError
+from tornado.netutil import bind_unix_socket, add_accept_handler
+
+from aerial.sample import codec
+from aerial.sample.api_wrapper import AsyncApiWrapper, AerialException
+from aerial.sample.codec import LazyDetectionResult
+
+
+# The SO_PEERCRED socket option of Linux, which Python 2 does not define
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def runtime_directory():
+    """
+    :return: The directory for the Unix sockets of the current user: $XDG_RUNTIME_DIR if it is set, otherwise an
+             aerial-<uid> directory in the temporary directory, which is created with mode 0700 if needed.
+    :raise AerialException: If the latter exists but is not a directory which only the current user can access.
+    """
+    path = os.environ.get('XDG_RUNTIME_DIR', None)
+    if path and os.path.isdir(path):
+        return path
+    path = os.path.join(tempfile.gettempdir(), 'aerial-{0}'.format(os.getuid()))
+    try:
+        os.mkdir(path, 0700)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0077:
+        raise AerialException('unsafe_directory', '{0} is not a private directory of the current user.'.format(path))
+    return path
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def socket_path(server, mode):
+    """
+    :return: The default path of the Unix socket of the daemon running detection on a DevKit in the given mode, in the
+             runtime directory of the current user.
+    """
+    return os.path.join(runtime_directory(), 'aerial-detection-{0}-{1}.sock'.format(server, mode))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def peer_uid(connection):
+    """
+    :return: The user id of the process on the other end of a connected Unix socket, or None if it cannot be told on
+             this platform.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def is_running(path):
+    """
+    Tells whether a daemon accepts subscribers on the given Unix socket.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        probe.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionDaemon:
+    """
+    Initializes a DevKit for detection once and holds a single detection connection to it, re-broadcasting every
+    result to any number of local subscribers over a Unix socket. Subscribers receive one line with the server, the
+    mode and the initialization result (including the 'expiry' of the session) as a JSON document, followed by one
+    line per detection result. A subscriber which falls behind by more than max_buffer_size bytes misses results until
+    it catches up, so that it does not hold back the others. With an InitializationCache, a session initialized by an
+    earlier run is reused as long as it has not expired. Subscribers run by other users are turned away. The daemon
+    runs on a thread of its own.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, server, port, mode, path = None, reconnect_policy = None, event_listener = None,
+                 max_buffer_size = 1024 * 1024, initialization_cache = None):
+        self.server = server
+        self.port = port
+        self.mode = mode
+        self.path = path if path is not None else socket_path(server, mode)
+        self.reconnect_policy = reconnect_policy
+        self.event_listener = event_listener
+        self.max_buffer_size = max_buffer_size
+        self.initialization_cache = initialization_cache
+        self.init_result = None
+        self.subscribers = set()
+        self.dropped = 0
+        self.io_loop = None
+        self.async_wrapper = None
+        self.__hello = None
+        self.__error = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def start(self):
+        """
+        Initializes the DevKit and starts accepting subscribers, blocking until the initialization is complete.
+        :raise AerialException: If another daemon is already running on the same socket, or the DevKit could not be
+                                initialized.
+        :return: The thread the daemon runs on. See the stop() method.
+        """
+        if is_running(self.path):
+            raise AerialException('daemon_running', 'A detection daemon is already running on {0}.'.format(self.path))
+        self.io_loop = IOLoop(make_current = False)
+        initialized = Event()
+
+        def __run():
+            self.io_loop.make_current()
+            try:
+                self.io_loop.run_sync(lambda: self.__serve(initialized))
+            except Exception as error:
+                self.__error = error
+            finally:
+                self.io_loop.close(all_fds = True)
+                initialized.set()
+
+        thread = Thread(target = __run)
+        thread.start()
+        initialized.wait()
+        if self.__error is not None:
+            thread.join()
+            raise self.__error
+        return thread
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Stops the detection loop, disconnecting all subscribers and removing the socket.
+        """
+        if self.io_loop is not None and self.async_wrapper is not None:
+            self.io_loop.add_callback(self.async_wrapper.stop)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def broadcast(self, detection_result):
+        """
+        The detection listener, writing a result to all subscribers.
+        """
+        line = codec.encode_detection(detection_result)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        if '\n' in line:
+            line = codec.dumps(codec.loads(line))
+        line += '\n'
+        for stream in list(self.subscribers):
+            try:
+                stream.write(line)
+            except StreamBufferFullError:
+                self.dropped += 1
+            except StreamClosedError:
+                self.subscribers.discard(stream)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __serve(self, initialized):
+        """
+        Initializes the DevKit, and runs the detection loop while accepting subscribers.
+        """
+        self.async_wrapper = AsyncApiWrapper(self.server, self.port, lazy_results = True,
+                                             initialization_cache = self.initialization_cache)
+        self.init_result = yield self.async_wrapper.initialize(self.mode, reuse = True)
+        self.__hello = codec.dumps({ 'server': self.server, 'mode': self.mode, 'init': self.init_result }) + '\n'
+        listener = bind_unix_socket(self.path)
+        remove_accept_handler = add_accept_handler(listener, self.__subscribe)
+        initialized.set()
+        try:
+            yield self.async_wrapper.detect(self.broadcast, self.reconnect_policy, self.event_listener)
+        finally:
+            remove_accept_handler()
+            listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            for stream in self.subscribers:
+                stream.close()
+            self.subscribers.clear()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __subscribe(self, connection, address):
+        """
+        Accepts a subscriber run by the same user, sending it the initialization details first.
+        """
+        uid = peer_uid(connection)
+        if uid is not None and uid != os.getuid():
+            connection.close()
+            return
+        stream = IOStream(connection, max_write_buffer_size = self.max_buffer_size)
+        stream.set_close_callback(lambda: self.subscribers.discard(stream))
+        stream.write(self.__hello)
+        self.subscribers.add(stream)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DaemonClient:
+    """
+    Receives the detection results re-broadcast by a DetectionDaemon, instead of initializing the DevKit and opening a
+    detection connection of its own. Only a daemon run by the same user is trusted. Its detect() and stop() methods
+    work like the ones of ApiWrapper. See AsyncApiWrapper for lazy_results.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, lazy_results = False):
+        self.path = path
+        self.lazy_results = lazy_results
+        self.info = None
+        self.detection_loop = None
+        self.__socket = None
+        self.__stream = None
+        self.__buffered = ''
+        self.__stop_detection = False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def connect(self, timeout = 5):
+        """
+        Connects to the daemon and reads the initialization details it sends first.
+        :raise socket.error: If no daemon is running on the socket, or it did not send the details within the timeout.
+        :raise AerialException: If the daemon is run by another user.
+        :return: A dictionary with the 'server', the 'mode' and the initialization result ('init') of the daemon.
+        """
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.settimeout(timeout)
+        self.__socket.connect(self.path)
+        uid = peer_uid(self.__socket)
+        if uid is None:
+            uid = os.stat(self.path).st_uid
+        if uid != os.getuid():
+            self.__socket.close()
+            raise AerialException('daemon_untrusted', 'The detection daemon on {0} is run by another user.'.format(
+                self.path))
+
+        # Read up to the end of the first line, keeping the results received after it for the detection loop
+        chunks = []
+        while True:
+            chunk = self.__socket.recv(65536)
+            if chunk == '':
+                raise socket.error('The detection daemon closed the connection.')
+            chunks.append(chunk)
+            if '\n' in chunk:
+                break
+        hello, self.__buffered = ''.join(chunks).split('\n', 1)
+        self.__socket.settimeout(None)
+        self.info = codec.loads(hello)
+        return self.info
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def detect(self, listener):
+        """
+        Receives detection results from the daemon on a new thread with its own IOLoop, passing them to a callback
+        function. If the daemon goes away, SIGALRM is sent to shutdown, as ApiWrapper does once a connection is lost.
+        :param listener: The callback function which is called with the detection result as the sole argument. See
+                         AsyncApiWrapper.detect().
+        :return: The thread on which the loop is run.
+        """
+        detection_loop = IOLoop(make_current = False)
+        self.detection_loop = detection_loop
+
+        def __run():
+            detection_loop.make_current()
+            try:
+                detection_loop.run_sync(lambda: self.__receive(listener))
+            finally:
+                detection_loop.close()
+
+        loop_thread = Thread(target = __run)
+        loop_thread.start()
+        return loop_thread
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Stops the loop started by detect() and disconnects from the daemon.
+        """
+        self.__stop_detection = True
+        if self.detection_loop is not None:
+            self.detection_loop.add_callback(self.__close)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __receive(self, listener):
+        """
+        The loop which reads detection results, one per line, until the loop is stopped or the daemon goes away.
+        """
+        self.__stream = IOStream(self.__socket)
+        buffered, self.__buffered = self.__buffered, ''
+        try:
+            while not self.__stop_detection:
+                end = buffered.find('\n')
+                if end < 0:
+                    line = buffered + (yield self.__stream.read_until('\n'))
+                    buffered = ''
+                else:
+                    line, buffered = buffered[:end + 1], buffered[end + 1:]
+                if self.lazy_results:
+                    pending = listener(LazyDetectionResult(line[:-1]))
+                else:
+                    pending = listener(codec.loads(line))
+                if is_future(pending):
+                    yield pending
+        except StreamClosedError:
+            pass
+        if not self.__stop_detection:
+            print 'Connection with the detection daemon lost.'
+            signal.alarm(1)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __close(self):
+        if self.__stream is not None:
+            self.__stream.close()
\ No newline at end of file
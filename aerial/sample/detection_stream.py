@@ -0,0 +1,167 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Pull-based access to detection results, optionally grouped into batches."""
+
+
+import time
+from Queue import Empty
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue
+
+
+# Marker put into a result queue once the detection loop feeding it is finished.
+END_OF_STREAM = object()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionStream:
+    """
+    Asynchronous iterator over detection results, to be used from coroutines running on the IOLoop the detection loop
+    runs on. Since results are pulled by the consumer rather than pushed to a callback, they can be processed in
+    batches: If batch_size and / or batch_interval are given, next() resolves to a list of results which is complete
+    once batch_size results are collected or batch_interval seconds have passed since its first result, whichever
+    happens first. Typical usage:
+
+        stream = async_wrapper.stream_detections(batch_size = 50, batch_interval = 0.2)
+        while True:
+            batch = yield stream.next()
+            if batch is None:
+                break
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, async_wrapper, batch_size = None, batch_interval = None):
+        self.async_wrapper = async_wrapper
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.__queue = Queue()
+        self.__finished = False
+        self.__error = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def put(self, detection_result):
+        """
+        Queues a detection result. This is the listener passed to the detection loop.
+        """
+        self.__queue.put_nowait(detection_result)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def finish(self, detection_future):
+        """
+        Marks the end of the stream once the detection loop is finished, keeping its error (if any) to be raised to the
+        consumer.
+        :param detection_future: The Future of the finished detection loop.
+        """
+        self.__error = detection_future.exception()
+        self.__queue.put_nowait(END_OF_STREAM)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Stops the underlying detection loop. Results which are already queued can still be retrieved.
+        """
+        self.async_wrapper.stop()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def next(self):
+        """
+        Waits for the next detection result, or the next batch of results if batching is enabled.
+        :return: A Future resolving to the result or the list of results, or None once the stream is finished.
+        """
+
+        # Once the end of the stream is reached, report it (and the error which caused it, if any) on every call
+        if self.__finished:
+            if self.__error is not None:
+                raise self.__error
+            raise gen.Return(None)
+
+        # Without batching, simply hand over the next result
+        if self.batch_size is None and self.batch_interval is None:
+            detection_result = yield self.__queue.get()
+            if detection_result is END_OF_STREAM:
+                self.__finished = True
+                result = yield self.next()
+                raise gen.Return(result)
+            raise gen.Return(detection_result)
+
+        # Otherwise wait for the first result without a deadline, and for the rest until the batch window is closed
+        batch = []
+        deadline = None
+        while self.batch_size is None or len(batch) < self.batch_size:
+            try:
+                detection_result = yield self.__queue.get(timeout = deadline)
+            except gen.TimeoutError:
+                break
+            if detection_result is END_OF_STREAM:
+                self.__finished = True
+                break
+            batch.append(detection_result)
+            if deadline is None and self.batch_interval is not None:
+                deadline = IOLoop.current().time() + self.batch_interval
+
+        if len(batch) == 0:
+            result = yield self.next()
+            raise gen.Return(result)
+        raise gen.Return(batch)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def iterate(result_queue, batch_size = None, batch_interval = None):
+    """
+    Synchronous counterpart of DetectionStream.next(): Yields results, or batches of results, taken from a thread-safe
+    queue until END_OF_STREAM is received.
+    :param result_queue: The Queue.Queue instance fed by the detection loop.
+    :param batch_size: (Optional) The maximum number of results in a batch.
+    :param batch_interval: (Optional) The maximum number of seconds between the first result of a batch and the moment
+                           the batch is yielded.
+    """
+
+    # Without batching, simply hand over the results one by one
+    if batch_size is None and batch_interval is None:
+        while True:
+            detection_result = result_queue.get()
+            if detection_result is END_OF_STREAM:
+                return
+            yield detection_result
+
+    # Otherwise wait for the first result of every batch without a deadline, and for the rest until the window is closed
+    finished = False
+    while not finished:
+        batch = []
+        deadline = None
+        while batch_size is None or len(batch) < batch_size:
+            try:
+                if deadline is None:
+                    detection_result = result_queue.get()
+                else:
+                    detection_result = result_queue.get(timeout = max(deadline - time.time(), 0))
+            except Empty:
+                break
+            if detection_result is END_OF_STREAM:
+                finished = True
+                break
+            batch.append(detection_result)
+            if deadline is None and batch_interval is not None:
+                deadline = time.time() + batch_interval
+        if len(batch) > 0:
+            yield batch
\ No newline at end of file
@@ -0,0 +1,367 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Local stand-in for the aerial DevKit API, for load and latency testing without hardware."""
+
+
+import email.utils
+import json
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from threading import Thread, Event
+
+from tornado import gen, web, websocket
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def format_date(date):
+    """
+    Formats a naive UTC datetime object the way the DevKit API does.
+    """
+    return date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DevKitStub:
+    """
+    A fake DevKit implementing the profile, training and initialization endpoints as well as the detection web socket
+    in memory. Its behavior under load is configurable:
+
+        rate               Detection messages sent per second on every web socket.
+        payload_size       Number of padding bytes added to every detection message.
+        latency            Seconds every REST request is delayed by.
+        error_rate         Probability of a REST request failing with a standard aerial API error.
+        drop_rate          Probability of a web socket connection being dropped (without a close handshake) after
+                           any message.
+        profiles           Number of profiles the DevKit starts with.
+        training_sets      Number of training sets every initial profile has.
+        training_duration  Seconds recording a training set takes.
+        session_expiry     Seconds after which a detection session expires, or None for sessions which never expire.
+                           Once expired, connections are closed with a 'session_expired' error and new ones are
+                           rejected with a 'not_initialized' error until the DevKit is initialized again.
+
+    Every detection message carries the time it was sent at under the 'timestamp' key, so that clients can measure
+    end-to-end latency. The profile list supports conditional requests by ETag as well as by modification time.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, rate = 10, payload_size = 0, latency = 0, error_rate = 0, drop_rate = 0, profiles = 3,
+                 training_sets = 2, training_duration = 0.1, session_expiry = None):
+        self.rate = rate
+        self.payload_size = payload_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.training_duration = training_duration
+        self.session_expiry = session_expiry
+        self.session_expires_at = None
+        self.profiles = {}
+        self.modified_at = int(time.time())
+        self.port = None
+        self.__io_loop = None
+        self.__thread = None
+
+        # Create the initial profiles, with training sets recorded a minute apart
+        now = datetime.utcnow()
+        for number in range(profiles):
+            name = 'profile{0}'.format(number)
+            dates = [format_date(now - timedelta(minutes = training_sets - index)) for index in range(training_sets)]
+            self.profiles[name] = {
+                'name': name,
+                'enabled': True,
+                'trainingSets': [{ 'date': date } for date in dates]
+            }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def application(self):
+        """
+        :return: The tornado web application serving the stub API under /api.
+        """
+        return web.Application([
+            (r'/api/profiles/', ProfilesHandler, { 'stub': self }),
+            (r'/api/profiles/([^/]+)/training-sets/', TrainingSetsHandler, { 'stub': self }),
+            (r'/api/profiles/([^/]+)', ProfileHandler, { 'stub': self }),
+            (r'/api/initialization/(home|room)', InitializationHandler, { 'stub': self }),
+            (r'/api/detection', DetectionHandler, { 'stub': self })
+        ])
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def listen(self, port = 80, address = '127.0.0.1'):
+        """
+        Starts serving the stub API on the current IOLoop.
+        :param port: The port to listen on, or 0 to pick a free one.
+        :param address: The address to listen on.
+        :return: The port actually listened on.
+        """
+        sockets = bind_sockets(port, address)
+        server = HTTPServer(self.application())
+        server.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+        return self.port
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def start(self, port = 0, address = '127.0.0.1'):
+        """
+        Starts serving the stub API on a background thread with its own IOLoop.
+        :return: The port actually listened on.
+        """
+        started = Event()
+
+        def __run():
+            self.__io_loop = IOLoop()
+            self.__io_loop.make_current()
+            self.listen(port, address)
+            started.set()
+            self.__io_loop.start()
+            self.__io_loop.close(all_fds = True)
+
+        self.__thread = Thread(target = __run)
+        self.__thread.daemon = True
+        self.__thread.start()
+        started.wait()
+        return self.port
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Stops a stub started by start() and waits for its thread to finish.
+        """
+        if self.__io_loop is not None:
+            self.__io_loop.add_callback(self.__io_loop.stop)
+            self.__thread.join()
+            self.__io_loop = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def modified(self):
+        """
+        Records a change of the profiles, at the one-second resolution of the Last-Modified header.
+        """
+        self.modified_at = int(time.time())
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def session_active(self):
+        """
+        :return: Whether the DevKit is initialized and its detection session has not expired.
+        """
+        return self.session_expires_at is not None and time.time() < self.session_expires_at
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def detection_message(self):
+        """
+        :return: A JSON encoded detection message naming one of the enabled profiles.
+        """
+        enabled = [name for name, profile in self.profiles.items() if profile['enabled']]
+        message = {
+            'results': random.choice(enabled) if len(enabled) > 0 else 'Nobody',
+            'timestamp': time.time()
+        }
+        if self.payload_size > 0:
+            message['padding'] = 'x' * self.payload_size
+        return json.dumps(message)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def error_document(type, message):
+    """
+    :return: A standard aerial API error document.
+    """
+    return json.dumps({ 'error': { 'type': type, 'message': message } })
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class StubHandler(web.RequestHandler):
+    """
+    Base class for the REST handlers of the stub, applying its latency and error injection to every request.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, stub):
+        self.stub = stub
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def prepare(self):
+        if self.stub.latency > 0:
+            yield gen.sleep(self.stub.latency)
+        if random.random() < self.stub.error_rate:
+            self.fail(500, 'internal_error', 'Injected error.')
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def fail(self, status, type, message):
+        self.set_status(status)
+        self.finish(error_document(type, message))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def profile(self, name):
+        profile = self.stub.profiles.get(name, None)
+        if profile is None:
+            self.fail(404, 'profile_not_found', 'Profile "{0}" does not exist.'.format(name))
+        return profile
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ProfilesHandler(StubHandler):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def get(self):
+        self.set_header('Last-Modified', email.utils.formatdate(self.stub.modified_at, usegmt = True))
+        since = self.request.headers.get('If-Modified-Since', None)
+        if since is not None and 'If-None-Match' not in self.request.headers:
+            since = email.utils.parsedate_tz(since)
+            if since is not None and email.utils.mktime_tz(since) >= self.stub.modified_at:
+                self.set_status(304)
+                self.finish()
+                return
+        self.finish(json.dumps(sorted(self.stub.profiles.values(), key = lambda profile: profile['name'])))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def delete(self):
+        self.stub.profiles.clear()
+        self.stub.modified()
+        self.stub.session_expires_at = None
+        self.set_status(204)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ProfileHandler(StubHandler):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def put(self, name):
+        profile = self.profile(name)
+        if profile is not None:
+            profile['enabled'] = bool(json.loads(self.request.body)['enabled'])
+            self.stub.modified()
+            self.finish(json.dumps(profile))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TrainingSetsHandler(StubHandler):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def post(self, name):
+        yield gen.sleep(self.stub.training_duration)
+        profile = self.stub.profiles.setdefault(name, { 'name': name, 'enabled': True, 'trainingSets': [] })
+        training_set = { 'date': format_date(datetime.utcnow()) }
+        profile['trainingSets'].append(training_set)
+        self.stub.modified()
+        self.finish(json.dumps(training_set))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class InitializationHandler(StubHandler):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def post(self, mode):
+        result = { 'profiles': [name for name, profile in self.stub.profiles.items() if profile['enabled']] }
+        if self.stub.session_expiry is not None:
+            self.stub.session_expires_at = time.time() + self.stub.session_expiry
+            result['expiry'] = format_date(datetime.utcfromtimestamp(self.stub.session_expires_at))
+        else:
+            self.stub.session_expires_at = float('inf')
+        self.finish(json.dumps(result))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionHandler(websocket.WebSocketHandler):
+    """
+    Sends detection messages at the configured rate, in bursts if the IOLoop falls behind, until the connection is
+    closed, dropped or the detection session expires.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, stub):
+        self.stub = stub
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def get(self, *args, **kwargs):
+        if not self.stub.session_active():
+            self.set_status(403)
+            self.finish(error_document('not_initialized', 'Detection has not been initialized.'))
+            return
+        return super(DetectionHandler, self).get(*args, **kwargs)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def open(self):
+        IOLoop.current().spawn_callback(self.__send)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __send(self):
+        interval = 1.0 / self.stub.rate
+        next_time = IOLoop.current().time()
+        while self.ws_connection is not None:
+            if not self.stub.session_active():
+                self.close(4000, error_document('session_expired', 'The detection session has expired.'))
+                return
+            if random.random() < self.stub.drop_rate:
+                self.ws_connection.stream.close()
+                return
+            try:
+                self.write_message(self.stub.detection_message())
+            except websocket.WebSocketClosedError:
+                return
+            next_time += interval
+            delay = next_time - IOLoop.current().time()
+            if delay > 0:
+                yield gen.sleep(delay)
+            else:
+                yield gen.moment
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def main():
+    """
+    Runs the stub DevKit until interrupted.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--port', type = int, default = 8080, help = 'Port to listen on (default: 8080)')
+    parser.add_argument('--address', type = str, default = '127.0.0.1', help = 'Address to listen on')
+    parser.add_argument('--rate', type = float, default = 10, help = 'Detection messages per second')
+    parser.add_argument('--payload-size', type = int, default = 0, help = 'Padding bytes per detection message')
+    parser.add_argument('--latency', type = float, default = 0, help = 'Seconds added to every REST request')
+    parser.add_argument('--error-rate', type = float, default = 0, help = 'Probability of a REST request failing')
+    parser.add_argument('--drop-rate', type = float, default = 0, help = 'Probability of dropping the connection '
+                                                                          'after a detection message')
+    parser.add_argument('--profiles', type = int, default = 3, help = 'Number of initial profiles')
+    parser.add_argument('--training-sets', type = int, default = 2, help = 'Training sets per initial profile')
+    parser.add_argument('--training-duration', type = float, default = 45, help = 'Seconds a training takes')
+    parser.add_argument('--session-expiry', type = float, default = None, help = 'Seconds a detection session lasts')
+    arguments = parser.parse_args()
+
+    stub = DevKitStub(arguments.rate, arguments.payload_size, arguments.latency, arguments.error_rate,
+                      arguments.drop_rate, arguments.profiles, arguments.training_sets, arguments.training_duration,
+                      arguments.session_expiry)
+    port = stub.listen(arguments.port, arguments.address)
+    print 'Stub DevKit listening on {0}:{1}. Press Ctrl+C to stop.'.format(arguments.address, port)
+    try:
+        IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# If the script is run directly, simply run the main function.
+if __name__ == '__main__':
+    main()
\ No newline at end of file
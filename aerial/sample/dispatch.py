@@ -0,0 +1,204 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Bounded hand-over of detection results from the websocket loop to a listener."""
+
+
+from collections import deque
+from threading import Condition
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_COALESCE = 'coalesce'
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionDispatcher:
+    """
+    A stage between the detection loop and a listener, so that a slow listener does not stall reading the web socket.
+    Its put() method is to be passed to the detection loop as the listener; results are queued up to max_size and
+    handed over to the actual listener either by worker threads (if workers is positive) or by callbacks on the
+    IOLoop, interleaved with reading the socket. What happens once the queue is full depends on the overflow policy:
+
+        OVERFLOW_BLOCK        put() returns a Future which the detection loop waits for before it reads on, so
+                              that nothing is lost and the server is slowed down instead.
+        OVERFLOW_DROP_OLDEST  The oldest queued result is dropped to make room for the new one.
+        OVERFLOW_COALESCE     All queued results are dropped in favor of the new one, i.e. the listener only gets to
+                              see the latest result.
+
+    With more than one worker, results may be handed over out of order. Exceptions raised by the listener are logged
+    and counted, without stopping the dispatcher. Counters are available through stats().
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, listener, max_size = 1000, overflow = OVERFLOW_BLOCK, workers = 0):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE):
+            raise ValueError('Unknown overflow policy: {0}'.format(overflow))
+        self.listener = listener
+        self.max_size = max_size
+        self.overflow = overflow
+        self.workers = workers
+        self.delivered = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.__queue = deque()
+        self.__waiting = deque()
+        self.__condition = Condition()
+        self.__closed = False
+        self.__draining = False
+        self.__executor = None
+        if workers > 0:
+            self.__executor = ThreadPoolExecutor(max_workers = workers)
+            for _ in range(workers):
+                self.__executor.submit(self.__work)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def put(self, detection_result):
+        """
+        Queues a detection result for the listener, applying the overflow policy if the queue is full. Must be called
+        on an IOLoop.
+        :return: None, or a Future to be waited for before the next result is put if the queue is full and the
+                 overflow policy is OVERFLOW_BLOCK.
+        """
+        with self.__condition:
+            if len(self.__queue) >= self.max_size:
+                if self.overflow == OVERFLOW_BLOCK:
+                    self.blocked += 1
+                    room = Future()
+                    self.__waiting.append((detection_result, room, IOLoop.current()))
+                    return room
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.__queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += len(self.__queue)
+                    self.__queue.clear()
+            self.__enqueue(detection_result)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def depth(self):
+        """
+        :return: The number of results currently waiting to be handed over to the listener.
+        """
+        return len(self.__queue)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        """
+        :return: A dictionary with the current queue depth, its high-water mark, and the numbers of delivered, dropped
+                 and blocked results as well as listener errors.
+        """
+        with self.__condition:
+            return {
+                'depth': len(self.__queue),
+                'max_depth': self.max_depth,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'blocked': self.blocked,
+                'errors': self.errors
+            }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self, wait = True):
+        """
+        Stops accepting results and shuts the worker threads down once the queue is drained.
+        :param wait: Whether to block until the worker threads are finished.
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait = wait)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __enqueue(self, detection_result):
+        """
+        Appends a result to the queue and wakes up a consumer. Must be called while holding the condition's lock.
+        """
+        self.__queue.append(detection_result)
+        self.max_depth = max(self.max_depth, len(self.__queue))
+        if self.__executor is not None:
+            self.__condition.notify()
+        elif not self.__draining:
+            self.__draining = True
+            IOLoop.current().add_callback(self.__drain)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __take(self):
+        """
+        Takes the next result off the queue, letting a blocked result in if there is one. Must be called while holding
+        the condition's lock on a non-empty queue.
+        """
+        detection_result = self.__queue.popleft()
+        if len(self.__waiting) > 0:
+            waiting_result, room, io_loop = self.__waiting.popleft()
+            self.__queue.append(waiting_result)
+            io_loop.add_callback(room.set_result, None)
+        return detection_result
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __deliver(self, detection_result):
+        """
+        Passes a result to the listener, logging any exception it raises.
+        """
+        try:
+            self.listener(detection_result)
+        except Exception:
+            app_log.exception('Exception in detection listener')
+            with self.__condition:
+                self.errors += 1
+        else:
+            with self.__condition:
+                self.delivered += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __drain(self):
+        """
+        Hands over one result on the IOLoop and schedules itself again while the queue is not empty, so that reading
+        the socket can go on in between.
+        """
+        with self.__condition:
+            if len(self.__queue) == 0:
+                self.__draining = False
+                return
+            detection_result = self.__take()
+        self.__deliver(detection_result)
+        IOLoop.current().add_callback(self.__drain)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __work(self):
+        """
+        The loop run by every worker thread, handing over results until the dispatcher is closed and drained.
+        """
+        while True:
+            with self.__condition:
+                while len(self.__queue) == 0 and not self.__closed:
+                    self.__condition.wait()
+                if len(self.__queue) == 0:
+                    return
+                detection_result = self.__take()
+            self.__deliver(detection_result)
\ No newline at end of file
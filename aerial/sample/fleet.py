@@ -0,0 +1,157 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Detection across many DevKits on a single event loop."""
+
+
+import signal
+from threading import Thread
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from aerial.sample.api_wrapper import AsyncApiWrapper
+from aerial.sample.connection_pool import KeepAliveHTTPClient
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionFleet:
+    """
+    Runs the detection loops of several DevKits on one IOLoop and one thread, instead of one thread and one IOLoop
+    per DevKit as ApiWrapper.detect() does. Every detection result passed to the listener is tagged with the address
+    of the DevKit it was received from under the 'server' key. All DevKits share a single keep-alive HTTP client
+    whose number of concurrent requests is capped by max_concurrency. Like ApiWrapper, the blocking methods of an
+    instance must not be used from several threads at the same time. See AsyncApiWrapper for lazy_results and
+    metrics.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, servers, port, max_concurrency = 50, lazy_results = False, metrics = None):
+        self.servers = list(servers)
+        self.port = port
+        self.io_loop = IOLoop(make_current = False)
+        self.errors = {}
+        self.__stopped = False
+
+        # Create the shared client and the asynchronous wrappers while the IOLoop is current, so that they are bound
+        # to it.
+        @gen.coroutine
+        def __create():
+            self.client = KeepAliveHTTPClient(force_instance = True, max_clients = max_concurrency)
+            raise gen.Return([AsyncApiWrapper(server, port, max_concurrency, self.client, lazy_results = lazy_results,
+                                              metrics = metrics)
+                              for server in self.servers])
+        self.async_wrappers = self.io_loop.run_sync(__create)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the shared HTTP client and the IOLoop. The instance cannot be used afterwards.
+        """
+        self.client.close()
+        self.io_loop.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def remove(self, servers):
+        """
+        Leaves the specified DevKits out of the fleet, e.g. the ones which failed to initialize. This method must not be
+        called while the detection loops are running.
+        :param servers: The addresses of the DevKits to be removed.
+        """
+        servers = set(servers)
+        self.async_wrappers = [async_wrapper for async_wrapper in self.async_wrappers
+                               if async_wrapper.server not in servers]
+        self.servers = [async_wrapper.server for async_wrapper in self.async_wrappers]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, mode):
+        """
+        Initializes all DevKits for the specified detection mode concurrently, and blocks until all of them respond.
+        :param mode: A string with the value of 'home' or 'room'.
+        :return: A dictionary mapping every server address either to its initialization result or to the exception
+                 raised while initializing it.
+        """
+
+        @gen.coroutine
+        def __initialize(async_wrapper):
+            try:
+                result = yield async_wrapper.initialize(mode)
+            except Exception as error:
+                result = error
+            raise gen.Return(result)
+
+        @gen.coroutine
+        def __initialize_all():
+            results = yield [__initialize(async_wrapper) for async_wrapper in self.async_wrappers]
+            raise gen.Return(dict(zip(self.servers, results)))
+
+        return self.io_loop.run_sync(__initialize_all)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def detect(self, listener, reconnect_policy = None, event_listener = None):
+        """
+        Establishes the web socket connections to all DevKits and passes every detection result, tagged with its
+        source server, to the specified callback function. A DevKit whose loop fails, including once its connection is
+        lost for good, does not affect the others: the exception is kept in the errors dictionary under its address and
+        reported to the event listener as a 'failed' event (with its 'error'). Only once the loops of all DevKits have
+        failed is SIGALRM sent to shutdown, as ApiWrapper.detect() does once its connection is lost.
+        :param listener: The callback function which is called with the detection result as the sole argument every
+        time it is received from any of the DevKits.
+        :param reconnect_policy: (Optional) A ReconnectPolicy instance applied to every DevKit separately.
+        :param event_listener: (Optional) The callback function for connection events, which are tagged with their
+                               source server as well. See AsyncApiWrapper.detect().
+        :return: The thread on which the web socket loops are run. It is finished once all loops are stopped.
+        """
+
+        @gen.coroutine
+        def __detect(async_wrapper):
+            def __tagged_listener(detection_result):
+                detection_result['server'] = async_wrapper.server
+                return listener(detection_result)
+            try:
+                yield async_wrapper.detect(__tagged_listener, reconnect_policy, event_listener,
+                                           shutdown_on_loss = False)
+            except Exception as error:
+                self.errors[async_wrapper.server] = error
+                if event_listener is not None:
+                    event_listener({ 'event': 'failed', 'server': async_wrapper.server,
+                                     'error': getattr(error, 'message', None) or str(error) })
+
+        @gen.coroutine
+        def __detect_all():
+            yield [__detect(async_wrapper) for async_wrapper in self.async_wrappers]
+            if not self.__stopped:
+                print '\nConnection with all aerial Devkits lost.\n'
+                signal.alarm(1) # send SIGALRM to shutdown via our signal handler
+
+        # Create the thread to run the event loop, start it, and return it
+        self.__stopped = False
+        loop_thread = Thread(target = lambda: self.io_loop.run_sync(__detect_all))
+        loop_thread.start()
+        return loop_thread
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Sends a stop signal to all detection loops. This method returns immediately, typically before the loops are
+        actually stopped, and may be called from any thread.
+        """
+        self.__stopped = True
+        for async_wrapper in self.async_wrappers:
+            self.io_loop.add_callback(async_wrapper.stop)
\ No newline at end of file
@@ -0,0 +1,177 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Client-side cache of detection initializations, kept across runs."""
+
+
+import calendar
+import hashlib
+import json
+import os
+import tempfile
+import time
+from threading import Lock
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def default_path():
+    """
+    :return: The path of the file in which initializations are cached by default, shared by all runs of the
+             application by the current user: aerial/initialization.json in $XDG_CACHE_HOME, or in ~/.cache if it is not
+             set.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME', None) or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'aerial', 'initialization.json')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def profiles_fingerprint(profiles):
+    """
+    Computes a fingerprint of the profiles a detection session would be initialized with: the enabled profiles along
+    with their training sets, so that enabling, disabling, training or resetting a profile changes the fingerprint.
+    :param profiles: The list of profiles, as returned by list_profiles().
+    :return: The fingerprint as a hexadecimal string.
+    """
+    enabled = sorted((profile for profile in profiles if profile.get('enabled', False)),
+                     key = lambda profile: profile['name'])
+    return hashlib.sha1(json.dumps(enabled, sort_keys = True)).hexdigest()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def expiry_timestamp(expiry):
+    """
+    Converts the expiry date of an initialization result, a naive UTC date such as "2016-06-01T12:30:00.000Z", into
+    seconds since the epoch.
+    :return: The timestamp, or None if the initialization result has no expiry date or it cannot be parsed.
+    """
+    if not expiry:
+        return None
+    try:
+        return calendar.timegm(time.strptime(expiry[:19].replace(' ', 'T'), '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class InitializationCache:
+    """
+    Keeps the results of detection initializations in a JSON file, keyed by the server, the detection mode and the
+    fingerprint of the enabled profiles (see profiles_fingerprint()), so that a later run can skip initializing a
+    detection session which is still alive on the server. An entry is only served until margin seconds before the
+    expiry date the server returned for it; results without an expiry date are not cached, since there is no telling
+    how long the server keeps them. Initializing a server in one mode replaces its entries for every mode, as a DevKit
+    runs a single detection session at a time. The file is replaced atomically, so concurrent runs never see a partial
+    one; the last writer wins. Since it holds live sessions, only its owner can read it (mode 0600), and its directory
+    is created with mode 0700.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path = None, margin = 5):
+        self.path = path if path is not None else default_path()
+        self.margin = margin
+        self.hits = 0
+        self.misses = 0
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def get(self, server, mode):
+        """
+        Looks up the cached initialization of the server for the mode, which is only to be reused if the profile
+        fingerprint it was stored with (its 'fingerprint') matches the current one. Looking it up does not count as a
+        hit or a miss, since that depends on the fingerprint.
+        :return: The entry, a dictionary with the 'fingerprint' and the initialization 'result', or None if there is
+                 none or it is about to expire.
+        """
+        with self.__lock:
+            entry = self.__load().get(server, None)
+        if entry is None or entry['mode'] != mode or entry['expires_at'] - self.margin <= time.time():
+            return None
+        return entry
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def cacheable(result):
+        """
+        Tells whether an initialization result can be cached, i.e. whether it has an expiry date.
+        """
+        return expiry_timestamp(result.get('expiry', None)) is not None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def store(self, server, mode, fingerprint, result):
+        """
+        Caches the result of a fresh initialization, replacing any other entry of the server.
+        """
+        expires_at = expiry_timestamp(result.get('expiry', None))
+        with self.__lock:
+            entries = self.__load()
+            if expires_at is not None:
+                entries[server] = {
+                    'mode': mode,
+                    'fingerprint': fingerprint,
+                    'expires_at': expires_at,
+                    'result': result
+                }
+            elif entries.pop(server, None) is None:
+                return
+            self.__save(entries)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def invalidate(self, server):
+        """
+        Drops the cached initialization of the server, e.g. once it turns out that its session no longer exists.
+        """
+        with self.__lock:
+            entries = self.__load()
+            if entries.pop(server, None) is not None:
+                self.__save(entries)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __load(self):
+        """
+        Reads the entries of all servers, dropping the expired ones. A missing or unreadable file is treated as empty.
+        """
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+        now = time.time()
+        return dict((server, entry) for server, entry in entries.items() if entry['expires_at'] > now)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __save(self, entries):
+        """
+        Writes the entries of all servers through a temporary file, which then replaces the cache file. Failing to
+        write the cache is not an error, it only means the next run initializes again.
+        """
+        directory, name = os.path.split(os.path.abspath(self.path))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            # Created with mode 0600, which the cache file keeps once renamed
+            descriptor, temporary_path = tempfile.mkstemp(prefix = name + '.', dir = directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(descriptor, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(temporary_path, self.path)
+        except (IOError, OSError):
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
\ No newline at end of file
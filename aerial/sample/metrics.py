@@ -0,0 +1,383 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""In-process client metrics, exposed as snapshots and in the Prometheus text format."""
+
+
+import bisect
+from threading import Thread, Event, Lock
+
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class CounterValue:
+    """
+    A monotonically increasing value.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.value = 0
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def inc(self, amount = 1):
+        with self.__lock:
+            self.value += amount
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def sample(self):
+        return self.value
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class GaugeValue:
+    """
+    A value which may be set to anything.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.value = 0
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def set(self, value):
+        self.value = value
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def sample(self):
+        return self.value
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class HistogramValue:
+    """
+    A distribution of observed values, counted in buckets with fixed upper bounds as Prometheus histograms are.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def sample(self):
+        """
+        :return: A dictionary with the count and the sum of the observed values, and a list of (upper bound, count)
+                 pairs with the cumulative count of every bucket, the last one having an infinite upper bound.
+        """
+        with self.__lock:
+            counts = list(self.counts)
+            result = { 'count': self.count, 'sum': self.sum }
+        cumulative = 0
+        buckets = []
+        for upper_bound, count in zip(list(self.buckets) + [float('inf')], counts):
+            cumulative += count
+            buckets.append((upper_bound, cumulative))
+        result['buckets'] = buckets
+        return result
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class Metric:
+    """
+    A named metric with zero or more labels. Every combination of label values has a value of its own, created when it
+    is first used through labels(). A metric without labels can be used as its only value directly.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, name, type, help, label_names, create_value):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.__create_value = create_value
+        self.__lock = Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def labels(self, *label_values):
+        """
+        :return: The value for the given label values, in the order of the label names.
+        """
+        value = self.values.get(label_values)
+        if value is None:
+            with self.__lock:
+                value = self.values.setdefault(label_values, self.__create_value())
+        return value
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __getattr__(self, name):
+        # Delegate inc(), set() and observe() of an unlabelled metric to its only value
+        if name.startswith('__') or len(self.label_names) > 0:
+            raise AttributeError(name)
+        return getattr(self.labels(), name)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class MetricsRegistry:
+    """
+    A collection of metrics which can be read as a snapshot or rendered in the Prometheus text exposition format.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.metrics = []
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def counter(self, name, help, label_names = ()):
+        return self.__register(Metric(name, 'counter', help, label_names, CounterValue))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def gauge(self, name, help, label_names = ()):
+        return self.__register(Metric(name, 'gauge', help, label_names, GaugeValue))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def histogram(self, name, help, label_names = (), buckets = DEFAULT_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self.__register(Metric(name, 'histogram', help, label_names, lambda: HistogramValue(buckets)))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """
+        :return: A dictionary mapping every metric name to a list of its values, each being a dictionary with the
+                 'labels' (a dictionary of label names and values) and either the 'value' of a counter or a gauge, or
+                 the 'count', 'sum' and 'buckets' of a histogram (see HistogramValue.sample()).
+        """
+        snapshot = {}
+        for metric in self.metrics:
+            samples = []
+            for label_values, value in sorted(metric.values.items()):
+                sample = value.sample()
+                if not isinstance(sample, dict):
+                    sample = { 'value': sample }
+                sample['labels'] = dict(zip(metric.label_names, label_values))
+                samples.append(sample)
+            snapshot[metric.name] = samples
+        return snapshot
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def prometheus_text(self):
+        """
+        :return: The current values of all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for label_values, value in sorted(metric.values.items()):
+                labels = zip(metric.label_names, label_values)
+                sample = value.sample()
+                if metric.type != 'histogram':
+                    lines.append('{0}{1} {2}'.format(metric.name, format_labels(labels), format_number(sample)))
+                    continue
+                for upper_bound, count in sample['buckets']:
+                    bucket_labels = labels + [('le', format_number(upper_bound))]
+                    lines.append('{0}_bucket{1} {2}'.format(metric.name, format_labels(bucket_labels), count))
+                lines.append('{0}_sum{1} {2}'.format(metric.name, format_labels(labels), format_number(sample['sum'])))
+                lines.append('{0}_count{1} {2}'.format(metric.name, format_labels(labels), sample['count']))
+        return '\n'.join(lines) + '\n'
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def format_labels(labels):
+    """
+    Formats (name, value) pairs as a Prometheus label set, or returns an empty string if there are none.
+    """
+    if len(labels) == 0:
+        return ''
+    escaped = [(name, unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels]
+    return '{' + ','.join(u'{0}="{1}"'.format(name, value) for name, value in escaped).encode('utf-8') + '}'
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def format_number(number):
+    """
+    Formats a number as Prometheus expects it.
+    """
+    if number == float('inf'):
+        return '+Inf'
+    return repr(number) if isinstance(number, float) else str(number)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ClientMetrics:
+    """
+    The metrics recorded by AsyncApiWrapper: Per-endpoint request durations and errors, and for every DevKit the number,
+    size, inter-arrival times and rate of detection messages, the time of the last one (to detect stalls), and the time
+    spent in the detection listener. One instance may be shared by several wrappers, e.g. in a DetectionFleet.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, registry = None, rate_interval = 1.0):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.rate_interval = rate_interval
+        self.request_duration = self.registry.histogram(
+            'aerial_request_duration_seconds', 'Duration of API requests.', ('server', 'method', 'endpoint'))
+        self.request_errors = self.registry.counter(
+            'aerial_request_errors_total', 'Failed API requests.', ('server', 'method', 'endpoint', 'type'))
+        self.messages = self.registry.counter(
+            'aerial_detection_messages_total', 'Detection messages received.', ('server',))
+        self.message_bytes = self.registry.counter(
+            'aerial_detection_received_bytes_total', 'Size of the detection messages received.', ('server',))
+        self.message_interval = self.registry.histogram(
+            'aerial_detection_message_interval_seconds', 'Time between consecutive detection messages.', ('server',))
+        self.message_rate = self.registry.gauge(
+            'aerial_detection_message_rate', 'Detection messages received per second, recently.', ('server',))
+        self.last_message = self.registry.gauge(
+            'aerial_detection_last_message_timestamp_seconds', 'Time of the last detection message.', ('server',))
+        self.listener_duration = self.registry.histogram(
+            'aerial_listener_duration_seconds', 'Time spent handling a detection result.', ('server',))
+        self.__rate_windows = {}
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def request(self, server, method, endpoint, duration, error_type = None):
+        """
+        Records a finished API request.
+        :param error_type: (Optional) The type of the error, if the request has failed.
+        """
+        self.request_duration.labels(server, method, endpoint).observe(duration)
+        if error_type is not None:
+            self.request_errors.labels(server, method, endpoint, error_type).inc()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def message(self, server, size, received_time, previous_time = None):
+        """
+        Records a received detection message.
+        :param previous_time: (Optional) The time the previous message was received on the same connection.
+        """
+        self.messages.labels(server).inc()
+        self.message_bytes.labels(server).inc(size)
+        self.last_message.labels(server).set(received_time)
+        if previous_time is not None:
+            self.message_interval.labels(server).observe(received_time - previous_time)
+
+        # Update the rate once per rate interval, from the number of messages counted during it
+        window_start, window_count = self.__rate_windows.get(server, (received_time, 0))
+        window_count += 1
+        if received_time - window_start >= self.rate_interval:
+            self.message_rate.labels(server).set(window_count / (received_time - window_start))
+            window_start, window_count = received_time, 0
+        self.__rate_windows[server] = (window_start, window_count)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def listener(self, server, duration):
+        """
+        Records the time spent in the detection listener for a single result.
+        """
+        self.listener_duration.labels(server).observe(duration)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        return self.registry.snapshot()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class MetricsHandler(web.RequestHandler):
+    """
+    Serves the metrics of a registry in the Prometheus text format.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def initialize(self, registry):
+        self.registry = registry
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def get(self):
+        self.set_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.write(self.registry.prometheus_text())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class MetricsServer:
+    """
+    A local HTTP server exposing the metrics of a registry at /metrics, run on a background thread with its own IOLoop
+    so that it keeps responding while the application blocks.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, registry):
+        self.registry = registry
+        self.port = None
+        self.__io_loop = None
+        self.__thread = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def start(self, port = 0, address = '127.0.0.1'):
+        """
+        Starts serving the metrics.
+        :param port: The port to listen on, or 0 to pick a free one.
+        :param address: The address to listen on; the local host by default.
+        :return: The port actually listened on.
+        """
+        sockets = bind_sockets(port, address)
+        self.port = sockets[0].getsockname()[1]
+        started = Event()
+
+        def __run():
+            self.__io_loop = IOLoop()
+            self.__io_loop.make_current()
+            server = HTTPServer(web.Application([(r'/metrics', MetricsHandler, { 'registry': self.registry })]))
+            server.add_sockets(sockets)
+            started.set()
+            self.__io_loop.start()
+            server.stop()
+            self.__io_loop.close(all_fds = True)
+
+        self.__thread = Thread(target = __run, name = 'MetricsServer')
+        self.__thread.daemon = True
+        self.__thread.start()
+        started.wait()
+        return self.port
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Stops the server and waits for its thread to finish.
+        """
+        if self.__io_loop is not None:
+            self.__io_loop.add_callback(self.__io_loop.stop)
+            self.__thread.join()
+            self.__io_loop = None
\ No newline at end of file
@@ -0,0 +1,161 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Client-side cache of the profile list."""
+
+
+import time
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ProfileCache:
+    """
+    Keeps the last profile list retrieved from a DevKit. Within ttl seconds of being retrieved or revalidated, the list
+    is served without contacting the server at all; afterwards, it is revalidated with a conditional GET request
+    (If-None-Match / If-Modified-Since), so that an unchanged list is not downloaded and parsed again. Changes made
+    through the same API wrapper are written through to the cached list. The cached list is shared with the callers
+    and must not be modified by them.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, ttl = 5):
+        self.ttl = ttl
+        self.profiles = None
+        self.etag = None
+        self.last_modified = None
+        self.validated_at = None
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def fresh(self):
+        """
+        :return: Whether the cached list can be served without revalidating it.
+        """
+        return self.profiles is not None and time.time() - self.validated_at < self.ttl
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def validators(self):
+        """
+        :return: The headers for a conditional request revalidating the cached list.
+        """
+        headers = {}
+        if self.profiles is not None:
+            if self.etag is not None:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified is not None:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def store(self, profiles, etag = None, last_modified = None):
+        """
+        Replaces the cached list with a freshly downloaded one.
+        """
+        self.profiles = profiles
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = time.time()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def revalidated(self):
+        """
+        Marks the cached list as fresh again after the server has confirmed it is unchanged.
+        """
+        self.validated_at = time.time()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def invalidate(self):
+        """
+        Drops the cached list, so that the next request downloads it again.
+        """
+        self.profiles = None
+        self.etag = None
+        self.last_modified = None
+        self.invalidations += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def reset(self):
+        """
+        Writes a reset of all profiles through to the cached list.
+        """
+        if self.profiles is not None:
+            self.profiles = []
+            self.etag = None
+            self.last_modified = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def change_status(self, profile_name, enabled):
+        """
+        Writes a change of the enabled status of a profile through to the cached list.
+        """
+        def __change(profiles):
+            for profile in profiles:
+                if profile['name'] == profile_name:
+                    profile['enabled'] = enabled
+                    return True
+            return False
+        self.__modify(__change)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def add_training_set(self, profile_name, training_set):
+        """
+        Writes a newly added training set through to the cached list.
+        """
+        def __add(profiles):
+            for profile in profiles:
+                if profile['name'] == profile_name:
+                    profile['trainingSets'].append(training_set)
+                    return True
+            return False
+        self.__modify(__add)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        """
+        :return: A dictionary with the numbers of hits (served without a request), revalidations (served after a
+                 conditional request), misses (downloaded) and invalidations, and the ratio of requests served from
+                 the cache.
+        """
+        served = self.hits + self.revalidations
+        total = served + self.misses
+        return {
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': float(served) / total if total > 0 else None
+        }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __modify(self, modification):
+        """
+        Applies a modification to the cached list, if any. Since the list does not match the server's representation
+        anymore, its validators are dropped; if the modification cannot be applied, the whole list is dropped.
+        :param modification: A function which modifies the list in place, returning False if it could not.
+        """
+        if self.profiles is None:
+            return
+        if modification(self.profiles):
+            self.etag = None
+            self.last_modified = None
+        else:
+            self.invalidate()
\ No newline at end of file
@@ -0,0 +1,251 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""On-demand profiling and timing spans for live processes."""
+
+
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# The SpanTracer timing the stages of detection while profiling is on, or None while it is off. Instrumented code goes
+# through start_span() and end_span(), which only look at this when it is None.
+tracer = None
+
+# The running ProfilingSession, if any
+session = None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def start_span():
+    """
+    Marks the start of a timed stage.
+    :return: The start time, or None if tracing is off.
+    """
+    if tracer is None:
+        return None
+    return time.time()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def end_span(name, start_time):
+    """
+    Records the duration of a timed stage, if tracing was on when it started and still is.
+    :param name: The name of the stage, e.g. 'decode'.
+    :param start_time: The value returned by start_span().
+    """
+    if start_time is not None:
+        current_tracer = tracer
+        if current_tracer is not None:
+            current_tracer.record(name, time.time() - start_time)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SpanTracer:
+    """
+    Aggregates the durations of timed stages (spans) by name: their count, total and maximum. Spans may be recorded
+    from any thread.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.spans = {}
+        self.__lock = threading.Lock()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def record(self, name, duration):
+        with self.__lock:
+            span = self.spans.get(name, None)
+            if span is None:
+                self.spans[name] = [1, duration, duration]
+            else:
+                span[0] += 1
+                span[1] += duration
+                if duration > span[2]:
+                    span[2] = duration
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """
+        :return: A dictionary mapping the name of every span to a dictionary with its 'count', and the 'total', 'mean'
+                 and 'max' duration in seconds.
+        """
+        with self.__lock:
+            return dict((name, { 'count': count, 'total': total, 'mean': total / count, 'max': maximum })
+                        for name, (count, total, maximum) in self.spans.items())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SamplingProfiler:
+    """
+    Samples the call stacks of all other threads every interval seconds on a thread of its own, counting how often
+    every stack is seen. Unlike cProfile, which only profiles the thread it is enabled on, this covers the detection
+    loop, the dispatcher and the renderer alike, and costs nothing while it is not running. Stacks are kept in the
+    collapsed format of flame graph tools: the thread name and the frames from the outermost one, separated by
+    semicolons.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def start(self):
+        self.__thread = threading.Thread(target = self.__run, name = 'SamplingProfiler')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write(self, stream):
+        """
+        Writes the collapsed stacks with their counts, one per line, the most frequent first.
+        """
+        for stack, count in self.samples.most_common():
+            stream.write('{0} {1}\n'.format(stack, count))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __run(self):
+        own_id = threading.current_thread().ident
+        while not self.__stopped.wait(self.interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[self.__collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.sample_count += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __collapse(self, thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ';'.join(reversed(frames))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ProfilingSession:
+    """
+    A sampling profiler running along with span tracing, whose results are written into two files once it is stopped:
+    <name>.folded with the sampled stacks (see SamplingProfiler) and <name>.spans with the span statistics, the name
+    being made of the process id, the start time and a random part. Since the temporary directory they are written to
+    by default is shared with other users, the files are created with mode 0600 and never in place of an existing file
+    or symbolic link, and their names cannot be guessed in advance.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, directory = None, interval = 0.005):
+        self.directory = directory
+        self.prefix = 'aerial-profile-{0}-{1}-'.format(os.getpid(), time.strftime('%Y%m%d-%H%M%S'))
+        self.profiler = SamplingProfiler(interval)
+        self.tracer = SpanTracer()
+        self.start_time = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def start(self):
+        global tracer
+        self.start_time = time.time()
+        tracer = self.tracer
+        self.profiler.start()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        """
+        Stops profiling and tracing, and writes the results.
+        :return: The paths of the files written.
+        """
+        global tracer
+        tracer = None
+        self.profiler.stop()
+        duration = time.time() - self.start_time
+        import tempfile
+        descriptor, stacks_path = tempfile.mkstemp(suffix = '.folded', prefix = self.prefix, dir = self.directory)
+        spans_path = stacks_path[:-len('.folded')] + '.spans'
+        with os.fdopen(descriptor, 'w') as stacks_file:
+            self.profiler.write(stacks_file)
+        with create_private_file(spans_path) as spans_file:
+            spans_file.write('# {0:.1f}s, {1} samples\n'.format(duration, self.profiler.sample_count))
+            spans_file.write('{0:<16}{1:>10}{2:>14}{3:>14}{4:>14}\n'.format('span', 'count', 'total (s)', 'mean (ms)',
+                                                                             'max (ms)'))
+            spans = self.tracer.snapshot()
+            for name in sorted(spans, key = lambda name: -spans[name]['total']):
+                span = spans[name]
+                spans_file.write('{0:<16}{1:>10}{2:>14.3f}{3:>14.3f}{4:>14.3f}\n'.format(
+                    name, span['count'], span['total'], span['mean'] * 1000, span['max'] * 1000))
+        return [stacks_path, spans_path]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def create_private_file(path):
+    """
+    Creates a new file which only the current user can read and write.
+    :return: The file, opened for writing.
+    :raise OSError: If the path exists already, even as a symbolic link.
+    """
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600), 'w')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def toggle(directory = None):
+    """
+    Starts a profiling session, or stops the running one and writes its results.
+    :param directory: (Optional) The directory of the result files; the temporary directory by default.
+    :return: The paths of the files written, or None if a session has been started.
+    """
+    global session
+    if session is None:
+        session = ProfilingSession(directory)
+        session.start()
+        return None
+    stopped, session = session, None
+    return stopped.stop()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def install(signal_number = signal.SIGUSR1, directory = None):
+    """
+    Installs a handler toggling profiling sessions (see toggle()) whenever the process receives the given signal, e.g.
+    through "kill -USR1 <pid>", and reporting where the results are written in the console.
+    """
+    def handler(signal_number, stack_frame):
+        try:
+            paths = toggle(directory)
+        except (IOError, OSError) as error:
+            sys.stderr.write('\nProfiling stopped; results could not be written: {0}.\n'.format(error))
+            return
+        if paths is None:
+            sys.stderr.write('\nProfiling started.\n')
+        else:
+            sys.stderr.write('\nProfiling stopped; results written to {0}.\n'.format(' and '.join(paths)))
+    signal.signal(signal_number, handler)
\ No newline at end of file
@@ -0,0 +1,239 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Append-only recording of detection results, and indexed replay of recordings."""
+
+
+import glob
+import mmap
+import os
+import struct
+import time
+
+from aerial.sample import codec
+
+
+# Every record is a header (timestamp in microseconds, payload length) followed by the JSON encoded detection result.
+RECORD_HEADER = struct.Struct('<qI')
+
+# Every index entry maps the timestamp of a record to its offset in the segment file.
+INDEX_ENTRY = struct.Struct('<qQ')
+
+SEGMENT_EXTENSION = '.seg'
+INDEX_EXTENSION = '.idx'
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionRecorder:
+    """
+    Persists detection results into a directory of append-only segment files. Its record() method is to be used as the
+    detection listener. A new segment is started once the current one exceeds segment_size bytes; segments are named
+    after the timestamp of their first record, so that their names sort chronologically. Next to every segment, a
+    sparse index holds the timestamp and offset of every index_interval-th record, which lets RecordingReader seek to
+    a point in time without scanning the segment. Timestamps are taken when results are recorded and never decrease
+    within a recording. Lazily decoded results are recorded as received, without being decoded and encoded again.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, directory, segment_size = 64 * 1024 * 1024, index_interval = 256):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.records = 0
+        self.__segment = None
+        self.__index = None
+        self.__segment_records = 0
+        self.__last_timestamp = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def record(self, detection_result):
+        """
+        Appends a detection result to the current segment.
+        :param detection_result: The detection result (dictionary) to be recorded.
+        """
+        timestamp = max(int(time.time() * 1000000), self.__last_timestamp)
+        payload = codec.encode_detection(detection_result)
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        # Start a new segment if there is none yet or the current one is full
+        if self.__segment is None or self.__segment.tell() >= self.segment_size:
+            self.__open_segment(timestamp)
+
+        # Index every index_interval-th record, flushing so that the index never points past the end of the segment
+        if self.__segment_records % self.index_interval == 0:
+            offset = self.__segment.tell()
+            self.__segment.flush()
+            self.__index.write(INDEX_ENTRY.pack(timestamp, offset))
+            self.__index.flush()
+
+        self.__segment.write(RECORD_HEADER.pack(timestamp, len(payload)))
+        self.__segment.write(payload)
+        self.__segment_records += 1
+        self.__last_timestamp = timestamp
+        self.records += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        """
+        Writes buffered records of the current segment to disk.
+        """
+        if self.__segment is not None:
+            self.__segment.flush()
+            self.__index.flush()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Flushes and closes the current segment. Recording may go on afterwards in a new segment.
+        """
+        if self.__segment is not None:
+            self.__segment.close()
+            self.__index.close()
+            self.__segment = None
+            self.__index = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __open_segment(self, timestamp):
+        """
+        Closes the current segment, if any, and starts a new one named after the timestamp of its first record.
+        """
+        self.close()
+        name = os.path.join(self.directory, '{0:020d}'.format(timestamp))
+        self.__segment = open(name + SEGMENT_EXTENSION, 'ab')
+        self.__index = open(name + INDEX_EXTENSION, 'ab')
+        self.__segment_records = 0
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class RecordingReader:
+    """
+    Reads recordings made by DetectionRecorder. Segments and their indexes are memory-mapped rather than read, so
+    that any time range of a recording can be found through the index and iterated over without loading the rest.
+    Timestamps are passed and returned as seconds since the epoch, like time.time().
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = sorted(path[:-len(SEGMENT_EXTENSION)]
+                               for path in glob.glob(os.path.join(directory, '*' + SEGMENT_EXTENSION)))
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def records(self, start = None, end = None, raw = False):
+        """
+        Iterates over the recorded detection results in chronological order.
+        :param start: (Optional) The timestamp of the first result to be included.
+        :param end: (Optional) The timestamp from which on results are not included anymore.
+        :param raw: (Optional) Whether to yield the JSON encoded results instead of decoding them.
+        :return: A generator of (timestamp, detection result) tuples.
+        """
+        start_micros = int(start * 1000000) if start is not None else None
+        end_micros = int(end * 1000000) if end is not None else None
+
+        for number, name in enumerate(self.segments):
+            # Skip the segments which entirely lie outside the range, relying on their names for their first timestamp
+            first_timestamp = int(os.path.basename(name))
+            if end_micros is not None and first_timestamp >= end_micros:
+                return
+            if start_micros is not None and number + 1 < len(self.segments):
+                if int(os.path.basename(self.segments[number + 1])) < start_micros:
+                    continue
+
+            for timestamp, payload in self.__read_segment(name, start_micros):
+                if end_micros is not None and timestamp >= end_micros:
+                    return
+                yield timestamp / 1000000.0, payload if raw else codec.loads(payload)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def replay(self, listener, start = None, end = None, speed = 1.0):
+        """
+        Passes the recorded detection results to a listener, either at the pace they were recorded in (scaled by the
+        speed factor) or as fast as possible.
+        :param listener: The callback function which is called with every detection result as the sole argument.
+        :param start: (Optional) The timestamp of the first result to be replayed.
+        :param end: (Optional) The timestamp from which on results are not replayed anymore.
+        :param speed: (Optional) The replay speed relative to real time, or None to replay at maximum speed.
+        :return: The number of replayed results.
+        """
+        count = 0
+        first_timestamp = None
+        replay_start = time.time()
+        for timestamp, detection_result in self.records(start, end):
+            if speed is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                delay = (timestamp - first_timestamp) / speed - (time.time() - replay_start)
+                if delay > 0:
+                    time.sleep(delay)
+            listener(detection_result)
+            count += 1
+        return count
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __read_segment(self, name, start_micros):
+        """
+        Iterates over the (timestamp, payload) pairs of a segment, starting from the first record not earlier than the
+        start timestamp.
+        """
+        with open(name + SEGMENT_EXTENSION, 'rb') as segment_file:
+            size = os.fstat(segment_file.fileno()).st_size
+            if size == 0:
+                return
+            segment = mmap.mmap(segment_file.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            offset = 0 if start_micros is None else self.__seek(name, start_micros)
+            while offset + RECORD_HEADER.size <= size:
+                timestamp, length = RECORD_HEADER.unpack_from(segment, offset)
+                offset += RECORD_HEADER.size
+                if offset + length > size:
+                    # A record which is still being written (or was cut off by a crash) ends the segment
+                    break
+                if start_micros is None or timestamp >= start_micros:
+                    yield timestamp, segment[offset:offset + length]
+                offset += length
+        finally:
+            segment.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __seek(self, name, start_micros):
+        """
+        Finds the offset in a segment from which on to scan for the start timestamp, i.e. the offset of the last indexed
+        record which is strictly earlier than it, using a binary search over the memory-mapped index.
+        """
+        with open(name + INDEX_EXTENSION, 'rb') as index_file:
+            entries = os.fstat(index_file.fileno()).st_size // INDEX_ENTRY.size
+            if entries == 0:
+                return 0
+            index = mmap.mmap(index_file.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            low, high = 0, entries
+            while low < high:
+                middle = (low + high) // 2
+                if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[0] < start_micros:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == 0:
+                return 0
+            return INDEX_ENTRY.unpack_from(index, (low - 1) * INDEX_ENTRY.size)[1]
+        finally:
+            index.close()
\ No newline at end of file
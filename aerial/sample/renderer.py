@@ -0,0 +1,171 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Buffered, rate-limited terminal output."""
+
+
+import atexit
+import sys
+import time
+from threading import Condition, Thread, current_thread
+
+from aerial.sample import profiling
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TerminalRenderer:
+    """
+    Draws frames (complete strings, including any escape codes) in the terminal with a single buffered write each.
+    A frame identical to the one on screen is not drawn again, and frames are drawn at most max_fps times per second:
+    Frames passed to update() in between are coalesced, so that only the latest one is drawn once the interval has
+    passed. This keeps terminal output from limiting the rate at which results can be processed. Frames are written to
+    the given stream, or to the current sys.stdout if there is none. Coalesced frames are drawn by a single daemon
+    thread, started with the first of them, and a frame still pending at exit is drawn by close().
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, max_fps = 30, stream = None):
+        self.interval = 1.0 / max_fps if max_fps is not None else 0
+        self.stream = stream
+        self.drawn = 0
+        self.skipped = 0
+        self.__condition = Condition()
+        self.__last_frame = None
+        self.__last_draw = 0
+        self.__pending_frame = None
+        self.__flusher = None
+        self.__closing_at_exit = False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def update(self, frame):
+        """
+        Submits a frame to be drawn, either right away or, if a frame was drawn less than the interval ago, once the
+        interval has passed, unless another frame is submitted before.
+        :param frame: The frame to be drawn.
+        """
+        with self.__condition:
+            if self.__last_draw + self.interval <= time.time():
+                self.__pending_frame = None
+                self.__draw(frame)
+                return
+            if self.__pending_frame is not None:
+                self.skipped += 1
+            self.__pending_frame = frame
+            if self.__flusher is None:
+                self.__flusher = Thread(target = self.__run_flusher, name = 'TerminalRenderer')
+                self.__flusher.daemon = True
+                self.__flusher.start()
+                if not self.__closing_at_exit:
+                    # Stops the flusher before the interpreter's teardown, which it could otherwise still be drawing in
+                    atexit.register(self.close)
+                    self.__closing_at_exit = True
+            self.__condition.notify()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def ready(self):
+        """
+        Tells whether a frame submitted now would be drawn right away, so that composing a costly frame can be skipped
+        while it would only be coalesced.
+        """
+        return self.__last_draw + self.interval <= time.time()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def render(self, frame):
+        """
+        Draws a frame right away, regardless of the rate limit, discarding any pending frame.
+        :param frame: The frame to be drawn.
+        """
+        with self.__condition:
+            self.__pending_frame = None
+            self.__draw(frame)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write(self, text):
+        """
+        Writes text which is not a frame (e.g. the cleanup after the last frame) in one write, so that the next frame
+        is drawn even if it is identical to the last one.
+        """
+        with self.__condition:
+            self.__pending_frame = None
+            self.__last_frame = None
+            self.__write(text)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        """
+        Draws the pending frame, if any.
+        """
+        with self.__condition:
+            if self.__pending_frame is not None:
+                frame = self.__pending_frame
+                self.__pending_frame = None
+                self.__draw(frame)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Stops the flusher thread, if running, and draws the pending frame, if any. A frame submitted afterwards starts
+        a new flusher thread if needed.
+        """
+        with self.__condition:
+            flusher = self.__flusher
+            self.__flusher = None
+            self.__condition.notify()
+        if flusher is not None and flusher is not current_thread():
+            flusher.join()
+        self.flush()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __run_flusher(self):
+        """
+        Draws each pending frame once the interval since the last draw has passed, until close() is called.
+        """
+        with self.__condition:
+            while self.__flusher is current_thread():
+                if self.__pending_frame is None:
+                    self.__condition.wait()
+                    continue
+                delay = self.__last_draw + self.interval - time.time()
+                if delay > 0:
+                    self.__condition.wait(delay)
+                    continue
+                frame = self.__pending_frame
+                self.__pending_frame = None
+                self.__draw(frame)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __draw(self, frame):
+        """
+        Draws a frame unless it is already on screen. Must be called while holding the condition.
+        """
+        self.__last_draw = time.time()
+        if frame == self.__last_frame:
+            self.skipped += 1
+            return
+        self.__last_frame = frame
+        self.drawn += 1
+        span = profiling.start_span()
+        self.__write(frame)
+        profiling.end_span('render', span)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __write(self, text):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(text)
+        stream.flush()
\ No newline at end of file
@@ -21,10 +21,10 @@
 
 import sys
 import signal
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 
 from aerial.sample import utils
-from aerial.sample.application import Application
+from aerial.sample import profiling
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -44,6 +44,31 @@ def signal_handler(signal_number, stack_frame):
     sys.exit(0)
 
 
+# ---------------------------------------------------------------------------------------------------------------------
+def sink_specification(specification):
+    """
+    Argument type for sink specifications, validating them without opening any file or socket yet.
+    """
+    from aerial.sample.sinks import parse_sink
+    try:
+        parse_sink(specification)
+    except ValueError as error:
+        raise ArgumentTypeError(str(error))
+    return specification
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def training_specification(specification):
+    """
+    Argument type for training specifications, parsing them into tuples of a profile name and a number of repetitions.
+    """
+    from aerial.sample.training import parse_training
+    try:
+        return parse_training(specification)
+    except ValueError as error:
+        raise ArgumentTypeError(str(error))
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 def parse_arguments():
     """
@@ -51,17 +76,52 @@ def parse_arguments():
     user, this function responds with a brief usage help message and the description of the error.
     :return: Parsed arguments from the command line.
     """
+    # The overflow policies are imported from the dispatch module only now, since it imports tornado with it
+    from aerial.sample.dispatch import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE
     parser = ArgumentParser()
-    parser.add_argument('server', type = str, help = 'IP address of the aerial Devkit')
+    parser.add_argument('servers', metavar = 'server', type = str, nargs = '+',
+                        help = 'IP address of the aerial Devkit (several addresses are accepted for detection)')
     command_group = parser.add_mutually_exclusive_group(required = True)
     command_group.add_argument('-l', '--list', action = 'store_true', help = 'List current profiles and training sets')
     command_group.add_argument('-r', '--reset', action = 'store_true', help = 'Reset all profiles and remove all training sets.')
-    command_group.add_argument('-t', '--train', metavar = 'profile', nargs = 1, help = 'Train the specified profile')
-    command_group.add_argument('-e', '--enable', metavar = 'profile', nargs = 1, help = 'Enable the specified profile.')
-    command_group.add_argument('-d', '--disable', metavar = 'profile', nargs = 1, help = 'Disable the specified profile.')
+    command_group.add_argument('-t', '--train', metavar = 'profile[:repetitions]', type = training_specification,
+                               nargs = '+', help = 'Train the specified profiles, one after the other, each once '
+                                                   'unless the number of training sets is specified')
+    command_group.add_argument('-e', '--enable', metavar = 'profile', nargs = '+',
+                               help = 'Enable the specified profiles (names or glob patterns).')
+    command_group.add_argument('-d', '--disable', metavar = 'profile', nargs = '+',
+                               help = 'Disable the specified profiles (names or glob patterns).')
     command_group.add_argument('-dh', '--detect-home', action = 'store_true', help = 'Run home-level detection')
     command_group.add_argument('-dr', '--detect-room', action = 'store_true', help = 'Run room-level detection')
-    return parser.parse_args()
+    parser.add_argument('--reconnect', metavar = 'attempts', type = int, nargs = '?', const = 10,
+                        help = 'Re-establish a lost detection connection, with up to 10 attempts unless specified')
+    parser.add_argument('--overflow', type = str, default = OVERFLOW_BLOCK,
+                        choices = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE],
+                        help = 'What to do with detection results once the console falls behind (default: block)')
+    parser.add_argument('--record', metavar = 'directory', type = str,
+                        help = 'Record all detection results in the specified directory')
+    parser.add_argument('--sink', metavar = 'sink', type = sink_specification, action = 'append',
+                        help = 'Also forward detection results as JSON lines to stdout, file:<path>, '
+                               'udp:<host>:<port>, unix:<path> or a shared-memory ring buffer shm:<path> '
+                               '(may be repeated)')
+    parser.add_argument('--daemon', action = 'store_true',
+                        help = 'Run detection as a daemon sharing its results with other local detection commands')
+    parser.add_argument('--stats', action = 'store_true',
+                        help = 'Show live occupancy statistics (presence, dwell times, transitions) during detection')
+    parser.add_argument('--switch-delay', metavar = 'seconds', type = int, nargs = '?', const = 5, default = 0,
+                        help = 'Count down before training a different profile, for 5 seconds unless specified')
+    parser.add_argument('--reinitialize', action = 'store_true',
+                        help = 'Initialize detection again even if the session of an earlier run has not expired')
+    parser.add_argument('--metrics-port', metavar = 'port', type = int,
+                        help = 'Serve client metrics in the Prometheus text format at http://127.0.0.1:<port>/metrics')
+    arguments = parser.parse_args()
+    if len(arguments.servers) > 1 and not (arguments.detect_home or arguments.detect_room):
+        parser.error('multiple servers are only supported for detection')
+    if arguments.daemon and (len(arguments.servers) > 1 or not (arguments.detect_home or arguments.detect_room)):
+        parser.error('--daemon is only supported for detection on a single server')
+    if len(arguments.servers) > 1 and arguments.stats:
+        parser.error('--stats is only supported for a single server')
+    return arguments
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -70,20 +130,27 @@ def main():
     The main function which is the starting point for the sample application.
     """
 
-    # Print application header
-    utils.print_header('aerial Sample Application')
-
     # Configure signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGALRM, signal_handler)
+    profiling.install()
 
     # Get command line arguments
     arguments = parse_arguments()
 
-    # Create the application instance
+    # With a stdout sink, the standard output carries nothing but the detection results, so everything the application
+    # prints itself (the header, messages and errors) goes to the standard error instead
+    if arguments.sink is not None and 'stdout' in arguments.sink:
+        sys.stdout = sys.stderr
+
+    # Print application header
+    utils.print_header('aerial Sample Application')
+
+    # Create the application instance, importing it (and tornado with it) only once the arguments are valid
+    from aerial.sample.application import Application
     global app
-    app = Application(arguments.server, 80)
+    app = Application(arguments.servers[0], 80, arguments.metrics_port)
 
     # Run application methods based on the arguments specified by the user
 
@@ -94,22 +161,24 @@ def main():
         app.reset()
 
     elif arguments.train is not None:
-        profile_name = arguments.train[0]
-        app.train(profile_name)
+        app.train(arguments.train, arguments.switch_delay)
 
     elif arguments.enable is not None:
-        profile_name = arguments.enable[0]
-        app.enable(profile_name)
+        app.enable(arguments.enable)
 
     elif arguments.disable is not None:
-        profile_name = arguments.disable[0]
-        app.disable(profile_name)
-
-    elif arguments.detect_home:
-        app.detect('home')
-
-    elif arguments.detect_room:
-        app.detect('room')
+        app.disable(arguments.disable)
+
+    elif arguments.detect_home or arguments.detect_room:
+        mode = 'home' if arguments.detect_home else 'room'
+        if arguments.daemon:
+            app.run_daemon(mode, arguments.reconnect, arguments.reinitialize)
+        elif len(arguments.servers) > 1:
+            app.detect_fleet(arguments.servers, mode, arguments.reconnect, arguments.overflow, arguments.record,
+                             arguments.sink)
+        else:
+            app.detect(mode, arguments.reconnect, arguments.overflow, arguments.record, arguments.sink,
+                       arguments.stats, arguments.reinitialize)
 
     print ''
 
@@ -0,0 +1,277 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Shared-memory ring buffer handing detection results to other local processes."""
+
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from aerial.sample.codec import LazyDetectionResult
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# The file starts with a header, followed by slot_count slots of slot_size bytes. The header holds the sequence number
+# of the last result written; every slot holds a stamp, the length of the encoded result, and the result itself. The
+# stamp of a slot is twice the sequence number of its result once the result is published, and odd while a result is
+# being written, as in a seqlock: The writer stores the odd stamp, then the result, then its length, and the even
+# stamp last of all, each on its own, relying on stores becoming visible in program order (as they do on x86). All
+# stamps and sequence numbers are 8-byte aligned, so that they are read and written as a whole.
+MAGIC = 'AERIALRB'
+VERSION = 2
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+SEQUENCE_OFFSET = 24
+SEQUENCE = struct.Struct('<Q')
+STAMP = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+LENGTH_OFFSET = 8
+SLOT_HEADER_SIZE = 16
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def read_geometry(ring_map):
+    """
+    Validates the header of a mapped ring buffer.
+    :return: A tuple of the slot count and the slot size.
+    :raise ValueError: If the mapping does not hold a ring buffer of this version.
+    """
+    if len(ring_map) < HEADER_SIZE:
+        raise ValueError('Not a ring buffer')
+    magic, version, slot_count, slot_size = HEADER.unpack_from(ring_map, 0)
+    if magic != MAGIC or version != VERSION or len(ring_map) != HEADER_SIZE + slot_count * slot_size:
+        raise ValueError('Not a ring buffer of version {0}'.format(VERSION))
+    return slot_count, slot_size
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SharedRingWriter:
+    """
+    Writes encoded detection results into a ring buffer of slot_count fixed-size slots in a memory-mapped file (e.g.
+    under /dev/shm), numbering them with sequence numbers starting from 1. There must be a single writer per file; it
+    never waits for readers, but overwrites the oldest slot once the ring is full. An existing ring buffer of the same
+    geometry is continued, so that readers keep up across restarts of the writer; any other file is replaced by a new
+    one rather than resized, since resizing a file mapped by readers would crash them.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, slot_count = 4096, slot_size = 1024):
+        if slot_count < 1 or slot_size <= SLOT_HEADER_SIZE or slot_size % 8 != 0:
+            raise ValueError('Invalid ring buffer geometry: {0} slots of {1} bytes'.format(slot_count, slot_size))
+        self.path = path
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.max_result_size = slot_size - SLOT_HEADER_SIZE
+        self.map = self.__open_existing()
+        if self.map is not None:
+            self.sequence = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+        else:
+            self.map = self.__create()
+            self.sequence = 0
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write(self, result):
+        """
+        Writes an encoded result into the next slot.
+        :param result: The encoded result, a byte string of at most max_result_size bytes.
+        :return: The sequence number of the result.
+        :raise ValueError: If the result does not fit into a slot.
+        """
+        if len(result) > self.max_result_size:
+            raise ValueError('Result of {0} bytes does not fit into a slot'.format(len(result)))
+        sequence = self.sequence + 1
+        offset = HEADER_SIZE + (sequence - 1) % self.slot_count * self.slot_size
+
+        # Mark the slot as being written, so that readers do not take a half-written result for the one which was in it
+        # before, and publish the result with the even stamp once it is complete
+        STAMP.pack_into(self.map, offset, 2 * sequence - 1)
+        self.map[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + len(result)] = result
+        LENGTH.pack_into(self.map, offset + LENGTH_OFFSET, len(result))
+        STAMP.pack_into(self.map, offset, 2 * sequence)
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, sequence)
+        self.sequence = sequence
+        return sequence
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Unmaps the ring buffer. The file is left in place for the readers.
+        """
+        self.map.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __open_existing(self):
+        """
+        Maps the existing file, if there is one with a ring buffer of the same geometry.
+        :return: The mapping, or None.
+        """
+        try:
+            descriptor = os.open(self.path, os.O_RDWR)
+        except OSError:
+            return None
+        try:
+            ring_map = mmap.mmap(descriptor, 0)
+        except (mmap.error, ValueError):
+            return None
+        finally:
+            os.close(descriptor)
+        try:
+            if read_geometry(ring_map) == (self.slot_count, self.slot_size):
+                return ring_map
+        except ValueError:
+            pass
+        ring_map.close()
+        return None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __create(self):
+        """
+        Creates an empty ring buffer in a temporary file, which then replaces the file at the path.
+        :return: The mapping of the new file.
+        """
+        directory, name = os.path.split(os.path.abspath(self.path))
+        descriptor, temporary_path = tempfile.mkstemp(prefix = name + '.', dir = directory)
+        try:
+            os.fchmod(descriptor, 0644)
+            os.ftruncate(descriptor, HEADER_SIZE + self.slot_count * self.slot_size)
+            ring_map = mmap.mmap(descriptor, 0)
+            HEADER.pack_into(ring_map, 0, MAGIC, VERSION, self.slot_count, self.slot_size)
+            os.rename(temporary_path, self.path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+        finally:
+            os.close(descriptor)
+        return ring_map
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SharedRingReader:
+    """
+    Reads results from a ring buffer written by a SharedRingWriter, without locks and without affecting the writer or
+    other readers, so that any number of local processes can consume the same stream. Every slot is read optimistically
+    between two reads of its stamp, and only taken if both are the published stamp of the expected result: If the
+    writer has lapped the reader in the meantime, the results it has missed are counted in the overruns attribute and
+    reading continues from the oldest result still in the ring.
+    Reading starts with the next result to be written, or with the oldest one in the ring if from_oldest is set.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, from_oldest = False):
+        self.path = path
+        self.map = None
+        self.overruns = 0
+        self.__open(from_oldest)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __open(self, from_oldest):
+        """
+        Maps the ring buffer currently at the path, replacing the previous mapping if any.
+        """
+        with open(self.path, 'rb') as ring_file:
+            ring_map = mmap.mmap(ring_file.fileno(), 0, access = mmap.ACCESS_READ)
+            inode = os.fstat(ring_file.fileno()).st_ino
+        try:
+            self.slot_count, self.slot_size = read_geometry(ring_map)
+        except ValueError:
+            ring_map.close()
+            raise
+        if self.map is not None:
+            self.map.close()
+        self.map = ring_map
+        self.inode = inode
+        head = self.head()
+        self.next_sequence = max(1, head - self.slot_count + 1) if from_oldest else head + 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def replaced(self):
+        """
+        :return: Whether the writer has replaced the ring buffer with a new one, which is to be read from now on.
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return False
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def head(self):
+        """
+        :return: The sequence number of the last result written.
+        """
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def lag(self):
+        """
+        :return: The number of results written but not read yet.
+        """
+        return max(0, self.head() - self.next_sequence + 1)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def read(self):
+        """
+        Reads the next result, if it has been written yet.
+        :return: The encoded result as a byte string, or None if there is no new result.
+        """
+        while True:
+            head = self.head()
+            if self.next_sequence > head:
+                return None
+            if head - self.next_sequence >= self.slot_count:
+                oldest = head - self.slot_count + 1
+                self.overruns += oldest - self.next_sequence
+                self.next_sequence = oldest
+
+            offset = HEADER_SIZE + (self.next_sequence - 1) % self.slot_count * self.slot_size
+            stamp = 2 * self.next_sequence
+            if STAMP.unpack_from(self.map, offset)[0] == stamp:
+                length = LENGTH.unpack_from(self.map, offset + LENGTH_OFFSET)[0]
+                result = self.map[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length]
+                if STAMP.unpack_from(self.map, offset)[0] == stamp and length <= self.slot_size - SLOT_HEADER_SIZE:
+                    self.next_sequence += 1
+                    return result
+
+            # The slot is being or has been overwritten by a newer result, so the result is lost; start over to skip it
+            # along with everything else which has been overwritten by now
+            self.overruns += 1
+            self.next_sequence += 1
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def results(self, poll_interval = 0.005):
+        """
+        Yields the results as they are written, polling the ring buffer while it has no new result, and switching over
+        to a new ring buffer from its first result once the writer replaces it. Results are LazyDetectionResult
+        instances, which are only decoded once they are looked into.
+        :param poll_interval: (Optional) The number of seconds to sleep between two polls.
+        """
+        while True:
+            result = self.read()
+            if result is not None:
+                yield LazyDetectionResult(result)
+            elif self.replaced():
+                self.__open(from_oldest = True)
+            else:
+                time.sleep(poll_interval)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        self.map.close()
\ No newline at end of file
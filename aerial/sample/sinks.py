@@ -0,0 +1,318 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Output sinks forwarding detection results to other local systems."""
+
+
+import socket
+import sys
+from Queue import Queue, Full, Empty
+from threading import Thread, Lock
+
+from tornado.log import app_log
+
+from aerial.sample import codec, detection_stream
+from aerial.sample.shared_ring import SharedRingWriter
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class Sink:
+    """
+    Base class for sinks. Every sink has its own bounded queue and thread, so that a slow or failing sink neither
+    blocks the detection loop nor the other sinks: Once its queue is full, the oldest results are dropped. Results are
+    encoded as newline-delimited JSON and written in batches, each of which is complete once batch_size results are
+    collected or batch_interval seconds have passed since its first result. Subclasses implement write_batch().
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, batch_size = 100, batch_interval = 0.1, max_queue_size = 10000):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.__queue = Queue(max_queue_size)
+        self.__counter_lock = Lock()
+        self.__thread = Thread(target = self.__run, name = self.__class__.__name__)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def put(self, detection_result):
+        """
+        Queues a detection result to be written, dropping the oldest queued result if the queue is full. This method
+        never blocks, and is to be used as (or called by) the detection listener.
+        """
+        while True:
+            try:
+                self.__queue.put_nowait(detection_result)
+                return
+            except Full:
+                try:
+                    self.__queue.get_nowait()
+                    with self.__counter_lock:
+                        self.dropped += 1
+                except Empty:
+                    pass
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Writes the queued results and closes the sink.
+        """
+        self.__queue.put(detection_stream.END_OF_STREAM)
+        self.__thread.join()
+        self.release()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        """
+        :return: A dictionary with the numbers of written and dropped results, failed batches and queued results.
+        """
+        with self.__counter_lock:
+            return {
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'depth': self.__queue.qsize()
+            }
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        """
+        Writes a batch of encoded results.
+        :param lines: The list of JSON documents (strings without line breaks), one per result.
+        """
+        raise NotImplementedError()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self):
+        """
+        Releases the resources of the sink (files, sockets) once it is closed.
+        """
+        pass
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __run(self):
+        """
+        The loop run by the thread of the sink, writing batches until the sink is closed.
+        """
+        for batch in detection_stream.iterate(self.__queue, self.batch_size, self.batch_interval):
+            lines = [codec.encode_detection(detection_result) for detection_result in batch]
+            try:
+                self.write_batch([line.encode('utf-8') if isinstance(line, unicode) else line for line in lines])
+            except Exception:
+                app_log.exception('Exception in %s', self.__class__.__name__)
+                with self.__counter_lock:
+                    self.errors += 1
+            else:
+                with self.__counter_lock:
+                    self.written += len(batch)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class NdjsonFileSink(Sink):
+    """
+    Appends results to a file, one JSON document per line.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.file = open(path, 'ab')
+        Sink.__init__(self, **kwargs)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self):
+        self.file.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class StdoutSink(Sink):
+    """
+    Writes results to the standard output of the process, one JSON document per line. The results are written to
+    sys.__stdout__ rather than sys.stdout, so that the application can send its own console output elsewhere (see
+    sample.main()) without sending the results along with it.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        sys.__stdout__.write('\n'.join(lines) + '\n')
+        sys.__stdout__.flush()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class UdpSink(Sink):
+    """
+    Sends results as UDP datagrams, packing as many newline-delimited documents into every datagram as fit into
+    max_datagram_size bytes. A single document larger than that is sent in a datagram of its own.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, host, port, max_datagram_size = 1400, **kwargs):
+        self.address = (host, port)
+        self.max_datagram_size = max_datagram_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        Sink.__init__(self, **kwargs)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        datagram = []
+        size = 0
+        for line in lines:
+            if size > 0 and size + len(line) + 1 > self.max_datagram_size:
+                self.socket.sendto('\n'.join(datagram) + '\n', self.address)
+                datagram = []
+                size = 0
+            datagram.append(line)
+            size += len(line) + 1
+        if size > 0:
+            self.socket.sendto('\n'.join(datagram) + '\n', self.address)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self):
+        self.socket.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class UnixSocketSink(Sink):
+    """
+    Streams results to a Unix domain socket, one JSON document per line. The connection is (re-)established for the
+    next batch whenever it is missing or broken; a batch which cannot be written is counted as an error.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.socket = None
+        Sink.__init__(self, **kwargs)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.socket.connect(self.path)
+            except socket.error:
+                self.release()
+                raise
+        try:
+            self.socket.sendall('\n'.join(lines) + '\n')
+        except socket.error:
+            self.release()
+            raise
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SharedRingSink(Sink):
+    """
+    Writes results into a shared-memory ring buffer (see the shared_ring module), from which any number of local
+    processes can read them with a SharedRingReader. Results which do not fit into a slot are skipped, and counted in
+    the oversized attribute. Batches are kept short, since readers poll the ring buffer anyway.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, slot_count = 4096, slot_size = 1024, batch_interval = 0.01, **kwargs):
+        self.writer = SharedRingWriter(path, slot_count, slot_size)
+        self.oversized = 0
+        Sink.__init__(self, batch_interval = batch_interval, **kwargs)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def write_batch(self, lines):
+        for line in lines:
+            if len(line) > self.writer.max_result_size:
+                self.oversized += 1
+            else:
+                self.writer.write(line)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def release(self):
+        self.writer.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SinkGroup:
+    """
+    Fans detection results out to several sinks. Its put() method is to be used as the detection listener.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def put(self, detection_result):
+        for sink in self.sinks:
+            sink.put(detection_result)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        """
+        :return: A list of (sink, statistics) pairs.
+        """
+        return [(sink, sink.stats()) for sink in self.sinks]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def parse_sink(specification):
+    """
+    Parses a command line sink specification: 'stdout', 'file:<path>', 'udp:<host>:<port>', 'unix:<path>' or
+    'shm:<path>'.
+    :return: A tuple of the sink class and the arguments of its constructor.
+    :raise ValueError: If the specification is not valid.
+    """
+    kind, _, target = specification.partition(':')
+    if kind == 'stdout' and target == '':
+        return StdoutSink, ()
+    elif kind == 'file' and target != '':
+        return NdjsonFileSink, (target,)
+    elif kind == 'unix' and target != '':
+        return UnixSocketSink, (target,)
+    elif kind == 'shm' and target != '':
+        return SharedRingSink, (target,)
+    elif kind == 'udp':
+        host, _, port = target.rpartition(':')
+        if host != '' and port.isdigit():
+            return UdpSink, (host, int(port))
+    raise ValueError('Invalid sink: {0}'.format(specification))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def create_sink(specification):
+    """
+    Creates a sink from a command line specification (see parse_sink()).
+    """
+    sink_class, args = parse_sink(specification)
+    return sink_class(*args)
\ No newline at end of file
@@ -0,0 +1,187 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+"""Scheduling of training sessions for several profiles."""
+
+
+import socket
+import time
+
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
+
+from aerial.sample.api_wrapper import AerialException
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+RECORDING_DURATION = 45 # The number of seconds the DevKit takes to record a training set, as shown in the progress
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def parse_training(specification):
+    """
+    Parses a command line training specification: '<profile>' or '<profile>:<repetitions>'.
+    :return: A tuple of the profile name and the number of training sets to be recorded for it.
+    :raise ValueError: If the specification is not valid.
+    """
+    name, separator, repetitions = specification.rpartition(':')
+    if separator == '' and specification != '':
+        return specification, 1
+    if name != '' and repetitions.isdigit() and int(repetitions) > 0:
+        return name, int(repetitions)
+    raise ValueError('Invalid training session: {0}'.format(specification))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TrainingSession:
+    """
+    The recording of a single training set, which is the given repetition (starting from 1) out of the given number
+    of repetitions for its profile. Once it is run, it holds the times its turn came (scheduled_time), the recording
+    started and ended, and either the training set or the error it has failed with.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, profile_name, repetition, repetitions):
+        self.profile_name = profile_name
+        self.repetition = repetition
+        self.repetitions = repetitions
+        self.scheduled_time = None
+        self.start_time = None
+        self.end_time = None
+        self.training_set = None
+        self.error = None
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def label(self):
+        """
+        :return: The name of the profile, along with the repetition if there are several.
+        """
+        if self.repetitions == 1:
+            return self.profile_name
+        return '{0} ({1}/{2})'.format(self.profile_name, self.repetition, self.repetitions)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def wait_duration(self):
+        """
+        :return: The number of seconds between the turn of the session and the start of its recording.
+        """
+        return self.start_time - self.scheduled_time
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def recording_duration(self):
+        """
+        :return: The number of seconds the recording took, until the training set was added or the request failed.
+        """
+        return self.end_time - self.start_time
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TrainingScheduler:
+    """
+    Records training sets for several profiles, each a number of times, one after the other on an IOLoop. The first
+    recording starts after a countdown of delay seconds, so that the user can get ready for it; every further one starts
+    as soon as the previous training set is added, with no dead time in between, unless switch_delay is set: A recording
+    for a different profile than the one before then starts after a countdown of switch_delay seconds, so that the next
+    person can step in. Sessions are advanced by the completion of the training requests themselves, and a failed
+    session does not stop the ones after it; its error is kept as an AerialException, whatever it has been raised as.
+    The listener is called with a dictionary describing every event: 'countdown' (with the 'remaining' seconds) and
+    'recording' (with the 'elapsed' seconds and the expected 'duration'), repeated every tick seconds, and 'finished' or
+    'failed' once the training set is added or the request fails. Every event carries its TrainingSession under the
+    'session' key.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self, async_wrapper, trainings, delay = 5, switch_delay = 0, listener = None, tick = 1):
+        self.async_wrapper = async_wrapper
+        self.sessions = [TrainingSession(profile_name, repetition, repetitions)
+                         for profile_name, repetitions in trainings for repetition in range(1, repetitions + 1)]
+        self.delay = delay
+        self.switch_delay = switch_delay
+        self.listener = listener
+        self.tick = tick
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def run(self):
+        """
+        Runs all sessions. Must be called on the IOLoop of the asynchronous API wrapper.
+        :return: A Future resolving to the list of TrainingSession instances once all of them are finished.
+        """
+        previous = None
+        for session in self.sessions:
+            session.scheduled_time = time.time()
+            if previous is None:
+                delay = self.delay
+            elif previous.profile_name != session.profile_name:
+                delay = self.switch_delay
+            else:
+                delay = 0
+            if delay > 0:
+                yield self.__count_down(session, delay)
+            yield self.__record(session)
+            previous = session
+        raise gen.Return(self.sessions)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __count_down(self, session, delay):
+        """
+        Waits for the countdown before a session, reporting the remaining time every tick.
+        """
+        deadline = time.time() + delay
+        remaining = delay
+        while remaining > 0:
+            self.__emit('countdown', session, remaining = remaining)
+            yield gen.sleep(min(self.tick, remaining))
+            remaining = deadline - time.time()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def __record(self, session):
+        """
+        Records the training set of a session, reporting the elapsed time every tick until the request is complete.
+        """
+        session.start_time = time.time()
+        emit_progress = lambda: self.__emit('recording', session, elapsed = time.time() - session.start_time,
+                                            duration = RECORDING_DURATION)
+        ticker = PeriodicCallback(emit_progress, self.tick * 1000)
+        emit_progress()
+        ticker.start()
+        try:
+            session.training_set = yield self.async_wrapper.train(session.profile_name)
+        except AerialException as error:
+            session.error = error
+        except socket.error as error:
+            session.error = AerialException('socket_error', '{0}.'.format(error.strerror))
+        except Exception as error:
+            session.error = AerialException('unknown_error', '{0}.'.format(error))
+        finally:
+            ticker.stop()
+            session.end_time = time.time()
+        self.__emit('failed' if session.error is not None else 'finished', session)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __emit(self, event, session, **details):
+        """
+        Passes an event, described by a dictionary, to the listener if there is any.
+        """
+        if self.listener is not None:
+            details['event'] = event
+            details['session'] = session
+            self.listener(details)
\ No newline at end of file
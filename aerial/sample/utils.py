@@ -20,22 +20,83 @@
 """aerial sample application utility functions."""
 
 
-from dateutil import parser, tz
-import subprocess
-import time
-from termcolor import colored
+import calendar
+import math
+import os
+import re
+import struct
+import sys
+from datetime import datetime
+
+from aerial.sample.renderer import TerminalRenderer
 
 
 DATETIME_FORMAT_FULL = 0
 DATETIME_FORMAT_TIME = 1
 
+DATETIME_FORMAT_STRINGS = {
+    DATETIME_FORMAT_FULL: '%Y-%m-%d  %I:%M:%S %p',
+    DATETIME_FORMAT_TIME: '%I:%M:%S %p'
+}
+
+# ISO-8601 dates as returned by the API, e.g. '2016-05-01T10:00:00.000Z'. Like the general parser path, the fast path
+# ignores any UTC offset and treats the date as UTC.
+ISO_DATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?$')
+
+# Formatted dates by (date, format), which are cleared once full.
+DATETIME_CACHE_SIZE = 4096
+datetime_cache = {}
+
+CURSOR_UP_ONE = '\x1b[1A'
+ERASE_LINE = '\x1b[2K'
+
+# Detection results are drawn at a limited rate, coalescing the ones in between; the frame for every distinct result
+# is composed only once. The timers are drawn once per second anyway, but in one write per step.
+detection_renderer = TerminalRenderer(max_fps = 30)
+detection_frames = {}
+DETECTION_FRAMES_SIZE = 256
+timer_renderer = TerminalRenderer(max_fps = None)
+
+# Live occupancy statistics are composed from a snapshot, so they are redrawn less often, and only when due.
+occupancy_renderer = TerminalRenderer(max_fps = 4)
+OCCUPANCY_PROFILES = 5
+
+DEFAULT_TERMINAL_WIDTH = 60
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def colored(text, color = None, on_color = None, attrs = None):
+    """
+    Colors text for the terminal with termcolor, which is only imported once something is printed.
+    """
+    from termcolor import colored as termcolor_colored
+    return termcolor_colored(text, color, on_color, attrs)
+
+
 # ---------------------------------------------------------------------------------------------------------------------
-try:
-    # Try to capture the width of the terminal (the number of available columns).
-    terminal_width = int(subprocess.check_output(['stty', 'size']).split()[1])
-except Exception:
-    # If it fails for any reason, including being run on Windows, assume a default value.
-    terminal_width = 60
+def terminal_width():
+    """
+    Captures the width of the terminal (the number of available columns) by asking the terminal driver directly, which
+    is cheap enough to be done whenever something is drawn, so that a resized terminal is taken into account.
+    :return: The width of the terminal attached to the standard output (or input), otherwise the COLUMNS environment
+             variable, or a default value if neither is available, including on Windows.
+    """
+    try:
+        import fcntl
+        import termios
+        for stream in (sys.stdout, sys.stdin):
+            try:
+                columns = struct.unpack('hhhh', fcntl.ioctl(stream.fileno(), termios.TIOCGWINSZ, '\0' * 8))[1]
+            except Exception:
+                continue
+            if columns > 0:
+                return columns
+    except ImportError:
+        pass
+    try:
+        return int(os.environ['COLUMNS'])
+    except (KeyError, ValueError):
+        return DEFAULT_TERMINAL_WIDTH
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -49,22 +110,87 @@ def print_profile(profile):
     else:
         status = 'Disabled'
     print colored('{0:15}{1:>8}'.format(profile['name'], status), 'magenta', attrs=['bold', 'underline'])
-    for training_set in profile['trainingSets']:
-        print format_datetime(training_set['date'])
+    dates = format_datetimes([training_set['date'] for training_set in profile['trainingSets']])
+    if len(dates) > 0:
+        print '\n'.join(dates)
     print ''
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 def print_detection(detection_result):
     """
-    Pretty-prints a detection result in the console.
+    Pretty-prints a detection result in the console. The console is redrawn at most 30 times per second; results
+    received in between are coalesced, so that the latest one is shown.
+    :param detection_result: The detection result (dictionary) to be displayed.
+    """
+    key = (detection_result['results'], terminal_width())
+    frame = detection_frames.get(key, None)
+    if frame is None:
+        text = colored(('{:^' + str(key[1]) + '}').format(key[0]), None, attrs=['bold'])
+        frame = ERASE_LINE + text + CURSOR_UP_ONE + '\n'
+        if len(detection_frames) >= DETECTION_FRAMES_SIZE:
+            detection_frames.clear()
+        detection_frames[key] = frame
+    detection_renderer.update(frame)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def print_occupancy(detection_result, analytics):
+    """
+    Pretty-prints the latest detection result in the console along with live occupancy statistics: how long the
+    detected profile has been present, the number of transitions, and the share of the time and the mean dwell time of
+    the most present profiles over the sliding window. The console is redrawn at most 4 times per second; the
+    statistics are not even computed for the results received in between.
     :param detection_result: The detection result (dictionary) to be displayed.
+    :param analytics: The OccupancyAnalytics instance fed with the detection results.
+    """
+    if not occupancy_renderer.ready():
+        return
+    width = terminal_width()
+    snapshot = analytics.snapshot()
+    window = snapshot['window']
+    transitions = sum(sum(targets.values()) for targets in window['transitions'].values())
+    lines = [
+        colored(('{:^' + str(width) + '}').format(detection_result['results']), None, attrs=['bold']),
+        colored('Present for {0:.0f}s; {1} transitions in the last {2:.0f} minutes'.format(
+            snapshot['dwell'], transitions, window['length'] / 60.0), 'yellow')
+    ]
+    ranking = sorted(window['presence_ratio'].items(), key = lambda item: -item[1])[:OCCUPANCY_PROFILES]
+    for name, ratio in ranking:
+        dwell = window['dwell'].get(name, None)
+        dwell_text = 'mean stay {0:.1f}s'.format(dwell) if dwell is not None else ''
+        lines.append('{0:15}{1:>5.0%}  {2}'.format(name, ratio, dwell_text))
+    lines.extend([''] * (OCCUPANCY_PROFILES + 2 - len(lines)))
+    frame = ''.join(ERASE_LINE + line + '\n' for line in lines[:-1]) + ERASE_LINE + lines[-1]
+    occupancy_renderer.update(frame + CURSOR_UP_ONE * len(lines) + '\n')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def print_fleet_detection(detection_result):
+    """
+    Prints a detection result received from one of several DevKits in the console, as a line of its own prefixed with
+    the address of the DevKit.
+    :param detection_result: The detection result (dictionary) to be displayed, tagged with its source server.
+    """
+    print colored('{0:>15}  '.format(detection_result['server']), 'magenta') + detection_result['results']
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def print_connection_event(event):
+    """
+    Prints a detection connection event (a lost connection, a reconnection attempt, etc.) in the console.
+    :param event: The event (dictionary) to be displayed.
     """
-    cursor_up_one = '\x1b[1A'
     erase_line = '\x1b[2K'
-    result = detection_result['results']
-    text = colored(('{:^' + str(terminal_width) + '}').format(result), None, attrs=['bold'])
-    print erase_line + text + cursor_up_one
+    text = {
+        'disconnected': 'Connection with {server} lost.',
+        'reconnecting': 'Reconnecting to {server} in {delay:.1f}s (attempt {attempt})...',
+        'reinitialized': 'Detection session on {server} expired and was re-initialized.',
+        'reconnected': 'Reconnected to {server}; no results were received for {gap:.1f}s.',
+        'gave_up': 'Giving up reconnecting to {server} after {attempts} attempts.',
+        'failed': 'Detection on {server} stopped: {error}'
+    }[event['event']].format(**event)
+    print erase_line + colored(text, 'yellow')
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -73,11 +199,12 @@ def print_header(title):
     Print the application header.
     :param title: Title of the application to be printed in the header.
     """
-    text = ('{:^' + str(terminal_width) + '}').format(title)
-    print colored(' ' * (terminal_width), None, attrs=['underline', 'dark'])
-    print colored(' ' * (terminal_width), None, 'on_grey')
+    width = terminal_width()
+    text = ('{:^' + str(width) + '}').format(title)
+    print colored(' ' * (width), None, attrs=['underline', 'dark'])
+    print colored(' ' * (width), None, 'on_grey')
     print colored(text, None, 'on_grey')
-    print colored(' ' * (terminal_width), None, 'on_grey', attrs=['underline', 'dark'])
+    print colored(' ' * (width), None, 'on_grey', attrs=['underline', 'dark'])
     print ''
 
 
@@ -91,14 +218,42 @@ def format_datetime(naive_date, format = DATETIME_FORMAT_FULL):
     :return: The string representing the date in the local timezone.
     """
 
-    format_string = {
-        DATETIME_FORMAT_FULL: '%Y-%m-%d  %I:%M:%S %p',
-        DATETIME_FORMAT_TIME: '%I:%M:%S %p'
-    }[format]
+    key = (naive_date, format)
+    formatted = datetime_cache.get(key, None)
+    if formatted is not None:
+        return formatted
+
+    # Convert plain ISO-8601 dates through the epoch, and leave anything else to the general parser
+    match = ISO_DATETIME.match(naive_date)
+    if match is not None:
+        timestamp = calendar.timegm(tuple(int(field) for field in match.groups()))
+        local_date = datetime.fromtimestamp(timestamp)
+    else:
+        # dateutil is only imported once a date needs it, as it is not needed otherwise
+        from dateutil import parser, tz
+        local_date = parser.parse(naive_date).replace(tzinfo = tz.tzutc()).astimezone(tz.tzlocal())
+    formatted = local_date.strftime(DATETIME_FORMAT_STRINGS[format])
+
+    if len(datetime_cache) >= DATETIME_CACHE_SIZE:
+        datetime_cache.clear()
+    datetime_cache[key] = formatted
+    return formatted
 
-    return parser.parse(naive_date)\
-        .replace(tzinfo = tz.tzutc()).astimezone(tz.tzlocal())\
-        .strftime(format_string)
+
+# ---------------------------------------------------------------------------------------------------------------------
+def format_datetimes(naive_dates, format = DATETIME_FORMAT_FULL):
+    """
+    Formats a list of naive UTC datetime strings at once, e.g. the dates of all training sets of a profile. Dates which
+    occur several times in the list are formatted only once.
+    :param naive_dates: The list of naive datetime strings to be formatted.
+    :param format: (Optional) The string format, one of the utils module's DATETIME_FORMAT_* constants.
+    :return: The list of strings representing the dates in the local timezone, in the same order.
+    """
+    formatted = {}
+    for naive_date in naive_dates:
+        if naive_date not in formatted:
+            formatted[naive_date] = format_datetime(naive_date, format)
+    return [formatted[naive_date] for naive_date in naive_dates]
 
 # ---------------------------------------------------------------------------------------------------------------------
 def print_api_error(aerial_exception):
@@ -111,55 +266,77 @@ def print_api_error(aerial_exception):
 
 
 # ---------------------------------------------------------------------------------------------------------------------
-def print_delay(delay):
+def print_status_report(profile_names, failures, enabled):
     """
-    Displays a countdown timer for recording new training sets, and blocks while the countdown is in progress.
-    :param delay: Countdown duration in seconds.
+    Prints the outcome of changing the enabled status of several profiles: An error for every failed profile, followed
+    by a summary.
+    :param profile_names: The names of all profiles, in the order to be reported.
+    :param failures: A dictionary mapping the name of every failed profile to its AerialException instance.
+    :param enabled: The desired enabled status of the profiles.
     """
-    def __text(step, duration):
-        return 'Recording starts in {0:02d}:{1:02d}'.format(step / 60, step % 60)
-    __timer(delay, __text)
+    status = 'enabled' if enabled else 'disabled'
+    for name in profile_names:
+        if name in failures:
+            error_type = failures[name].type.replace('_', ' ').upper()
+            print colored('[' + error_type + '] ', 'red', attrs=['bold']) + name + ': ' + failures[name].message
+    succeeded = len(profile_names) - len(failures)
+    if len(profile_names) == 1 and succeeded == 1:
+        print 'Profile {0} is {1}.'.format(profile_names[0], status)
+    elif len(profile_names) > 1:
+        print '{0} of {1} profiles {2}, {3} failed.'.format(succeeded, len(profile_names), status, len(failures))
 
 
 # ---------------------------------------------------------------------------------------------------------------------
-def print_timer(duration, task = None):
+def print_training_event(event):
     """
-    Displays a timer with a pre-defined duration. This method accepts an optional "task" argument which should be a
-    Future instance representing the background task to be finished. If the task is finished at any point in time, the
-    timer is not displayed anymore. This function blocks while the timer is being displayed.
-    :param duration: Duration of the timer.
-    :param task: The Future instance representing the background task.
+    Displays the progress of a training session (see training.TrainingScheduler): a countdown before the recording
+    starts, a progress bar while recording, and the date of the training set once it is added, or the error.
+    :param event: The event (dictionary) to be displayed.
     """
-    def __text(step, duration):
-        width = terminal_width - 18
-        progress = float(duration - step) / duration
+    session = event['session']
+    if event['event'] == 'countdown':
+        step = int(math.ceil(event['remaining']))
+        text = 'Recording {0} starts in {1:02d}:{2:02d}'.format(session.label(), step / 60, step % 60)
+    elif event['event'] == 'recording':
+        step = int(math.ceil(max(0, event['duration'] - event['elapsed'])))
+        label = session.label()
+        width = max(terminal_width() - 19 - len(label), 1)
+        progress = min(event['elapsed'] / event['duration'], 1)
         filled_width = int(round(progress * width))
-        full = colored(' ', None, 'on_white') * filled_width
-        empty = colored(' ', None, 'on_grey') * (width - filled_width)
-        return 'Recording {2}{3} {0:02d}:{1:02d}'.format(step / 60, step % 60, full, empty)
-    __timer(duration, __text, task)
+        full = colored(' ' * filled_width, None, 'on_white') if filled_width > 0 else ''
+        empty = colored(' ' * (width - filled_width), None, 'on_grey') if filled_width < width else ''
+        text = 'Recording {0} {3}{4} {1:02d}:{2:02d}'.format(label, step / 60, step % 60, full, empty)
+    else:
+        # Clean the timer up and report the outcome
+        timer_renderer.write(ERASE_LINE + CURSOR_UP_ONE + '\n')
+        if session.error is not None:
+            print_api_error(session.error)
+        elif session.training_set is not None:
+            print 'Training set added for profile "{0}" [{1}].'.format(
+                session.profile_name, format_datetime(session.training_set['date']))
+        return
+
+    # Draw the timer and move the cursor back to its line in one write
+    timer_renderer.render(ERASE_LINE + text + '\n' + CURSOR_UP_ONE + CURSOR_UP_ONE + '\n')
 
 
 # ---------------------------------------------------------------------------------------------------------------------
-def __timer(duration, text_generator, task = None):
+def print_training_summary(sessions):
     """
-    Displays a timer in the console and blocks while it's running.
-    :param duration: Total duration for the timer.
-    :param text_generator: The function that generates the custom timer display text.
-    :param task: (Optional) A future which represents the background task. If specified, this function returns when the
-                 task is finished or the specified duration has passed, whichever happens first.
+    Prints how long every training session waited for its recording to start and how long the recording took, followed
+    by the totals. Nothing is printed for a single session, whose outcome has been printed already.
+    :param sessions: The list of TrainingSession instances which have been run.
     """
-
-    cursor_up_one = '\x1b[1A'
-    erase_line = '\x1b[2K'
-
-    # The countdown loop
-    for step in range(duration, 0, -1):
-        print erase_line + text_generator(step, duration)
-        time.sleep(1)
-        print cursor_up_one + cursor_up_one
-        if task is not None and not task.running():
-            break
-
-    # Cleanup
-    print erase_line + cursor_up_one
\ No newline at end of file
+    if len(sessions) < 2:
+        return
+    print ''
+    print colored('{0:<30}{1:>10}{2:>12}  {3}'.format('Session', 'Wait', 'Recording', 'Result'), None,
+                  attrs=['bold', 'underline'])
+    for session in sessions:
+        result = 'added' if session.error is None else colored('failed', 'red')
+        print '{0:<30}{1:>9.1f}s{2:>11.1f}s  {3}'.format(session.label(), session.wait_duration(),
+                                                         session.recording_duration(), result)
+    added = len([session for session in sessions if session.error is None])
+    total = sessions[-1].end_time - sessions[0].scheduled_time
+    print ''
+    print '{0} of {1} training sets added in {2:.1f}s.'.format(added, len(sessions), total)
\ No newline at end of file
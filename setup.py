@@ -30,7 +30,6 @@ setup(
     name                = 'aerial-sample',
     version             = '1.0.0',
     author              = 'aerial.ai',
-    namespace_packages  = ['aerial'],
     packages            = find_packages(),
 
     package_data        = {
@@ -40,7 +39,9 @@ setup(
     install_requires    = ['termcolor', 'tornado', 'python-dateutil'],
 
     entry_points        = {
-        'console_scripts': ['aerial-sample = aerial.sample.sample:main']
+        'console_scripts': ['aerial-sample = aerial.sample.sample:main',
+                            'aerial-benchmark = aerial.sample.benchmark:main',
+                            'aerial-devkit-stub = aerial.sample.devkit_stub:main']
     }
 
 )
\ No newline at end of file
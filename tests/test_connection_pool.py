@@ -0,0 +1,109 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the keep-alive HTTP client."""
+
+
+import socket
+import unittest
+from threading import Thread
+
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from aerial.sample.connection_pool import ConnectionPool, KeepAliveHTTPClient
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class ForgetfulServer:
+    """
+    An HTTP server which answers every GET request, but closes the connection without responding once it has received
+    a POST request, as if the connection had failed after the request was acted on. The methods received are kept in
+    order.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.methods = []
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        thread = Thread(target = self.__accept)
+        thread.daemon = True
+        thread.start()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __accept(self):
+        while True:
+            connection = self.listener.accept()[0]
+            thread = Thread(target = self.__serve, args = (connection,))
+            thread.daemon = True
+            thread.start()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __serve(self, connection):
+        buffered = ''
+        try:
+            while True:
+                data = connection.recv(65536)
+                if data == '':
+                    return
+                buffered += data
+                while '\r\n\r\n' in buffered:
+                    head, buffered = buffered.split('\r\n\r\n', 1)
+                    method = head.split(' ', 1)[0]
+                    self.methods.append(method)
+                    if method == 'POST':
+                        return
+                    connection.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        finally:
+            connection.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class KeepAliveHTTPClientTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_failed_post_is_not_sent_again(self):
+        server = ForgetfulServer()
+        url = 'http://127.0.0.1:{0}/'.format(server.port)
+        io_loop = IOLoop(make_current = False)
+
+        @gen.coroutine
+        def __exchange():
+            client = KeepAliveHTTPClient(force_instance = True, pool = ConnectionPool())
+            first = yield client.fetch(url + 'profiles/', raise_error = False)
+            second = yield client.fetch(HTTPRequest(url + 'profiles/alice', method = 'POST', body = ''),
+                                        raise_error = False)
+            client.close()
+            raise gen.Return((first.code, second.code))
+
+        try:
+            self.assertEqual(io_loop.run_sync(__exchange), (200, 599))
+        finally:
+            io_loop.close()
+        self.assertEqual(server.methods, ['GET', 'POST'])
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,81 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the detection fleet."""
+
+
+import signal
+import time
+import unittest
+
+from aerial.sample.devkit_stub import DevKitStub
+from aerial.sample.fleet import DetectionFleet
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class DetectionFleetTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.alarms = []
+        self.alarm_handler = signal.signal(signal.SIGALRM, lambda signal_number, stack_frame: self.alarms.append(1))
+        self.stubs = [DevKitStub(rate = 50), DevKitStub(rate = 50)]
+        port = self.stubs[0].start(0, '127.0.0.1')
+        self.stubs[1].start(port, '127.0.0.2')
+        self.fleet = DetectionFleet(['127.0.0.1', '127.0.0.2'], port)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.stop()
+        self.fleet.close()
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, self.alarm_handler)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_lost_devkit_does_not_stop_the_others(self):
+        self.fleet.initialize('room')
+        counts = {}
+        events = []
+
+        def __listener(detection_result):
+            counts[detection_result['server']] = counts.get(detection_result['server'], 0) + 1
+
+        loop_thread = self.fleet.detect(__listener, event_listener = events.append)
+        time.sleep(0.5)
+        self.stubs[1].stop()
+        time.sleep(0.5)
+        received = counts.get('127.0.0.1', 0)
+        time.sleep(0.5)
+        self.fleet.stop()
+        loop_thread.join(5)
+
+        self.assertFalse(loop_thread.is_alive())
+        self.assertGreater(counts.get('127.0.0.1', 0), received)
+        self.assertEqual(self.fleet.errors.keys(), ['127.0.0.2'])
+        self.assertEqual(self.fleet.errors['127.0.0.2'].type, 'connection_lost')
+        self.assertEqual([(event['event'], event['server']) for event in events], [('failed', '127.0.0.2')])
+        time.sleep(1.5)
+        self.assertEqual(self.alarms, [])
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
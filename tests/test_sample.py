@@ -0,0 +1,90 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the command line of the sample application."""
+
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+# Runs the sample application with the given arguments in a fresh interpreter, against a DevKit stub instead of a DevKit
+# on port 80, and terminates it after a second as Ctrl+C would
+SAMPLE_SCRIPT = '''
+import os, signal, sys, threading
+from aerial.sample import application, sample
+from aerial.sample.devkit_stub import DevKitStub
+stub_port = DevKitStub(rate = 20).start()
+Application = application.Application
+class StubApplication(Application):
+    def __init__(self, server, port, metrics_port = None):
+        Application.__init__(self, server, stub_port, metrics_port)
+application.Application = StubApplication
+threading.Timer(1, lambda: os.kill(os.getpid(), signal.SIGTERM)).start()
+sys.argv = ['sample'] + {0!r}
+sample.main()
+'''
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SampleTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.cache_home = tempfile.mkdtemp()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.cache_home)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def run_sample(self, arguments):
+        """
+        :return: The standard output and the standard error of the sample application run with the given arguments.
+        """
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment['XDG_CACHE_HOME'] = self.cache_home
+        process = subprocess.Popen([sys.executable, '-c', SAMPLE_SCRIPT.format(arguments)], env = environment,
+                                   stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        output, errors = process.communicate()
+        self.assertEqual(process.returncode, 0, errors)
+        return output, errors
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_stdout_sink_gets_the_standard_output_to_itself(self):
+        output, errors = self.run_sample(['-dr', '--sink', 'stdout', '127.0.0.1'])
+        lines = output.splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            self.assertIn('results', json.loads(line))
+        self.assertIn('aerial Sample Application', errors)
+        self.assertIn('Detection is about to begin', errors)
+        self.assertIn('Shutting down...', errors)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
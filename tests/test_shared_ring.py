@@ -0,0 +1,108 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the shared-memory ring buffer."""
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from aerial.sample.shared_ring import SharedRingReader, SharedRingWriter
+
+
+# The number of records written by the concurrent writer
+RECORDS = 200000
+
+# Writes the records in a process of its own, as fast as possible, so that the reader is lapped again and again
+WRITER = '''
+import sys
+from aerial.sample.shared_ring import SharedRingWriter
+from test_shared_ring import record
+writer = SharedRingWriter(sys.argv[1], slot_count = 16, slot_size = 128)
+for number in xrange(1, int(sys.argv[2]) + 1):
+    writer.write(record(number))
+'''
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def record(number):
+    """
+    :return: The record with the given number, whose length and contents both depend on the number, so that a record
+             pieced together from two writes does not match the number it starts with.
+    """
+    return '{0:08d}'.format(number) + chr(ord('a') + number % 26) * (number % 97)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class SharedRingTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ring')
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_lapped_reader_counts_overruns(self):
+        writer = SharedRingWriter(self.path, slot_count = 8, slot_size = 64)
+        reader = SharedRingReader(self.path)
+        for number in xrange(1, 21):
+            writer.write(record(number))
+        self.assertEqual(reader.read(), record(13))
+        self.assertEqual(reader.overruns, 12)
+        self.assertEqual(reader.lag(), 7)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_concurrent_reads_are_never_torn(self):
+        SharedRingWriter(self.path, slot_count = 16, slot_size = 128).close()
+        reader = SharedRingReader(self.path)
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                     os.path.dirname(os.path.abspath(__file__))])
+        writer = subprocess.Popen([sys.executable, '-c', WRITER, self.path, str(RECORDS)], env = environment)
+
+        # Every record read must be intact and newer than the previous one, and the records either read or overrun
+        # must add up to the ones written
+        received = 0
+        last = 0
+        while writer.poll() is None or reader.lag() > 0:
+            result = reader.read()
+            if result is None:
+                continue
+            number = int(result[:8])
+            self.assertEqual(result, record(number))
+            self.assertGreater(number, last)
+            last = number
+            received += 1
+        self.assertEqual(writer.returncode, 0)
+        self.assertEqual(received + reader.overruns, RECORDS)
+        self.assertGreater(received, 0)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,113 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the startup cost of the sample application."""
+
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+# The maximum median time, in seconds, the sample application may take to be ready for the first request of a command
+# listing the profiles, and the number of fresh interpreters to take the median over
+STARTUP_BUDGET = 0.15
+STARTUP_RUNS = 5
+
+# Modules which must not be imported until a command needs them
+DEFERRED_MODULES = ['dateutil', 'termcolor', 'pkg_resources', 'tornado.web', 'tornado.websocket',
+                    'aerial.sample.metrics', 'aerial.sample.daemon', 'aerial.sample.fleet', 'aerial.sample.training',
+                    'aerial.sample.recorder', 'aerial.sample.sinks', 'aerial.sample.shared_ring',
+                    'aerial.sample.analytics']
+
+# Goes through the startup of the sample application for the --list command in a fresh interpreter, i.e. imports its
+# main module and the application module (as benchmark.STARTUP_MODULES) and parses the command line, recording any
+# attempt at starting another process, and prints the time taken, the deferred modules imported and the
+# process-starting functions called
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+spawned = []
+def record(name):
+    function = getattr(os, name)
+    def recorded(*arguments, **keywords):
+        spawned.append(name)
+        return function(*arguments, **keywords)
+    setattr(os, name, recorded)
+for name in ('fork', 'forkpty', 'popen', 'popen2', 'popen3', 'popen4', 'system', 'spawnv', 'spawnve', 'execv',
+             'execve'):
+    if hasattr(os, name):
+        record(name)
+sys.argv = ['sample', '--list', '127.0.0.1']
+start = time.time()
+import aerial.sample.sample, aerial.sample.application
+aerial.sample.sample.parse_arguments()
+seconds = time.time() - start
+print json.dumps({{
+    'seconds': seconds,
+    'imported': [module for module in {0!r} if module in sys.modules],
+    'spawned': spawned
+}})
+'''
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+def start_listing():
+    """
+    Starts the sample application for the --list command in a fresh interpreter, up to its first request.
+    :return: A dictionary with the startup time in 'seconds', the deferred modules 'imported' and the names of the os
+             functions called to start another process ('spawned').
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT.format(DEFERRED_MODULES)],
+                                     env = environment)
+    return json.loads(output)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class StartupTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+        cls.runs = [start_listing() for _ in range(STARTUP_RUNS)]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_deferred_modules_are_not_imported(self):
+        for run in self.runs:
+            self.assertEqual(run['imported'], [])
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_no_process_is_started(self):
+        for run in self.runs:
+            self.assertEqual(run['spawned'], [])
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_startup_time_is_within_budget(self):
+        seconds = sorted(run['seconds'] for run in self.runs)[len(self.runs) // 2]
+        self.assertLessEqual(seconds, STARTUP_BUDGET, 'Starting to list the profiles took {0:.3f}s (budget: {1:.3f}s)'
+                             .format(seconds, STARTUP_BUDGET))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
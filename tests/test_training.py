@@ -0,0 +1,81 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#
+# Copyright (C) 2016 aerial
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+"""Tests of the training scheduler."""
+
+
+import sys
+import unittest
+from StringIO import StringIO
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from aerial.sample import utils
+from aerial.sample.training import TrainingScheduler
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class EmptyResponseWrapper:
+    """
+    Stands in for AsyncApiWrapper, adding training sets whose response has an empty body.
+    """
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        self.trained = []
+
+    # -----------------------------------------------------------------------------------------------------------------
+    @gen.coroutine
+    def train(self, profile_name):
+        self.trained.append(profile_name)
+        raise gen.Return(None)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+class TrainingSchedulerTest(unittest.TestCase):
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.io_loop = IOLoop(make_current = False)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.io_loop.close()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    def test_empty_training_response(self):
+        async_wrapper = EmptyResponseWrapper()
+        scheduler = TrainingScheduler(async_wrapper, [('alice', 2), ('bob', 1)], delay = 0,
+                                      listener = utils.print_training_event)
+        sessions = self.io_loop.run_sync(scheduler.run)
+        utils.print_training_summary(sessions)
+        self.assertEqual(async_wrapper.trained, ['alice', 'alice', 'bob'])
+        self.assertEqual([session.error for session in sessions], [None, None, None])
+        self.assertEqual([session.training_set for session in sessions], [None, None, None])
+        self.assertNotIn('Training set added', sys.stdout.getvalue())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file